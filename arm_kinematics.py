@@ -0,0 +1,165 @@
+import math
+import time
+from array import array
+
+# Inverse kinematics for the shoulder/elbow chain of the arm, in the arm's
+# vertical plane: x forward from the shoulder axis, y up, millimetres.
+#
+# Servo conventions (matching the firmware's named moves): shoulder 0 points
+# the upper arm forward, 90 straight up, 180 backwards; elbow 180 is the arm
+# stretched out ("expand_elbow") and smaller angles fold the forearm down
+# towards 0 ("close_elbow"). The link lengths below are the printed arm's;
+# pass an ArmGeometry for another build.
+
+UPPER_ARM_MM = 105.0
+FOREARM_MM = 125.0
+MIN_HEIGHT_MM = -40.0  # Table surface relative to the shoulder axis; elbow and tip stay above it
+
+GRID_MM = 4.0          # Cell size of the reachability grid
+UNREACHABLE = 255      # Grid marker; joint angles are stored as whole degrees 0-180
+TOLERANCE_MM = 0.5     # Refined solutions further than this from the target are rejected
+
+
+class ArmGeometry:
+    def __init__(self, upper_arm_mm=UPPER_ARM_MM, forearm_mm=FOREARM_MM, min_height_mm=MIN_HEIGHT_MM,
+                 shoulder_range=(0, 180), elbow_range=(0, 180)):
+        self.upper_arm = upper_arm_mm
+        self.forearm = forearm_mm
+        self.min_height = min_height_mm
+        self.shoulder_range = shoulder_range
+        self.elbow_range = elbow_range
+
+    def forward(self, shoulder, elbow):
+        # Servo degrees -> (elbow x, elbow y), (tip x, tip y)
+        a1 = math.radians(shoulder)
+        a2 = a1 - math.radians(180 - elbow)
+        ex, ey = self.upper_arm * math.cos(a1), self.upper_arm * math.sin(a1)
+        return (ex, ey), (ex + self.forearm * math.cos(a2), ey + self.forearm * math.sin(a2))
+
+    def clamp(self, shoulder, elbow):
+        return (min(max(shoulder, self.shoulder_range[0]), self.shoulder_range[1]),
+                min(max(elbow, self.elbow_range[0]), self.elbow_range[1]))
+
+    def allowed(self, shoulder, elbow):
+        if not (self.shoulder_range[0] <= shoulder <= self.shoulder_range[1]
+                and self.elbow_range[0] <= elbow <= self.elbow_range[1]):
+            return False
+        (_, elbow_y), (_, tip_y) = self.forward(shoulder, elbow)
+        return elbow_y >= self.min_height and tip_y >= self.min_height
+
+    def solve(self, x, y):
+        # Closed-form two-link solution. Only the "elbow folded down" branch
+        # exists within the elbow's 0-180 range, so there is no branch choice.
+        l1, l2 = self.upper_arm, self.forearm
+        cos_fold = (x * x + y * y - l1 * l1 - l2 * l2) / (2 * l1 * l2)
+        if not -1 <= cos_fold <= 1:
+            return None
+        q2 = -math.acos(cos_fold)
+        q1 = math.atan2(y, x) - math.atan2(l2 * math.sin(q2), l1 + l2 * math.cos(q2))
+        shoulder = math.degrees(q1) % 360
+        if shoulder > 270:
+            shoulder -= 360  # Just below horizontal is a small negative angle, not ~359
+        return shoulder, 180 + math.degrees(q2)
+
+
+# Precomputed IK over a square grid around the shoulder. Each cell stores the
+# whole-degree shoulder and elbow angles for its centre (one byte each,
+# UNREACHABLE where the joint limits or the table forbid it), so a query is an
+# index computation plus a few Newton steps from that seed to the exact target.
+# The default 4 mm grid over a 230 mm reach is about 27 KB.
+class ReachabilityGrid:
+    def __init__(self, geometry=None, cell_mm=GRID_MM):
+        self.geometry = geometry or ArmGeometry()
+        self.cell = cell_mm
+        self.reach = self.geometry.upper_arm + self.geometry.forearm
+        self.size = int(math.ceil(2 * self.reach / cell_mm)) + 1
+        self.origin = -(self.size - 1) * cell_mm / 2
+        self.shoulder = array('B', [UNREACHABLE]) * (self.size * self.size)
+        self.elbow = array('B', [UNREACHABLE]) * (self.size * self.size)
+        started = time.perf_counter()
+        self._build()
+        self.build_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    def _build(self):
+        geometry = self.geometry
+        for row in range(self.size):
+            y = self.origin + row * self.cell
+            for col in range(self.size):
+                x = self.origin + col * self.cell
+                solution = geometry.solve(x, y)
+                if solution is None:
+                    continue
+                # Cells just past a joint limit keep the clamped pose as a seed
+                # if it still lands within the cell
+                shoulder, elbow = (round(angle) for angle in geometry.clamp(*solution))
+                tip_x, tip_y = geometry.forward(shoulder, elbow)[1]
+                if geometry.allowed(shoulder, elbow) and math.hypot(tip_x - x, tip_y - y) <= self.cell:
+                    self.shoulder[row * self.size + col] = shoulder
+                    self.elbow[row * self.size + col] = elbow
+
+    def _seed(self, x, y):
+        # The target's own cell, or the first reachable neighbour for targets
+        # on the edge of the workspace
+        col = int(round((x - self.origin) / self.cell))
+        row = int(round((y - self.origin) / self.cell))
+        for d_row, d_col in ((0, 0), (0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)):
+            r, c = row + d_row, col + d_col
+            if 0 <= r < self.size and 0 <= c < self.size:
+                index = r * self.size + c
+                if self.shoulder[index] != UNREACHABLE:
+                    return self.shoulder[index], self.elbow[index]
+        return None
+
+    def reachable(self, x, y):
+        return self._seed(x, y) is not None
+
+    def solve(self, x, y, iterations=4):
+        # Returns {"shoulder", "elbow", "error_mm"} in degrees, or None when the
+        # target is outside the workspace
+        seed = self._seed(x, y)
+        if seed is None:
+            return None
+        l1, l2 = self.geometry.upper_arm, self.geometry.forearm
+        q1 = math.radians(seed[0])
+        q2 = math.radians(seed[1] - 180)
+        for _ in range(iterations):
+            c1, s1 = math.cos(q1), math.sin(q1)
+            c12, s12 = math.cos(q1 + q2), math.sin(q1 + q2)
+            dx = x - (l1 * c1 + l2 * c12)
+            dy = y - (l1 * s1 + l2 * s12)
+            if dx * dx + dy * dy < 1e-4:
+                break  # Within 0.01 mm
+            det = l1 * l2 * math.sin(q2)
+            if abs(det) < 1e-6:
+                break  # Arm stretched out or folded flat, the Jacobian is singular
+            # Newton step with the inverse of the 2x2 Jacobian
+            q1 += (l2 * c12 * dx + l2 * s12 * dy) / det
+            q2 += (-(l1 * c1 + l2 * c12) * dx - (l1 * s1 + l2 * s12) * dy) / det
+        solution = self._check(x, y, math.degrees(q1), 180 + math.degrees(q2))
+        if solution is None:
+            # Newton does not converge next to the singular poses; the closed
+            # form handles those
+            closed_form = self.geometry.solve(x, y)
+            if closed_form is not None:
+                solution = self._check(x, y, *closed_form)
+        return solution
+
+    def _check(self, x, y, shoulder, elbow):
+        shoulder, elbow = self.geometry.clamp(shoulder, elbow)
+        if not self.geometry.allowed(shoulder, elbow):
+            return None
+        tip_x, tip_y = self.geometry.forward(shoulder, elbow)[1]
+        error = math.hypot(tip_x - x, tip_y - y)
+        if error > TOLERANCE_MM:
+            return None
+        return {"shoulder": round(shoulder, 2), "elbow": round(elbow, 2), "error_mm": round(error, 3)}
+
+    def to_dict(self):
+        return {
+            "cell_mm": self.cell,
+            "size": self.size,
+            "reach_mm": self.reach,
+            "reachable_cells": sum(1 for angle in self.shoulder if angle != UNREACHABLE),
+            "bytes": len(self.shoulder) * self.shoulder.itemsize + len(self.elbow) * self.elbow.itemsize,
+            "build_ms": self.build_ms,
+        }
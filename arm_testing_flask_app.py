@@ -1,73 +1,261 @@
-from flask import Flask, render_template, redirect, url_for, flash
-import requests
+import time
 
-app = Flask(__name__)
-app.secret_key = 'robotic_arm_control'  # Necessary for flash messages
+from flask import Flask, Blueprint, render_template, redirect, url_for, flash, request, jsonify, g
 
-ESP32_SERVER_IP = '192.168.43.79'  # Replace with your ESP32 server IP address
+import services
+from arm_trajectory import Trajectory, scaled_limits, stream
+from fleet import PRIORITY_STOP, command_priority, make_fleet_blueprint
+from latency import RequestTrace, make_latency_blueprint
+from session_log import make_session_blueprint
+
+# Arm routes live on a blueprint so the gateway can host them next to the car and camera
+arm = Blueprint('arm', __name__)
+ARM_ID = 'arm-1'  # Arm the buttons control unless a request names another one
+
+JOINTS = ('shoulder', 'elbow', 'gripper')
+
+# Firmware commands and the word their success message contains
+ARM_COMMANDS = {
+    'move_shoulder_up': 'moved',
+    'move_shoulder_down': 'moved',
+    'expand_elbow': 'expanded',
+    'close_elbow': 'closed',
+    'open_gripper': 'opened',
+    'close_gripper': 'closed',
+    'expand_arm': 'expanded',
+    'close_arm': 'closed',
+    'cancel': 'cancelled',  # Stops the running motions where they are, nothing is latched
+    'stop': 'stopped',    # Cancels the running motion on the board
+    'halt': 'halted',     # Stop and refuse motion until resume
+    'resume': 'resumed',
+}
+
+@arm.before_request
+def start_trace():
+    # The browser may send its own X-Request-Id so a click can be followed end to end
+    g.trace = RequestTrace(request.headers.get('X-Request-Id'))
 
 def send_command_to_esp32(command):
-    url = f'http://{ESP32_SERVER_IP}:8080/{command}'
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"message": "Failed to execute command"}
-    except requests.exceptions.RequestException as e:
-        return {"message": str(e)}
-
-@app.route('/')
+    # Every command goes through the fleet layer; ?device=<id> targets another arm.
+    # The result carries the per-hop timings under "trace".
+    g.trace.dispatch()
+    result = services.get_fleet().send(request.args.get('device', ARM_ID), command, request_id=g.trace.id)
+    result['trace'] = g.trace.complete(command.split('?')[0], result.get('trace'))
+    group = 'stop' if command_priority(command) == PRIORITY_STOP else 'arm'
+    services.get_latency().record(group, result['trace'])
+    return result
+
+def parse_step_text(item):
+    fields = item.strip().split(':')
+    if len(fields) < 2:
+        raise ValueError(f"Invalid step: {item}")
+    return {"joint": fields[0], "angle": fields[1], "duration_ms": fields[2] if len(fields) > 2 else 0}
+
+def parse_steps(steps):
+    # Accepts a list of {"joint", "angle", "duration_ms"} dicts or the compact
+    # "joint:angle[:duration_ms]" text form (one step per line or comma
+    # separated), also as the items of a list
+    if isinstance(steps, str):
+        steps = [item for item in steps.replace('\n', ',').split(',') if item.strip()]
+
+    parsed = []
+    for step in steps:
+        if isinstance(step, str):
+            step = parse_step_text(step)
+        elif not isinstance(step, dict):
+            raise ValueError(f"Invalid step: {step}")
+        joint = step.get('joint')
+        angle = int(step.get('angle'))
+        duration_ms = int(step.get('duration_ms') or 0)
+        if joint not in JOINTS:
+            raise ValueError(f"Unknown joint: {joint}")
+        if not 0 <= angle <= 180 or duration_ms < 0:
+            raise ValueError(f"Step out of range: {step}")
+        parsed.append({"joint": joint, "angle": angle, "duration_ms": duration_ms})
+    if not parsed:
+        raise ValueError("Sequence is empty")
+    return parsed
+
+def encode_steps(steps):
+    # Compact wire format understood by the firmware: "shoulder:180:500,elbow:90:0"
+    return ','.join(f"{step['joint']}:{step['angle']}:{step['duration_ms']}" for step in steps)
+
+def respond(result, keyword):
+    # JSON clients get the raw result, the HTML interface gets a flash message
+    if request.is_json:
+        return jsonify(dict(result, ok=keyword in result['message']))
+    flash(result['message'], 'success' if keyword in result['message'] else 'danger')
+    return redirect(url_for('.index'))
+
+def request_data():
+    return request.get_json(silent=True) or request.form
+
+@arm.route('/')
 def index():
     return render_template('arm_interface.html')
 
-@app.route('/move_shoulder_up')
+@arm.route('/move_shoulder_up')
 def move_shoulder_up():
     result = send_command_to_esp32('move_shoulder_up')
     flash(result['message'], 'success' if 'moved' in result['message'] else 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/move_shoulder_down')
+@arm.route('/move_shoulder_down')
 def move_shoulder_down():
     result = send_command_to_esp32('move_shoulder_down')
     flash(result['message'], 'success' if 'moved' in result['message'] else 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/expand_elbow')
+@arm.route('/expand_elbow')
 def expand_elbow():
     result = send_command_to_esp32('expand_elbow')
     flash(result['message'], 'success' if 'expanded' in result['message'] else 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/close_elbow')
+@arm.route('/close_elbow')
 def close_elbow():
     result = send_command_to_esp32('close_elbow')
     flash(result['message'], 'success' if 'closed' in result['message'] else 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/open_gripper')
+@arm.route('/open_gripper')
 def open_gripper():
     result = send_command_to_esp32('open_gripper')
     flash(result['message'], 'success' if 'opened' in result['message'] else 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/close_gripper')
+@arm.route('/close_gripper')
 def close_gripper():
     result = send_command_to_esp32('close_gripper')
     flash(result['message'], 'success' if 'closed' in result['message'] else 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/expand_arm')
+@arm.route('/expand_arm')
 def expand_arm():
     result = send_command_to_esp32('expand_arm')
     flash(result['message'], 'success' if 'expanded' in result['message'] else 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/close_arm')
+@arm.route('/close_arm')
 def close_arm():
     result = send_command_to_esp32('close_arm')
     flash(result['message'], 'success' if 'closed' in result['message'] else 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
+
+@arm.route('/api/arm/<command>', methods=['POST'])
+def arm_command(command):
+    if command not in ARM_COMMANDS:
+        return jsonify({"message": "Unknown command", "ok": False}), 404
+    result = send_command_to_esp32(command)
+    return jsonify(dict(result, ok=ARM_COMMANDS[command] in result['message']))
+
+@arm.route('/api/arm/status', methods=['GET'])
+def arm_status():
+    # Per joint angle, target and moving flag, plus the motions in progress;
+    # answered by the board while a move is running. Polls are queries, so they
+    # stay out of recorded sessions.
+    result = services.get_fleet().send(request.args.get('device', ARM_ID), 'status', record=False)
+    return jsonify(dict(result, ok='joints' in result))
+
+def move_to(target, speed):
+    # Plans a coordinated move from the arm's current angles to target and
+    # streams it to the board
+    device_id = request.args.get('device', ARM_ID)
+    fleet = services.get_fleet()
+    state = fleet.send(device_id, 'state', record=False)  # A query; the trajectory is recorded
+    if 'angles' not in state:
+        return jsonify(dict(state, ok=False)), 502
+    try:
+        plan = Trajectory(state['angles'], target, scaled_limits(speed))
+    except ValueError as e:
+        return jsonify({"message": str(e), "ok": False}), 400
+    g.trace.dispatch()
+    result = stream(fleet, device_id, plan, request_id=g.trace.id)
+    result['trace'] = g.trace.complete('trajectory', result.get('trace'))
+    services.get_latency().record('arm', result['trace'])
+    return jsonify(dict(result, plan=plan.to_dict(), ok='executed' in result['message']))
+
+@arm.route('/api/arm/trajectory', methods=['POST'])
+def run_trajectory():
+    # {"shoulder": 120, "elbow": 90, "gripper": 40, "speed": 0.5} moves the given
+    # joints together along a planned trajectory; joints left out hold still
+    data = request_data()
+    try:
+        target = {joint: int(data[joint]) for joint in JOINTS if data.get(joint) not in (None, '')}
+        speed = float(data.get('speed') or 1)
+    except (TypeError, ValueError) as e:
+        return jsonify({"message": str(e), "ok": False}), 400
+    return move_to(target, speed)
+
+@arm.route('/api/arm/ik', methods=['GET'])
+def inverse_kinematics():
+    # Joint angles that put the gripper at (x, y) mm in the arm's plane; cheap
+    # enough (~10 us) to call for every camera frame
+    x, y = request.args.get('x', type=float), request.args.get('y', type=float)
+    if x is None or y is None:
+        return jsonify({"message": "x and y are required", "ok": False}), 400
+    kinematics = services.get_kinematics()
+    started = time.perf_counter()
+    solution = kinematics.solve(x, y)
+    solve_us = round((time.perf_counter() - started) * 1000000, 1)
+    if solution is None:
+        return jsonify({"message": "Target out of reach", "ok": False, "solve_us": solve_us})
+    return jsonify(dict(solution, message="Target reachable", ok=True, solve_us=solve_us))
+
+@arm.route('/api/arm/reach', methods=['POST'])
+def reach():
+    # {"x": 120, "y": 60, "gripper": 35, "speed": 0.5}: moves the gripper to
+    # (x, y) mm along a planned trajectory
+    data = request_data()
+    try:
+        x, y = float(data['x']), float(data['y'])
+        speed = float(data.get('speed') or 1)
+        gripper = int(data['gripper']) if data.get('gripper') not in (None, '') else None
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"message": f"Invalid target: {e}", "ok": False}), 400
+    solution = services.get_kinematics().solve(x, y)
+    if solution is None:
+        return jsonify({"message": "Target out of reach", "ok": False}), 422
+    target = {"shoulder": solution['shoulder'], "elbow": solution['elbow']}
+    if gripper is not None:
+        target['gripper'] = gripper
+    return move_to(target, speed)
+
+@arm.route('/sequence', methods=['POST'])
+def run_sequence():
+    try:
+        steps = parse_steps(request_data().get('steps', ''))
+    except (TypeError, ValueError) as e:
+        return respond({"message": str(e)}, 'executed')
+    result = send_command_to_esp32(f'sequence?steps={encode_steps(steps)}')
+    return respond(result, 'executed')
+
+@arm.route('/macros', methods=['POST'])
+def save_macro():
+    data = request_data()
+    name = data.get('name', '')
+    if not name.replace('_', '').replace('-', '').isalnum():
+        return respond({"message": "Macro names may only contain letters, digits, '-' and '_'"}, 'saved')
+    try:
+        steps = parse_steps(data.get('steps', ''))
+    except (TypeError, ValueError) as e:
+        return respond({"message": str(e)}, 'saved')
+    result = send_command_to_esp32(f'save_macro?name={name}&steps={encode_steps(steps)}')
+    return respond(result, 'saved')
+
+@arm.route('/macros/<name>/run', methods=['POST'])
+def run_macro(name):
+    result = send_command_to_esp32(f'run_macro?name={name}')
+    return respond(result, 'executed')
+
+def create_app():
+    app = Flask(__name__)
+    app.secret_key = 'robotic_arm_control'  # Necessary for flash messages
+    app.register_blueprint(arm)
+    app.register_blueprint(make_fleet_blueprint(services.get_fleet, services.get_latency))
+    app.register_blueprint(make_latency_blueprint(services.get_latency))
+    app.register_blueprint(make_session_blueprint(services.get_fleet, services.get_telemetry, services.open_teleop))
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
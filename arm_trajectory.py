@@ -0,0 +1,146 @@
+import binascii
+import math
+
+# Host-side joint trajectories for the arm. A move of several joints is
+# planned here as one time-parameterised trapezoidal velocity profile per
+# joint, all stretched to the same duration so shoulder, elbow and gripper
+# start and stop together. The board only replays the result: one waypoint of
+# three PWM duties every WAYPOINT_MS (see /trajectory in the firmware).
+
+JOINTS = ('shoulder', 'elbow', 'gripper')
+
+# Duty range of RoboticArm.angle_to_duty on the board
+MIN_DUTY = 40
+MAX_DUTY = 115
+
+WAYPOINT_MS = 20       # Player period on the board, same as the old servo step
+BATCH_WAYPOINTS = 25   # Waypoints per /trajectory request (0.5 s of motion)
+
+# Velocity (deg/s) and acceleration (deg/s^2) limits per joint. These are
+# gentler than SERVO_LIMITS, the defaults for the firmware's own moves.
+JOINT_LIMITS = {
+    'shoulder': (150.0, 600.0),
+    'elbow': (180.0, 720.0),
+    'gripper': (120.0, 600.0),
+}
+
+
+def angle_to_duty(angle):
+    # Same mapping (and truncation) as RoboticArm.angle_to_duty
+    return int(MIN_DUTY + (angle / 180) * (MAX_DUTY - MIN_DUTY))
+
+
+def scaled_limits(speed, limits=JOINT_LIMITS):
+    # speed in (0, 1] slows every joint down; acceleration scales with the
+    # square so the shape of the profile stays the same
+    if not 0 < speed <= 1:
+        raise ValueError("Speed must be in (0, 1]")
+    return {joint: (velocity * speed, acceleration * speed ** 2)
+            for joint, (velocity, acceleration) in limits.items()}
+
+
+def min_duration(distance, max_velocity, max_acceleration):
+    # Shortest profile: a triangle when the joint never reaches max_velocity,
+    # otherwise ramp up, cruise, ramp down
+    if distance <= max_velocity ** 2 / max_acceleration:
+        return 2 * math.sqrt(distance / max_acceleration)
+    return distance / max_velocity + max_velocity / max_acceleration
+
+
+# Trapezoidal profile covering start -> target in exactly duration seconds with
+# max_acceleration ramps. The cruise velocity v solves distance = v * (T - v / a).
+class JointProfile:
+    def __init__(self, start, target, duration, max_acceleration):
+        self.start = start
+        self.target = target
+        self.duration = duration
+        self.acceleration = max_acceleration
+        distance = abs(target - start)
+        if distance == 0 or duration == 0:
+            self.velocity = 0.0
+            self.ramp = 0.0
+        else:
+            a, t = max_acceleration, duration
+            self.velocity = (a * t - math.sqrt(max(0.0, (a * t) ** 2 - 4 * a * distance))) / 2
+            self.ramp = self.velocity / a
+
+    def position(self, t):
+        if t >= self.duration or self.velocity == 0:
+            return float(self.target)
+        if t <= 0:
+            return float(self.start)
+        a, v, ramp = self.acceleration, self.velocity, self.ramp
+        if t < ramp:
+            travelled = a * t * t / 2
+        elif t <= self.duration - ramp:
+            travelled = v * ramp / 2 + v * (t - ramp)
+        else:
+            remaining = self.duration - t
+            travelled = abs(self.target - self.start) - a * remaining * remaining / 2
+        return self.start + math.copysign(travelled, self.target - self.start)
+
+
+class Trajectory:
+    def __init__(self, start, target, limits=JOINT_LIMITS, period_ms=WAYPOINT_MS):
+        # start and target map joint -> angle (degrees, 0-180); joints missing
+        # from target keep their start angle
+        self.period_ms = period_ms
+        self.start = {joint: float(start[joint]) for joint in JOINTS}
+        self.target = {joint: float(target.get(joint, start[joint])) for joint in JOINTS}
+        for joint in JOINTS:
+            if not 0 <= self.target[joint] <= 180:
+                raise ValueError(f"{joint} angle out of range: {self.target[joint]}")
+
+        # The slowest joint sets the duration, rounded up to whole waypoints;
+        # the others are slowed down to finish with it
+        slowest = max(min_duration(abs(self.target[joint] - self.start[joint]), *limits[joint])
+                      for joint in JOINTS)
+        self.steps = max(1, math.ceil(slowest * 1000 / period_ms - 1e-9))
+        self.duration = self.steps * period_ms / 1000
+        self.profiles = {joint: JointProfile(self.start[joint], self.target[joint], self.duration, limits[joint][1])
+                         for joint in JOINTS}
+
+    def angles(self, t):
+        return {joint: profile.position(t) for joint, profile in self.profiles.items()}
+
+    def waypoints(self):
+        # One (shoulder, elbow, gripper) duty tuple per period, ending on the target
+        period = self.period_ms / 1000
+        return [tuple(angle_to_duty(self.profiles[joint].position(step * period)) for joint in JOINTS)
+                for step in range(1, self.steps + 1)]
+
+    def batches(self, size=BATCH_WAYPOINTS):
+        # (seq, hex payload, last) per request; 3 bytes per waypoint
+        waypoints = self.waypoints()
+        chunks = [waypoints[i:i + size] for i in range(0, len(waypoints), size)]
+        return [(seq, binascii.hexlify(bytes(duty for waypoint in chunk for duty in waypoint)).decode(),
+                 seq == len(chunks) - 1)
+                for seq, chunk in enumerate(chunks)]
+
+    def to_dict(self):
+        return {
+            "duration_ms": round(self.duration * 1000),
+            "period_ms": self.period_ms,
+            "waypoints": self.steps,
+            "target": {joint: round(angle) for joint, angle in self.target.items()},
+            "peak_velocity": {joint: round(profile.velocity, 1) for joint, profile in self.profiles.items()},
+        }
+
+
+def stream(fleet, device_id, trajectory, request_id=None, batch_size=BATCH_WAYPOINTS):
+    # Sends the batches in order. The board answers early batches at once and
+    # holds a request while its buffer is full, so the loop is paced by the
+    # player; the last batch is answered when the arm has arrived. The target
+    # angles and the request id go with the last batch, whose firmware timings
+    # cover the playback.
+    result = {"message": "Trajectory is empty"}
+    for seq, payload, last in trajectory.batches(batch_size):
+        params = {'seq': seq, 'dt': trajectory.period_ms, 'w': payload}
+        if last:
+            params['end'] = 1
+            params['a'] = binascii.hexlify(bytes(round(trajectory.target[joint]) for joint in JOINTS)).decode()
+        result = fleet.send(device_id, 'trajectory', params, request_id=request_id if last else None)
+        result['batches'] = seq + 1
+        if last or 'queued' not in result['message']:
+            break
+    return result
@@ -0,0 +1,227 @@
+import codecs
+import json
+import math
+import re
+import socket
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit, urlencode
+
+# Older firmware serialises float('inf') as a bare "inf", which is not valid JSON
+INF_TOKEN = re.compile(r'(?<![A-Za-z"])(-?)inf(?![A-Za-z"])')
+MAX_BUFFER = 64 * 1024
+
+
+# A /move the board refused (400 invalid direction, 423 halted, ...) instead
+# of starting a stream
+class CommandRefused(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Incremental parser for the car's /move response stream. Handles the NDJSON
+# form (one header, one JSON sample per line) as well as the legacy form that
+# repeats "HTTP/1.1 200 OK" + headers in front of every JSON sample.
+class TelemetryParser:
+    def __init__(self):
+        self.buffer = ''
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.status = None  # HTTP status of the first header block
+
+    def feed(self, data):
+        self.buffer = INF_TOKEN.sub(r'\1Infinity', self.buffer + self.text.decode(data))
+        samples = []
+        while True:
+            self.buffer = self.buffer.lstrip()
+            if not self.buffer or 'HTTP/'.startswith(self.buffer):
+                break
+
+            # Header block: skip it once it is complete
+            if self.buffer.startswith('HTTP/'):
+                end = self.buffer.find('\r\n\r\n')
+                if end < 0:
+                    break
+                if self.status is None:
+                    fields = self.buffer.split(None, 2)
+                    self.status = int(fields[1]) if len(fields) > 1 and fields[1].isdigit() else 0
+                self.buffer = self.buffer[end + 4:]
+                if self.status != 200:
+                    break  # The rest is the board's reason, not telemetry
+                continue
+
+            try:
+                sample, end = self.decoder.raw_decode(self.buffer)
+            except ValueError:
+                # Either an incomplete sample (wait for more data) or garbage
+                # (drop everything up to the next line or header)
+                boundary = min((i for i in (self.buffer.find('\n'), self.buffer.find('HTTP/', 1)) if i > 0), default=-1)
+                if boundary < 0:
+                    if len(self.buffer) > MAX_BUFFER:
+                        self.buffer = ''
+                    break
+                self.buffer = self.buffer[boundary:]
+                continue
+
+            self.buffer = self.buffer[end:]
+            if isinstance(sample, dict):
+                samples.append(sample)
+        return samples
+
+
+# Keeps the car's telemetry stream open in a background thread and the most
+# recent samples in a fixed-size ring buffer. Readers only take a lock and copy,
+# so request threads never wait on the network.
+class CarTelemetry:
+    def __init__(self, url, history=600, connect_timeout=2, read_timeout=5, store=None, device='car'):
+        self.url = url
+        self.store = store  # Optional TelemetryStore that keeps the long-term history
+        self.device = device
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.samples = deque(maxlen=history)  # 600 samples = one minute at 100 ms
+        self.lock = threading.Lock()
+        self.sock = None
+        self.generation = 0
+        self.connected = False
+        self.error = None
+
+    def command(self, direction, speed, wait=1.0, request_id=None):
+        # The firmware starts streaming in response to /move, so every new command
+        # replaces the current stream. Returns the first sample of the new stream,
+        # which carries the firmware's timings when request_id is given.
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            old_sock, self.sock = self.sock, None
+        if old_sock is not None:
+            self._close(old_sock)
+
+        first = threading.Event()
+        outcome = {}
+        threading.Thread(target=self._stream, args=(generation, direction, speed, request_id, first, outcome), daemon=True).start()
+        if not first.wait(wait):
+            raise TimeoutError('No telemetry received from the car')
+        if 'refused' in outcome:
+            raise CommandRefused(*outcome['refused'])
+        if 'error' in outcome:
+            raise ConnectionError(outcome['error'])
+        return outcome['sample']
+
+    def _stream(self, generation, direction, speed, request_id, first, outcome):
+        parts = urlsplit(self.url)
+        query = {'direction': direction, 'speed': speed}
+        if request_id is not None:
+            query['rid'] = request_id
+        path = f"{parts.path or '/move'}?{urlencode(query)}"
+        try:
+            sock = socket.create_connection((parts.hostname, parts.port or 80), timeout=self.connect_timeout)
+            sock.settimeout(self.read_timeout)
+            sock.sendall(f'GET {path} HTTP/1.1\r\nHost: {parts.hostname}\r\n\r\n'.encode())
+        except OSError as e:
+            outcome['error'] = self.error = str(e)
+            first.set()
+            return
+
+        with self.lock:
+            if generation != self.generation:
+                self._close(sock)
+                return
+            self.sock = sock
+            self.connected = True
+            self.error = None
+
+        parser = TelemetryParser()
+        try:
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                samples = parser.feed(data)
+                if parser.status not in (None, 200):
+                    outcome['refused'] = (parser.status, self._reason(sock, parser.buffer))
+                    first.set()
+                    break
+                for sample in samples:
+                    sample = self.record(sample)
+                    if not first.is_set():
+                        outcome['sample'] = sample
+                        first.set()
+        except OSError as e:
+            with self.lock:
+                if generation == self.generation:
+                    self.error = str(e)
+        finally:
+            with self.lock:
+                if generation == self.generation:
+                    self.connected = False
+                    self.sock = None
+            self._close(sock)
+            if not first.is_set():
+                outcome['error'] = self.error or 'Telemetry stream closed'
+                first.set()
+
+    def record(self, sample):
+        # "No echo" distances become null so the samples stay valid JSON for the UI
+        sample = {key: None if isinstance(value, float) and not math.isfinite(value) else value
+                  for key, value in sample.items()}
+        sample['ts'] = time.time()
+        with self.lock:
+            self.samples.append(sample)
+        if self.store is not None:
+            self.store.append(self.device, sample, sample['ts'])
+        return sample
+
+    def latest(self):
+        with self.lock:
+            return self.samples[-1] if self.samples else None
+
+    def history(self, limit=None, since=None):
+        with self.lock:
+            samples = list(self.samples)
+        if since is not None:
+            samples = [sample for sample in samples if sample['ts'] > since]
+        if limit is not None:
+            samples = samples[-limit:]
+        return samples
+
+    def snapshot(self, limit=None, since=None):
+        return {
+            "connected": self.connected,
+            "error": self.error,
+            "latest": self.latest(),
+            "history": self.history(limit, since),
+        }
+
+    def close(self):
+        with self.lock:
+            self.generation += 1
+            sock, self.sock = self.sock, None
+            self.connected = False
+        if sock is not None:
+            self._close(sock)
+
+    @staticmethod
+    def _reason(sock, body):
+        # The board closes the connection after an error reply
+        data = b''
+        try:
+            while chunk := sock.recv(4096):
+                data += chunk
+        except OSError:
+            pass
+        body = (body + data.decode('utf-8', 'replace')).strip()
+        try:
+            return json.loads(body).get('message', body)
+        except (ValueError, AttributeError):
+            return body or 'Command refused'
+
+    @staticmethod
+    def _close(sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
@@ -0,0 +1,246 @@
+import binascii
+import json
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Binary teleop datagrams, sent over UDP to the same port number as the car's
+# HTTP server. All fields big endian, each packet followed by the CRC32 of
+# the fields before it:
+#   command: magic, cmd, seq (uint16), throttle, steering (int8)      10 bytes
+#   status:  magic, cmd, seq, distance_mm (uint16, 0xFFFF = no echo),
+#            speed (int8), direction code, ir                          13 bytes
+PACKET_MAGIC = 0xA5
+CMD_DRIVE = 1
+CMD_STOP = 2
+CMD_STATUS = 0x81
+COMMAND_FORMAT = '!BBHbb'
+STATUS_FORMAT = '!BBHHbBB'
+NO_ECHO = 0xFFFF
+DIRECTIONS = ('stop', 'forward', 'backward', 'left', 'right')  # Index = direction code in status packets
+
+
+def with_crc(payload):
+    return payload + struct.pack('!I', binascii.crc32(payload) & 0xFFFFFFFF)
+
+
+def strip_crc(packet):
+    # Payload of a packet whose CRC matches, otherwise None
+    if len(packet) < 5:
+        return None
+    payload = packet[:-4]
+    if struct.unpack('!I', packet[-4:])[0] != binascii.crc32(payload) & 0xFFFFFFFF:
+        return None
+    return payload
+
+
+def encode_command(seq, throttle, steering, cmd=CMD_DRIVE):
+    return with_crc(struct.pack(COMMAND_FORMAT, PACKET_MAGIC, cmd, seq & 0xFFFF, throttle, steering))
+
+
+def decode_command(packet):
+    payload = strip_crc(packet)
+    if payload is None or len(payload) != struct.calcsize(COMMAND_FORMAT):
+        return None
+    magic, cmd, seq, throttle, steering = struct.unpack(COMMAND_FORMAT, payload)
+    return None if magic != PACKET_MAGIC else (cmd, seq, throttle, steering)
+
+
+def encode_status(seq, distance, speed, direction, ir):
+    distance_mm = NO_ECHO if distance is None else min(int(distance * 10), NO_ECHO - 1)
+    return with_crc(struct.pack(STATUS_FORMAT, PACKET_MAGIC, CMD_STATUS, seq & 0xFFFF, distance_mm,
+                                speed, DIRECTIONS.index(direction), ir))
+
+
+def decode_status(packet):
+    payload = strip_crc(packet)
+    if payload is None or len(payload) != struct.calcsize(STATUS_FORMAT):
+        return None
+    magic, cmd, seq, distance_mm, speed, direction, ir = struct.unpack(STATUS_FORMAT, payload)
+    if magic != PACKET_MAGIC or cmd != CMD_STATUS:
+        return None
+    return {
+        "seq": seq,
+        "distance": None if distance_mm == NO_ECHO else distance_mm / 10,
+        "speed": speed,
+        "direction": DIRECTIONS[direction] if direction < len(DIRECTIONS) else None,
+        "ir": ir,
+    }
+
+
+def seq_newer(seq, last):
+    # uint16 serial number arithmetic: newer if ahead by less than half the range
+    return 0 < ((seq - last) & 0xFFFF) < 0x8000
+
+
+# One persistent connection to the car firmware's /teleop endpoint.
+# Samples pushed with update() are coalesced: the sender thread never writes
+# faster than min_interval and always sends the newest sample, resending the
+# last one every keepalive seconds so the firmware's deadman timer stays fed.
+class TeleopLink:
+
+    def __init__(self, host, port, min_interval=0.03, keepalive=0.2, connect_timeout=2):
+        self.min_interval = min_interval
+        self.keepalive = keepalive
+        self.sock = socket.create_connection((host, port), timeout=connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(f'GET /teleop HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+        self.stream = self.sock.makefile('rb')
+
+        # Skip the response headers, the body is one JSON status per line
+        status_line = self.stream.readline()
+        if b' 200 ' not in status_line:
+            self.sock.close()
+            raise ConnectionError(f'Car refused teleop link: {status_line!r}')
+        while self.stream.readline() not in (b'\r\n', b''):
+            pass
+        self.sock.settimeout(None)
+
+        self.cond = threading.Condition()
+        self.pending = None
+        self.closed = False
+        self.seq = 0
+        self.sent_at = {}
+        threading.Thread(target=self._send_loop, daemon=True).start()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        parts = urlsplit(url)
+        return cls(parts.hostname, parts.port or 80, **kwargs)
+
+    def update(self, throttle, steering):
+        with self.cond:
+            self.pending = (int(throttle), int(steering))
+            self.cond.notify()
+
+    def stop(self):
+        self.update(0, 0)
+
+    def _send_loop(self):
+        sample, last_sent = (0, 0), 0.0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending is not None or self.closed, timeout=self.keepalive)
+                if self.closed:
+                    return
+
+            delay = last_sent + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            with self.cond:
+                if self.pending is not None:
+                    sample, self.pending = self.pending, None
+                self.seq += 1
+                seq = self.seq
+                self.sent_at[seq] = time.monotonic()
+
+            try:
+                self._transmit(seq, sample)
+            except OSError:
+                self.close()
+                return
+            last_sent = time.monotonic()
+
+    def _transmit(self, seq, sample):
+        self.sock.sendall(f'{seq},{sample[0]},{sample[1]}\n'.encode())
+
+    def read_status(self):
+        # Blocks until the car reports back; returns None once the link is gone
+        try:
+            line = self.stream.readline()
+        except (OSError, ValueError):
+            return None
+        if not line:
+            return None
+        try:
+            status = json.loads(line)
+        except ValueError:
+            return {}
+
+        with self.cond:
+            sent_at = self.sent_at.pop(status.get('seq'), None)
+            # Drop timestamps of samples the car never answered
+            for seq in [seq for seq in self.sent_at if seq < status.get('seq', 0)]:
+                del self.sent_at[seq]
+        if sent_at is not None:
+            status['rtt_ms'] = round((time.monotonic() - sent_at) * 1000, 1)
+        return status
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        try:
+            self.sock.sendall(f'{self.seq + 1},0,0\n'.encode())
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# TeleopLink over the binary UDP protocol. There is no handshake: every sample
+# is one 10-byte datagram, and the car drops packets whose sequence number is
+# not newer than the last one it applied, so late or reordered datagrams on a
+# lossy link never override a fresher command. The keepalive resend doubles
+# as loss recovery.
+class UdpTeleopLink(TeleopLink):
+
+    def __init__(self, host, port, min_interval=0.03, keepalive=0.1):
+        self.min_interval = min_interval
+        self.keepalive = keepalive
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(0.5)  # close() does not wake a blocked recv, so read_status polls
+        self.sock.connect((host, port))
+
+        self.cond = threading.Condition()
+        self.pending = None
+        self.closed = False
+        self.seq = 0
+        self.sent_at = {}
+        threading.Thread(target=self._send_loop, daemon=True).start()
+
+    def _transmit(self, seq, sample):
+        self.sock.send(encode_command(seq, sample[0], sample[1]))
+
+    def read_status(self):
+        # Blocks until a status datagram arrives; {} for a corrupt one, None once closed
+        while True:
+            try:
+                packet = self.sock.recv(64)
+                break
+            except socket.timeout:
+                if self.closed:
+                    return None
+            except OSError:
+                return None
+        status = decode_status(packet)
+        if status is None:
+            return {}
+
+        now = time.monotonic()
+        with self.cond:
+            # Status packets carry the low 16 bits of seq
+            matches = [seq for seq in self.sent_at if seq & 0xFFFF == status['seq']]
+            sent_at = self.sent_at.pop(max(matches)) if matches else None
+            # Stale send times are dropped by age
+            for seq in [seq for seq, at in self.sent_at.items() if now - at > 2.0]:
+                del self.sent_at[seq]
+        if sent_at is not None:
+            status['rtt_ms'] = round((now - sent_at) * 1000, 1)
+        return status
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        try:
+            self.sock.send(encode_command(self.seq + 1, 0, 0, CMD_STOP))
+        except OSError:
+            pass
+        self.sock.close()
@@ -1,15 +1,54 @@
-from flask import Flask, request, render_template
-import requests
+from flask import Flask, Blueprint, request, render_template, jsonify, g
+from flask_sock import Sock, ConnectionClosed
+import threading
+import json
+import time
 
-app = Flask(__name__)
+import services
+from car_teleop import TeleopLink, UdpTeleopLink
+from car_telemetry import CommandRefused
+from fleet import CircuitOpen, make_fleet_blueprint
+from latency import RequestTrace, make_latency_blueprint
+from session_log import make_session_blueprint
 
-ESP32_SERVER_URL = 'http://192.168.43.79:8080/move'
+# Car routes live on a blueprint so the gateway can host them next to the arm and camera
+car = Blueprint('car', __name__)
+sock = Sock()
+CAR_ID = 'car-1'  # Car this page drives; fleet-wide commands go through /api/fleet
 
-@app.route('/')
+@car.route('/')
 def index():
     return render_template('car_interface.html')
 
-@app.route('/move', methods=['GET'])
+DIRECTIONS = ('forward', 'backward', 'left', 'right', 'stop')
+
+@car.before_request
+def start_trace():
+    g.trace = RequestTrace(request.headers.get('X-Request-Id'))
+
+def send_move(direction, speed):
+    # The car answers /move with a continuous stream of samples, kept in a ring buffer.
+    # Its first sample carries the firmware timings, completed here into the hop trace.
+    g.trace.dispatch()
+    telemetry = services.get_telemetry(CAR_ID)
+    response_data = services.get_fleet().stream(
+        CAR_ID, 'move', {"direction": direction, "speed": int(speed)},
+        lambda device: telemetry.command(direction, speed, request_id=g.trace.id))
+    response_data = dict(response_data, trace=g.trace.complete('move', response_data.get('trace')))
+    services.get_latency().record('car', response_data['trace'])
+    return response_data
+
+def validate_move(direction, speed):
+    if not direction or speed in (None, ''):
+        raise ValueError("Missing parameters")
+    if direction not in DIRECTIONS:
+        raise ValueError(f"Unknown direction: {direction}")
+    speed = int(speed)
+    if not 0 <= speed <= 100:
+        raise ValueError("Speed must be between 0 and 100")
+    return direction, speed
+
+@car.route('/move', methods=['GET'])
 def control_car():
     direction = request.args.get('direction')
     speed = request.args.get('speed')
@@ -18,15 +57,113 @@ def control_car():
         return render_template('car_interface.html', error="Missing parameters")
 
     try:
-        response = requests.get(f'{ESP32_SERVER_URL}?direction={direction}&speed={speed}')
-        response_data = response.json()
-
-        # Print the response received from the ESP32 server
-        print(f"Response from ESP32: {response_data}")
-
+        response_data = send_move(direction, speed)
         return render_template('car_interface.html', response=response_data)
     except Exception as e:
         return render_template('car_interface.html', error=str(e))
 
+@car.route('/api/move', methods=['POST'])
+def api_move():
+    data = request.get_json(silent=True) or request.form
+    try:
+        direction, speed = validate_move(data.get('direction'), data.get('speed'))
+    except (TypeError, ValueError) as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    try:
+        return jsonify({"ok": True, "response": send_move(direction, speed)})
+    except CommandRefused as e:
+        return jsonify({"ok": False, "error": str(e), "status": e.status}), e.status
+    except CircuitOpen as e:
+        return jsonify({"ok": False, "error": str(e), "circuit": "open"}), 503
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 502
+
+@car.route('/api/drive', methods=['POST'])
+def api_drive():
+    # Differential drive: {"linear": 60, "angular": -20} (positive angular turns
+    # left) or per-wheel {"right": 70, "left": 40}, signed percent
+    data = request.get_json(silent=True) or request.form
+    try:
+        if 'right' in data or 'left' in data:
+            params = {"right": clamp(data['right']), "left": clamp(data['left'])}
+        else:
+            params = {"linear": clamp(data.get('linear', 0)), "angular": clamp(data.get('angular', 0))}
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"ok": False, "error": "Give linear/angular or right/left"}), 400
+    result = services.get_fleet().send(CAR_ID, 'drive', params)
+    return jsonify({"ok": 'wheels' in result, "response": result}), 200 if 'wheels' in result else 502
+
+@car.route('/api/telemetry', methods=['GET'])
+def api_telemetry():
+    limit = request.args.get('limit', 100, type=int)
+    since = request.args.get('since', type=float)
+    return jsonify(services.get_telemetry(CAR_ID).snapshot(limit, since))
+
+@car.route('/api/telemetry/history', methods=['GET'])
+def api_telemetry_history():
+    # e.g. /api/telemetry/history?metric=distance&start=<unix ts>&resolution=auto
+    metric = request.args.get('metric', 'distance')
+    end = request.args.get('end', time.time(), type=float)
+    start = request.args.get('start', end - 3600, type=float)
+    try:
+        resolution, points = services.get_store().query(
+            request.args.get('device', CAR_ID), metric, start, end,
+            request.args.get('resolution', 'auto'), request.args.get('max_points', 4000, type=int))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"metric": metric, "resolution": resolution, "points": points})
+
+def clamp(value):
+    return max(-100, min(100, int(value)))
+
+@sock.route('/ws/teleop', bp=car)
+def teleop(ws):
+    # Browser joystick samples ({"throttle": -100..100, "steering": -100..100}) come in
+    # on the websocket, car status lines go back out on the same socket.
+    # ?transport=udp drives the car with binary datagrams instead of the TCP link.
+    fleet = services.get_fleet()
+    telemetry = services.get_telemetry(CAR_ID)
+    link_class = UdpTeleopLink if request.args.get('transport') == 'udp' else TeleopLink
+    try:
+        # Opening the link is not a command; the samples sent over it are recorded
+        link = fleet.stream(CAR_ID, 'teleop', None, lambda device: link_class(device.address, device.port),
+                            record=False)
+    except OSError as e:
+        ws.send(json.dumps({"error": str(e)}))
+        return
+
+    def forward_status():
+        while (status := link.read_status()) is not None:
+            if status:
+                telemetry.record(status)
+            try:
+                ws.send(json.dumps(status))
+            except ConnectionClosed:
+                break
+
+    threading.Thread(target=forward_status, daemon=True).start()
+    try:
+        while not link.closed:
+            try:
+                sample = json.loads(ws.receive(timeout=1))
+                throttle, steering = clamp(sample.get('throttle', 0)), clamp(sample.get('steering', 0))
+                link.update(throttle, steering)
+                fleet.record('teleop', CAR_ID, 'teleop', {"throttle": throttle, "steering": steering})
+            except (TypeError, ValueError, AttributeError):
+                continue
+    except ConnectionClosed:
+        pass
+    finally:
+        link.close()
+
+def create_app():
+    app = Flask(__name__)
+    app.register_blueprint(car)
+    app.register_blueprint(make_fleet_blueprint(services.get_fleet, services.get_latency))
+    app.register_blueprint(make_latency_blueprint(services.get_latency))
+    app.register_blueprint(make_session_blueprint(services.get_fleet, services.get_telemetry, services.open_teleop))
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,182 @@
+import socket
+import threading
+import time
+
+CLOSED = 'closed'        # Device healthy, commands go through
+OPEN = 'open'            # Device known dead, commands fail immediately
+HALF_OPEN = 'half_open'  # Reset timeout passed, one trial request is let through
+
+
+# Per-device circuit breaker. After failure_threshold consecutive failures the
+# circuit opens and allow() returns False without touching the network; after
+# reset_timeout one trial (a probe or a real command) decides whether it closes
+# again or stays open for another reset_timeout.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, reset_timeout=5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+# Reachability and RTT of one device as seen by the prober and by real commands
+class DeviceHealth:
+    def __init__(self, device_id, breaker):
+        self.device_id = device_id
+        self.breaker = breaker
+        self.reachable = None
+        self.rtt_ms = None
+        self.last_probe = None
+        self.last_error = None
+        self.probes = 0
+        self.probe_failures = 0
+
+    def to_dict(self):
+        return {
+            "id": self.device_id,
+            "reachable": self.reachable,
+            "rtt_ms": self.rtt_ms,
+            "circuit": self.breaker.state,
+            "last_probe": self.last_probe,
+            "last_error": self.last_error,
+            "probes": self.probes,
+            "probe_failures": self.probe_failures,
+        }
+
+
+def probe(address, port, timeout):
+    # Lightweight probe: one GET /ping, only the status line is read. Any HTTP
+    # answer (even a 404 from firmware without /ping) counts as reachable.
+    started = time.perf_counter()
+    with socket.create_connection((address, port), timeout=timeout) as sock:
+        sock.sendall(f'GET /ping HTTP/1.1\r\nHost: {address}\r\n\r\n'.encode())
+        status_line = sock.makefile('rb').readline()
+    if not status_line.startswith(b'HTTP/'):
+        raise ConnectionError(f'Unexpected probe answer: {status_line[:40]!r}')
+    return (time.perf_counter() - started) * 1000
+
+
+# Background prober that feeds the fleet's circuit breakers. Attaching it to a
+# Fleet makes Fleet.send() fail fast for devices whose circuit is open.
+class HealthMonitor:
+    def __init__(self, fleet, interval=2.0, probe_timeout=0.5, failure_threshold=3, reset_timeout=5.0):
+        self.fleet = fleet
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.health = {}
+        self.stopped = threading.Event()
+        self.thread = None
+        fleet.health = self
+
+    def _get(self, device_id):
+        with self.lock:
+            if device_id not in self.health:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self.health[device_id] = DeviceHealth(device_id, breaker)
+            return self.health[device_id]
+
+    def allow(self, device_id):
+        return self._get(device_id).breaker.allow()
+
+    def record_success(self, device_id, rtt_ms=None):
+        health = self._get(device_id)
+        health.breaker.record_success()
+        health.reachable = True
+        health.last_error = None
+        if rtt_ms is not None:
+            health.rtt_ms = round(rtt_ms, 1)
+
+    def record_failure(self, device_id, error):
+        health = self._get(device_id)
+        health.breaker.record_failure()
+        health.reachable = False
+        health.last_error = str(error)
+
+    def probe_all(self):
+        # Probes run concurrently on the fleet's pool, so one dead board does
+        # not delay the others by a connect timeout
+        devices = self.fleet.devices()
+        futures = [self.fleet.executor.submit(self.probe_device, device) for device in devices]
+        for future in futures:
+            future.result()
+
+    def probe_device(self, device):
+        health = self._get(device.id)
+        # An open circuit is only probed once its reset timeout has passed
+        if not health.breaker.allow():
+            return
+        health.probes += 1
+        health.last_probe = time.time()
+        try:
+            rtt_ms = probe(device.address, device.port, self.probe_timeout)
+        except OSError as e:
+            health.probe_failures += 1
+            self.record_failure(device.id, e)
+        else:
+            self.record_success(device.id, rtt_ms)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.probe_all()
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True, name='health-monitor')
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def snapshot(self):
+        known = {device.id for device in self.fleet.devices()}
+        return [self._get(device_id).to_dict() for device_id in sorted(known)]
+
+    def metrics(self):
+        # Prometheus text exposition format
+        lines = [
+            '# TYPE robogarden_device_up gauge',
+            '# TYPE robogarden_device_rtt_ms gauge',
+            '# TYPE robogarden_device_circuit_open gauge',
+            '# TYPE robogarden_device_probe_failures_total counter',
+        ]
+        for health in self.snapshot():
+            label = f'{{device="{health["id"]}"}}'
+            lines.append(f'robogarden_device_up{label} {1 if health["reachable"] else 0}')
+            if health['rtt_ms'] is not None:
+                lines.append(f'robogarden_device_rtt_ms{label} {health["rtt_ms"]}')
+            lines.append(f'robogarden_device_circuit_open{label} {0 if health["circuit"] == CLOSED else 1}')
+            lines.append(f'robogarden_device_probe_failures_total{label} {health["probe_failures"]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+# Local stand-in for the ESP32 boards: runs the real firmware
+# (micro_conrollers/Full_Combined_code_car_arm.py) under micropython_hal with
+# the wall clock, one process per board, so the host apps, load_generator.py
+# and session replays talk to the code that ships. Each board serves the arm
+# on its arm port and the car (HTTP and UDP teleop) on the next port, like the
+# real board does on 8080/8081. The car drives around a room with obstacles
+# (sensors.CarWorld), so its distance and IR readings follow its motion.
+# Optional network latency, jitter and loss are added by a proxy in front of
+# every port.
+
+FIRMWARE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'micro_conrollers',
+                        'Full_Combined_code_car_arm.py')
+BOARD_ARM_PORT = 8080  # Ports in the firmware; the car is on the next one
+PROXY_OFFSET = 10000   # Boards behind the proxy listen this much higher
+STARTUP_TIMEOUT_S = 15  # The emulated Wi-Fi takes a few seconds to connect
+
+
+class Network:
+    # Latency is applied half on the request and half on the response; a lost
+    # request is answered with a closed connection, like a board that dropped it
+    def __init__(self, latency_ms=0, jitter_ms=0, loss=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+
+    def impaired(self):
+        return bool(self.latency_ms or self.jitter_ms or self.loss)
+
+    def one_way(self):
+        return max(0.0, (self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 2) / 1000
+
+    async def delay(self):
+        one_way = self.one_way()
+        if one_way > 0:
+            await asyncio.sleep(one_way)
+
+    def dropped(self):
+        return random.random() < self.loss
+
+
+async def pipe(reader, writer, network):
+    # Forwards one direction of a connection. Every chunk is delayed by one
+    # network leg but chunks keep their order, so a telemetry stream arrives
+    # late, not slower.
+    queue = asyncio.Queue()
+
+    async def deliver():
+        while (item := await queue.get()) is not None:
+            deliver_at, data = item
+            await asyncio.sleep(max(0.0, deliver_at - time.monotonic()))
+            writer.write(data)
+            await writer.drain()
+
+    sender = asyncio.create_task(deliver())
+    last = 0.0
+    try:
+        while data := await reader.read(4096):
+            last = max(last, time.monotonic() + network.one_way())
+            queue.put_nowait((last, data))
+        queue.put_nowait(None)
+        await sender
+    except ConnectionError:
+        pass
+    finally:
+        sender.cancel()
+        writer.close()
+
+
+async def proxy_tcp(host, port, target_port, network):
+    async def handle(reader, writer):
+        if network.dropped():
+            writer.close()
+            return
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, target_port)
+        except OSError:
+            writer.close()
+            return
+        await asyncio.gather(pipe(reader, upstream_writer, network), pipe(upstream_reader, writer, network))
+
+    return await asyncio.start_server(handle, host, port)
+
+
+class UdpProxy(asyncio.DatagramProtocol):
+    # One upstream socket per client, so the board's replies find their way back
+    def __init__(self, host, target_port, network):
+        self.host = host
+        self.target_port = target_port
+        self.network = network
+        self.transport = None
+        self.upstreams = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if not self.network.dropped():
+            asyncio.ensure_future(self.forward(data, addr))
+
+    async def forward(self, data, addr):
+        if addr not in self.upstreams:
+            loop = asyncio.get_running_loop()
+            self.upstreams[addr], _ = await loop.create_datagram_endpoint(
+                lambda: UdpReply(self, addr), remote_addr=(self.host, self.target_port))
+        await self.network.delay()
+        self.upstreams[addr].sendto(data)
+
+    async def reply(self, data, addr):
+        await self.network.delay()
+        self.transport.sendto(data, addr)
+
+
+class UdpReply(asyncio.DatagramProtocol):
+    def __init__(self, proxy, addr):
+        self.proxy = proxy
+        self.addr = addr
+
+    def datagram_received(self, data, _):
+        asyncio.ensure_future(self.proxy.reply(data, self.addr))
+
+
+def start_board(firmware, host, arm_port):
+    # The firmware binds 8080/8081; the HAL shifts them to arm_port/arm_port + 1
+    return subprocess.Popen([sys.executable, '-m', 'micropython_hal.run', firmware, '--real', '--duration', '0',
+                             '--world', '--no-trace', '--host', host,
+                             '--port-offset', str(arm_port - BOARD_ARM_PORT),
+                             '--flash-dir', tempfile.mkdtemp(prefix='board-')],
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+async def wait_ready(host, port, board):
+    deadline = time.monotonic() + STARTUP_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if board.poll() is not None:
+            raise RuntimeError(f'Board on port {port} exited with {board.returncode}')
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b'GET /ping HTTP/1.1\r\n\r\n')
+            await reader.read()
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'Board on port {port} did not start')
+
+
+async def serve(host, arm_ports, network, firmware=FIRMWARE):
+    # Without network impairment the boards listen on the public ports themselves
+    offset = PROXY_OFFSET if network.impaired() else 0
+    boards = [start_board(firmware, host, port + offset) for port in arm_ports]
+    try:
+        for board, port in zip(boards, arm_ports):
+            await wait_ready(host, port + offset, board)
+        servers = []
+        loop = asyncio.get_running_loop()
+        if offset:
+            for port in arm_ports:
+                for public in (port, port + 1):
+                    servers.append(await proxy_tcp(host, public, public + offset, network))
+                await loop.create_datagram_endpoint(lambda port=port: UdpProxy(host, port + 1 + offset, network),
+                                                    local_addr=(host, port + 1))
+        for port in arm_ports:
+            print(f'Board on http://{host}:{port} (arm) and http://{host}:{port + 1} (car, UDP teleop)')
+        await asyncio.gather(*(server.serve_forever() for server in servers),
+                             *(asyncio.to_thread(board.wait) for board in boards))
+    finally:
+        for board in boards:
+            board.terminate()
+        for board in boards:
+            board.wait()
+
+
+def devices_config(host, arm_ports):
+    devices = [{"id": f"arm-{i + 1}", "kind": "arm", "address": host, "port": port,
+                "capabilities": ["arm", "sequence", "macros"], "groups": ["arms"]}
+               for i, port in enumerate(arm_ports)]
+    devices += [{"id": f"car-{i + 1}", "kind": "car", "address": host, "port": port + 1,
+                 "capabilities": ["move", "teleop", "telemetry"], "groups": ["cars"]}
+                for i, port in enumerate(arm_ports)]
+    return {"devices": devices}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the ESP32 firmware locally as emulated boards')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--arm-port', type=int, default=8080, help="first board's arm port; its car is on the next")
+    parser.add_argument('--boards', type=int, default=1, help='number of boards (one arm and one car each)')
+    parser.add_argument('--firmware', default=FIRMWARE)
+    parser.add_argument('--latency-ms', type=float, default=0, help='round-trip network latency')
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--loss', type=float, default=0.0, help='probability a request is dropped')
+    parser.add_argument('--write-devices', metavar='PATH',
+                        help='write a devices.json pointing at the emulated boards '
+                             '(use it with ROBOGARDEN_DEVICES=PATH)')
+    args = parser.parse_args()
+
+    # Boards take every other port: arms on 8080, 8082, ... and cars on 8081, 8083, ...
+    arm_ports = [args.arm_port + 2 * i for i in range(args.boards)]
+    if args.write_devices:
+        with open(args.write_devices, 'w') as f:
+            json.dump(devices_config(args.host, arm_ports), f, indent=4)
+
+    network = Network(args.latency_ms, args.jitter_ms, args.loss)
+    # Stopped like Ctrl+C, so serve() takes the board processes down with it
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(serve(args.host, arm_ports, network, args.firmware))
+    except KeyboardInterrupt:
+        print("Emulator stopped")
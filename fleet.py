@@ -0,0 +1,357 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from flask import Blueprint, Response, jsonify, request
+
+
+# One ESP32 board (car, arm or camera) reachable over HTTP
+class Device:
+    def __init__(self, id, kind, address, port=80, capabilities=(), groups=()):
+        self.id = id
+        self.kind = kind
+        self.address = address
+        self.port = int(port)
+        self.capabilities = list(capabilities)
+        self.groups = list(groups)
+
+    def url(self, path=''):
+        return f'http://{self.address}:{self.port}/{path.lstrip("/")}'
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "address": self.address,
+            "port": self.port,
+            "capabilities": self.capabilities,
+            "groups": self.groups,
+        }
+
+
+# Priority classes. Stop commands (stop, halt and car moves with direction=stop)
+# skip the circuit breaker check and run on their own session and thread pool,
+# so they never wait behind queued fan-outs, pooled connections or a long
+# arm move holding a worker.
+PRIORITY_STOP = 0
+PRIORITY_CONTROL = 1
+STOP_COMMANDS = ('stop', 'halt')
+
+
+def command_priority(command, params=None):
+    route, _, query = command.partition('?')
+    if route.strip('/') in STOP_COMMANDS:
+        return PRIORITY_STOP
+    if route.strip('/') == 'move' and ((params or {}).get('direction') == 'stop' or 'direction=stop' in query):
+        return PRIORITY_STOP
+    return PRIORITY_CONTROL
+
+
+# Raised instead of a request to a device whose circuit breaker is open
+class CircuitOpen(ConnectionError):
+    pass
+
+
+def read_response(response):
+    # The car answers /move with an endless NDJSON stream, so only the first
+    # line is read; everything else is a single JSON document
+    if 'ndjson' in response.headers.get('Content-Type', ''):
+        while line := response.raw.readline():
+            if line.strip():
+                return json.loads(line)
+        return {"message": "Empty response"}
+    return response.json()
+
+
+def read_error(response):
+    # Keeps the firmware's own answer to a refused command (400 invalid
+    # action, 404, 423 halted) along with the status code
+    try:
+        result = response.json()
+    except ValueError:
+        result = None
+    if not isinstance(result, dict):
+        result = {"message": response.text.strip() or "Failed to execute command"}
+    result["status"] = response.status_code
+    return result
+
+
+# Device registry plus the dispatch layer every host-side command goes through.
+# broadcast() fans a command out to a group of devices concurrently on a
+# bounded thread pool, so a fleet-wide "stop" costs one round trip, not N.
+# Car moves and teleop links go through stream() instead of send(): the board
+# answers them with a stream that stays open on its own socket, so they cannot
+# share the connection pool, but they get the same breaker, stop priority and
+# session recording.
+class Fleet:
+    def __init__(self, devices=(), max_workers=8, timeout=(3.05, 30), stop_timeout=(1.0, 5)):
+        self.timeout = timeout
+        self.stop_timeout = stop_timeout
+        self.lock = threading.Lock()
+        self.registry = {}
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fleet')
+        # Priority lane for stop commands
+        self.stop_session = requests.Session()
+        self.stop_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=max_workers,
+                                                                         pool_maxsize=max_workers))
+        self.stop_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fleet-stop')
+        self.health = None  # Set by device_health.HealthMonitor
+        self.recorder = None  # Set while a session is recorded (session_log.SessionRecorder)
+        for device in devices:
+            self.register(device)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path) as f:
+            config = json.load(f)
+        return cls([Device(**entry) for entry in config.get('devices', [])], **kwargs)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({"devices": [device.to_dict() for device in self.devices()]}, f, indent=4)
+
+    def register(self, device):
+        with self.lock:
+            self.registry[device.id] = device
+        return device
+
+    def unregister(self, device_id):
+        with self.lock:
+            return self.registry.pop(device_id, None)
+
+    def get(self, device_id):
+        with self.lock:
+            device = self.registry.get(device_id)
+        if device is None:
+            raise KeyError(f'Unknown device: {device_id}')
+        return device
+
+    def devices(self, kind=None, group=None, capability=None):
+        with self.lock:
+            devices = list(self.registry.values())
+        return [device for device in devices
+                if (kind is None or device.kind == kind)
+                and (group is None or group in device.groups)
+                and (capability is None or capability in device.capabilities)]
+
+    def send(self, device_id, command, params=None, request_id=None, record=True):
+        # Same result shape as the apps' old send_command_to_esp32: a dict with
+        # at least a "message" key, also on failure, plus "ok" (the board
+        # answered 200). request_id is passed to the firmware as ?rid= so it
+        # can time the command (see latency.py). record=False keeps the
+        # command out of the session being recorded (used by replays).
+        if record:
+            self.record('http', device_id, command, params)
+        if request_id is not None:
+            params = dict(params or {}, rid=request_id)
+        try:
+            device = self.get(device_id)
+        except KeyError as e:
+            return {"message": str(e.args[0]), "device": device_id, "ok": False}
+        urgent = command_priority(command, params) == PRIORITY_STOP
+        # Known-dead devices fail fast instead of waiting on a connect timeout;
+        # a stop is always attempted
+        if not urgent and self.health is not None and not self.health.allow(device.id):
+            return {"message": "Device unreachable (circuit open)", "device": device.id, "circuit": "open", "ok": False}
+
+        session, timeout = (self.stop_session, self.stop_timeout) if urgent else (self.session, self.timeout)
+        started = time.perf_counter()
+        ok = False
+        try:
+            with session.get(device.url(command), params=params, timeout=timeout, stream=True) as response:
+                if response.status_code == 200:
+                    result = read_response(response)
+                    ok = True
+                else:
+                    result = read_error(response)
+            if self.health is not None:
+                self.health.record_success(device.id)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+            if self.health is not None:
+                self.health.record_failure(device.id, e)
+            result = {"message": str(e)}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # The board accepted the connection, so it is up even if the answer was bad
+            if self.health is not None:
+                self.health.record_success(device.id)
+            result = {"message": str(e)}
+        result.setdefault("message", "")
+        result["ok"] = ok
+        result["device"] = device.id
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    def fetch(self, device_id, command, params=None, timeout=None):
+        # Raw requests.Response variant of send() for binary answers such as camera
+        # snapshots; raises OSError subclasses instead of returning a message
+        device = self.get(device_id)
+        if self.health is not None and not self.health.allow(device.id):
+            raise CircuitOpen('Device unreachable (circuit open)')
+        try:
+            response = self.session.get(device.url(command), params=params, timeout=timeout or self.timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+            if self.health is not None:
+                self.health.record_failure(device.id, e)
+            raise
+        except requests.exceptions.RequestException:
+            if self.health is not None:
+                self.health.record_success(device.id)
+            raise
+        if self.health is not None:
+            self.health.record_success(device.id)
+        return response
+
+    def record(self, kind, device_id, command, params=None):
+        # Adds a command to the session being recorded, if any; teleop samples
+        # are recorded here directly since they only go over an open link
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.record(kind, device_id, command, params)
+
+    def stream(self, device_id, command, params, connect, record=True):
+        # Commands that hold their own socket to the board (car moves on the
+        # telemetry stream, teleop links) still fail fast on an open circuit
+        # and feed the breaker. connect(device) opens the stream and returns
+        # its result; an OSError from it counts as a failure of the device.
+        # Recorded with the command as the kind ("move"), see session_log.py.
+        if record:
+            self.record(command, device_id, command, params)
+        device = self.get(device_id)
+        urgent = command_priority(command, params) == PRIORITY_STOP
+        if not urgent and self.health is not None and not self.health.allow(device.id):
+            raise CircuitOpen('Device unreachable (circuit open)')
+        try:
+            result = connect(device)
+        except OSError as e:
+            if self.health is not None:
+                self.health.record_failure(device.id, e)
+            raise
+        except Exception:
+            # The board answered, e.g. with a refusal
+            if self.health is not None:
+                self.health.record_success(device.id)
+            raise
+        if self.health is not None:
+            self.health.record_success(device.id)
+        return result
+
+    def broadcast(self, command, params=None, kind=None, group=None, device_ids=None):
+        # Returns {device_id: result}; all requests are in flight at once (up to max_workers)
+        if device_ids is None:
+            device_ids = [device.id for device in self.devices(kind, group)]
+        urgent = command_priority(command, params) == PRIORITY_STOP
+        executor = self.stop_executor if urgent else self.executor
+        futures = {executor.submit(self.send, device_id, command, params): device_id
+                   for device_id in device_ids}
+        return {futures[future]: future.result() for future in as_completed(futures)}
+
+    def emergency_stop(self, latch=False, kind=None, group=None, device_ids=None):
+        # /stop (or /halt, which also refuses motion until /resume) on every
+        # moving device; cameras are left alone
+        if device_ids is None:
+            device_ids = [device.id for device in self.devices(kind, group) if device.kind != 'camera']
+        return self.broadcast('halt' if latch else 'stop', device_ids=device_ids)
+
+    def resume(self, kind=None, group=None, device_ids=None):
+        if device_ids is None:
+            device_ids = [device.id for device in self.devices(kind, group) if device.kind != 'camera']
+        return self.broadcast('resume', device_ids=device_ids)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.stop_executor.shutdown(wait=False)
+        self.session.close()
+        self.stop_session.close()
+
+
+def make_fleet_blueprint(get_fleet, get_latency=None):
+    # get_fleet is called per request, so the fleet (and its health monitor
+    # thread) is created in the process that serves requests, not before a fork.
+    # With get_latency, stop round trips and firmware stop times are recorded
+    # in the "stop" latency group.
+    blueprint = Blueprint('fleet', __name__)
+
+    def record_stops(results):
+        if get_latency is None:
+            return
+        for device_id, result in results.items():
+            stages = {"round_trip_ms": result.get('elapsed_ms', 0.0)}
+            if isinstance(result.get('stop_us'), (int, float)):
+                stages['firmware_ms'] = round(result['stop_us'] / 1000, 2)
+            get_latency().record('stop', {"id": device_id, "command": "stop", "stages": stages})
+
+    @blueprint.route('/api/fleet/devices', methods=['GET'])
+    def list_devices():
+        fleet = get_fleet()
+        devices = fleet.devices(request.args.get('kind'), request.args.get('group'))
+        return jsonify([device.to_dict() for device in devices])
+
+    @blueprint.route('/api/fleet/devices', methods=['POST'])
+    def register_device():
+        fleet = get_fleet()
+        try:
+            device = fleet.register(Device(**request.get_json()))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(device.to_dict()), 201
+
+    @blueprint.route('/api/fleet/devices/<device_id>', methods=['DELETE'])
+    def unregister_device(device_id):
+        fleet = get_fleet()
+        if fleet.unregister(device_id) is None:
+            return jsonify({"error": "Unknown device"}), 404
+        return jsonify({"id": device_id})
+
+    @blueprint.route('/api/fleet/devices/<device_id>/<path:command>', methods=['POST'])
+    def send_command(device_id, command):
+        fleet = get_fleet()
+        data = request.get_json(silent=True) or {}
+        return jsonify(fleet.send(device_id, command, data.get('params')))
+
+    @blueprint.route('/api/fleet/broadcast', methods=['POST'])
+    def broadcast():
+        # e.g. {"command": "move", "params": {"direction": "stop", "speed": 0}, "kind": "car"}
+        fleet = get_fleet()
+        data = request.get_json(silent=True) or {}
+        if not data.get('command'):
+            return jsonify({"error": "Missing command"}), 400
+        results = fleet.broadcast(data['command'], data.get('params'), data.get('kind'),
+                                  data.get('group'), data.get('devices'))
+        return jsonify(results)
+
+    @blueprint.route('/api/fleet/stop', methods=['POST'])
+    def emergency_stop():
+        # {"latch": true} halts the boards until /api/fleet/resume; kind, group
+        # and devices narrow the stop down like a broadcast
+        fleet = get_fleet()
+        data = request.get_json(silent=True) or {}
+        results = fleet.emergency_stop(bool(data.get('latch')), data.get('kind'),
+                                       data.get('group'), data.get('devices'))
+        record_stops(results)
+        return jsonify(results)
+
+    @blueprint.route('/api/fleet/resume', methods=['POST'])
+    def resume():
+        fleet = get_fleet()
+        data = request.get_json(silent=True) or {}
+        return jsonify(fleet.resume(data.get('kind'), data.get('group'), data.get('devices')))
+
+    @blueprint.route('/api/fleet/health', methods=['GET'])
+    def health():
+        fleet = get_fleet()
+        if fleet.health is None:
+            return jsonify([])
+        return jsonify(fleet.health.snapshot())
+
+    @blueprint.route('/metrics', methods=['GET'])
+    def metrics():
+        fleet = get_fleet()
+        body = fleet.health.metrics() if fleet.health is not None else ''
+        return Response(body, mimetype='text/plain; version=0.0.4')
+
+    return blueprint
@@ -0,0 +1,69 @@
+import argparse
+import os
+
+from flask import Flask, render_template
+
+import services
+from fleet import make_fleet_blueprint
+from latency import make_latency_blueprint
+from session_log import make_session_blueprint
+from arm_testing_flask_app import arm
+from car_testing_flask_app import car
+from live_stream_esp32_app import camera
+
+# Single control gateway: the car, arm and camera blueprints in one process,
+# sharing one device client pool, health monitor and telemetry bus (services.py).
+# The vision stack is only imported when the first camera stream is opened.
+
+def create_app():
+    app = Flask(__name__, template_folder='templates', static_folder='static')
+    app.secret_key = os.environ.get('ROBOGARDEN_SECRET_KEY', 'robogarden_gateway')  # Necessary for flash messages
+    app.register_blueprint(car, url_prefix='/car')
+    app.register_blueprint(arm, url_prefix='/arm')
+    app.register_blueprint(camera, url_prefix='/camera')
+    app.register_blueprint(make_fleet_blueprint(services.get_fleet, services.get_latency))
+    app.register_blueprint(make_latency_blueprint(services.get_latency))
+    app.register_blueprint(make_session_blueprint(services.get_fleet, services.get_telemetry, services.open_teleop))
+
+    @app.route('/')
+    def index():
+        return render_template('gateway.html', devices=services.get_fleet().devices())
+
+    return app
+
+def serve(server, host, port, workers, threads):
+    if server == 'gunicorn':
+        # Threaded workers keep websockets (car teleop) working. Every worker
+        # process has its own fleet, health monitor and telemetry streams, so
+        # scale with threads first and only add workers for CPU-bound load.
+        from gunicorn.app.base import BaseApplication
+
+        class GatewayApplication(BaseApplication):
+            def load_config(self):
+                self.cfg.set('bind', f'{host}:{port}')
+                self.cfg.set('workers', workers)
+                self.cfg.set('threads', threads)
+                self.cfg.set('worker_class', 'gthread')
+                self.cfg.set('timeout', 0)  # Streams (camera, telemetry, teleop) are long-lived
+
+            def load(self):
+                return create_app()
+
+        GatewayApplication().run()
+    elif server == 'waitress':
+        # Pure-Python and Windows friendly, but no websocket support (no teleop)
+        from waitress import serve as waitress_serve
+        waitress_serve(create_app(), host=host, port=port, threads=threads)
+    else:
+        create_app().run(host=host, port=port, threaded=True, debug=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Robogarden control gateway (car, arm and camera)')
+    parser.add_argument('--server', choices=('gunicorn', 'waitress', 'dev'),
+                        default=os.environ.get('ROBOGARDEN_SERVER', 'gunicorn'))
+    parser.add_argument('--host', default=os.environ.get('ROBOGARDEN_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('ROBOGARDEN_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('ROBOGARDEN_WORKERS', 1)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('ROBOGARDEN_THREADS', 16)))
+    args = parser.parse_args()
+    serve(args.server, args.host, args.port, args.workers, args.threads)
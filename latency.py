@@ -0,0 +1,132 @@
+import bisect
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import Blueprint, jsonify, render_template, request
+
+# Upper bounds of the histogram buckets in milliseconds; the last bucket is open
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+# Timing of one command from the host route to the firmware and back.
+# The request id travels to the board as ?rid=<id>; the firmware answers with
+# its own durations (microseconds, from ticks_us) under "trace", which are
+# subtracted from the host-side round trip to get the network share.
+class RequestTrace:
+    def __init__(self, request_id=None):
+        self.id = request_id or uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.dispatched = None
+        self.stages = {}
+
+    def _ms_since(self, t):
+        return round((time.perf_counter() - t) * 1000, 2)
+
+    def dispatch(self):
+        # Host route work done, the command is about to leave for the device
+        self.stages['host_ms'] = self._ms_since(self.started)
+        self.dispatched = time.perf_counter()
+
+    def complete(self, command, firmware=None):
+        if self.dispatched is not None:
+            round_trip_ms = self._ms_since(self.dispatched)
+            self.stages['round_trip_ms'] = round_trip_ms
+            if isinstance(firmware, dict) and firmware.get('rid') == self.id:
+                for key, value in firmware.items():
+                    if key.endswith('_us') and isinstance(value, (int, float)):
+                        self.stages[key[:-3] + '_ms'] = round(value / 1000, 2)
+                if 'firmware_ms' in self.stages:
+                    self.stages['network_ms'] = round(max(0.0, round_trip_ms - self.stages['firmware_ms']), 2)
+        self.stages['total_ms'] = self._ms_since(self.started)
+        return {"id": self.id, "command": command, "stages": dict(self.stages)}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+        self.max = max(self.max, value_ms)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum / self.count, 2) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p90_ms": self.quantile(0.9),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max, 2),
+            "buckets": [[bound, count] for bound, count in zip(BUCKETS_MS + (None,), self.counts)],
+        }
+
+
+# Per-stage latency histograms for every traced command, grouped by device
+# kind ("arm", "car") since an arm motion and a car actuation differ by three
+# orders of magnitude. The last few traces are kept for the dashboard.
+class LatencyRecorder:
+    def __init__(self, recent=200):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.recent = deque(maxlen=recent)
+
+    def record(self, group, trace):
+        with self.lock:
+            for stage, value_ms in trace['stages'].items():
+                key = (group, stage)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                self.histograms[key].observe(value_ms)
+            self.recent.append(dict(trace, group=group, ts=time.time()))
+
+    def snapshot(self):
+        with self.lock:
+            groups = {}
+            for (group, stage), histogram in sorted(self.histograms.items()):
+                groups.setdefault(group, {})[stage] = histogram.to_dict()
+            return {"groups": groups, "recent": list(self.recent)}
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.recent.clear()
+
+
+def make_latency_blueprint(get_recorder):
+    blueprint = Blueprint('latency', __name__)
+
+    @blueprint.route('/latency', methods=['GET'])
+    def dashboard():
+        return render_template('latency.html')
+
+    @blueprint.route('/api/latency', methods=['GET'])
+    def snapshot():
+        data = get_recorder().snapshot()
+        data['recent'] = data['recent'][-request.args.get('recent', 50, type=int):]
+        return jsonify(data)
+
+    @blueprint.route('/api/latency', methods=['DELETE'])
+    def reset():
+        get_recorder().reset()
+        return jsonify({"ok": True})
+
+    return blueprint
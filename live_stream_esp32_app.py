@@ -1,97 +1,110 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, Response
-from ultralytics import YOLO
-import aiohttp
-import aiofiles
-import asyncio
-import cv2
+from flask import Flask, Blueprint, render_template, redirect, url_for, flash, Response, current_app
+import threading
+import time
 
-app = Flask(__name__, template_folder='templates', static_folder='static')
-app.secret_key = 'detect_live'  # Necessary for flash messages
+import services
+from fleet import make_fleet_blueprint
 
-# Load a model
-model = YOLO("yolov8m.pt")  # load an official model
+# Camera routes live on a blueprint so the gateway can host them next to the car and arm
+camera = Blueprint('camera', __name__)
 
-ESP32_CAM_IP = '192.168.69.212'  # Replace with your ESP32-CAM IP address
+CAMERA_ID = 'cam-1'  # ESP32-CAM entry in devices.json
 REQUEST_TIMEOUT = 5  # Timeout for HTTP requests in seconds
 MAX_RETRIES = 3  # Maximum number of retries for failed requests
 
-async def send_request(url):
-    retries = 0
-    async with aiohttp.ClientSession() as session:
-        while retries < MAX_RETRIES:
-            try:
-                async with session.get(url, timeout=REQUEST_TIMEOUT) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        app.logger.warning(f'Unexpected status code: {response.status}')
-            except aiohttp.ClientError as e:
-                app.logger.error(f'RequestException occurred: {e}')
-            retries += 1
-            await asyncio.sleep(1)  # Wait before retrying
+# The vision stack (ultralytics + torch + OpenCV) takes seconds and a lot of
+# memory to import, so it is only loaded the first time a stream is opened
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            from ultralytics import YOLO
+            _model = YOLO("yolov8m.pt")  # load an official model
+        return _model
+
+def send_request(path):
+    # Goes through the shared fleet pool, so a dead camera fails fast once its circuit opens
+    for _ in range(MAX_RETRIES):
+        try:
+            response = services.get_fleet().fetch(CAMERA_ID, path, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 200:
+                return response.content
+            current_app.logger.warning(f'Unexpected status code: {response.status_code}')
+        except OSError as e:
+            current_app.logger.error(f'RequestException occurred: {e}')
+        time.sleep(1)  # Wait before retrying
     return None
 
-@app.route('/')
+@camera.route('/')
 def index():
     return render_template('interface_esp32cam.html')
 
-@app.route('/stream_on')
+@camera.route('/stream_on')
 def stream_on():
-    url = f'http://{ESP32_CAM_IP}/stream_on'
-    response = asyncio.run(send_request(url))
+    response = send_request('stream_on')
     if response:
         flash('Stream started successfully', 'success')
     else:
         flash('Failed to start stream', 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/stream_off')
+@camera.route('/stream_off')
 def stream_off():
-    url = f'http://{ESP32_CAM_IP}/stream_off'
-    response = asyncio.run(send_request(url))
+    response = send_request('stream_off')
     if response:
         flash('Stream stopped successfully', 'success')
     else:
         flash('Failed to stop stream', 'danger')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/snapshot')
+@camera.route('/snapshot')
 def take_snapshot():
-    url = f'http://{ESP32_CAM_IP}/snapshot'
-    response = asyncio.run(send_request(url))
+    response = send_request('snapshot')
     if response:
-        async def save_snapshot():
-            async with aiofiles.open('static/snapshot.jpg', 'wb') as f:
-                await f.write(response)
-        asyncio.run(save_snapshot())
+        with open('static/snapshot.jpg', 'wb') as f:
+            f.write(response)
         image_url = url_for('static', filename='snapshot.jpg')
         return render_template('snapshot.html', image_url=image_url)
     else:
         flash('Failed to capture snapshot', 'danger')
-        return redirect(url_for('index'))
-
-def generate_frames():
-    cap = cv2.VideoCapture(f'http://{ESP32_CAM_IP}/stream')
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-
-    while True:
-        success, frame = loop.run_until_complete(loop.run_in_executor(None, cap.read))
-        if not success:
-            break
-        else:
-            # Apply YOLOv8 detection
-            results = model(frame)
-            annotated_frame = results[0].plot()
-
-            ret, buffer = cv2.imencode('.jpg', annotated_frame)
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
-@app.route('/stream')
+        return redirect(url_for('.index'))
+
+def generate_frames(stream_url):
+    import cv2
+
+    model = get_model()
+    cap = cv2.VideoCapture(stream_url)
+    try:
+        while True:
+            success, frame = cap.read()
+            if not success:
+                break
+            else:
+                # Apply YOLOv8 detection
+                results = model(frame)
+                annotated_frame = results[0].plot()
+
+                ret, buffer = cv2.imencode('.jpg', annotated_frame)
+                frame = buffer.tobytes()
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    finally:
+        cap.release()
+
+@camera.route('/stream')
 def live_stream():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    stream_url = services.get_fleet().get(CAMERA_ID).url('stream')
+    return Response(generate_frames(stream_url), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+def create_app():
+    app = Flask(__name__, template_folder='templates', static_folder='static')
+    app.secret_key = 'detect_live'  # Necessary for flash messages
+    app.register_blueprint(camera)
+    app.register_blueprint(make_fleet_blueprint(services.get_fleet))
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,149 @@
+import argparse
+import random
+import threading
+import time
+
+import requests
+
+# Load generator for the host control apps: N concurrent operators each click
+# through a command mix as fast as the app answers, then throughput and
+# latency percentiles are reported per command. Point it at the gateway (or a
+# single app) running against esp32_emulator.py to test without real boards.
+
+ARM_COMMANDS = ('move_shoulder_up', 'move_shoulder_down', 'expand_elbow', 'close_elbow',
+                'open_gripper', 'close_gripper')
+CAR_DIRECTIONS = ('forward', 'backward', 'left', 'right', 'stop')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoadGenerator:
+    def __init__(self, base_url, operators, duration, mix, arm_prefix='/arm', car_prefix='/car', think_time=0.0,
+                 stop_interval=0.0):
+        self.base_url = base_url.rstrip('/')
+        self.operators = operators
+        self.duration = duration
+        self.mix = mix
+        self.arm_prefix = arm_prefix.rstrip('/')
+        self.car_prefix = car_prefix.rstrip('/')
+        self.think_time = think_time
+        self.stop_interval = stop_interval
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def next_request(self):
+        if random.choice(self.mix) == 'arm':
+            command = random.choice(ARM_COMMANDS)
+            return f'arm:{command}', f'{self.base_url}{self.arm_prefix}/api/arm/{command}', {}
+        direction = random.choice(CAR_DIRECTIONS)
+        body = {"direction": direction, "speed": random.choice((30, 60, 100))}
+        return 'car:move', f'{self.base_url}{self.car_prefix}/api/move', body
+
+    def operator(self, deadline):
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            name, url, body = self.next_request()
+            started = time.perf_counter()
+            try:
+                response = session.post(url, json=body, timeout=60)
+                ok = response.ok and response.json().get('ok', True)
+            except (requests.exceptions.RequestException, ValueError):
+                ok = False
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self.lock:
+                self.latencies.setdefault(name, []).append(elapsed_ms)
+                if not ok:
+                    self.errors[name] = self.errors.get(name, 0) + 1
+            if self.think_time:
+                time.sleep(self.think_time)
+
+    def safety_operator(self, deadline):
+        # Emergency stop of every board every stop_interval seconds while the other
+        # operators keep the host and the boards busy; its max is the worst-case
+        # stop latency under this load
+        session = requests.Session()
+        while time.monotonic() + self.stop_interval < deadline:
+            time.sleep(self.stop_interval)
+            started = time.perf_counter()
+            try:
+                response = session.post(f'{self.base_url}/api/fleet/stop', json={}, timeout=10)
+                results = response.json()
+                ok = response.ok and all('stop_us' in result for result in results.values())
+            except (requests.exceptions.RequestException, ValueError):
+                ok, results = False, {}
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self.lock:
+                self.latencies.setdefault('stop', []).append(elapsed_ms)
+                for result in results.values():
+                    if isinstance(result.get('stop_us'), (int, float)):
+                        self.latencies.setdefault('stop (firmware)', []).append(result['stop_us'] / 1000)
+                if not ok:
+                    self.errors['stop'] = self.errors.get('stop', 0) + 1
+
+    def run(self):
+        deadline = time.monotonic() + self.duration
+        threads = [threading.Thread(target=self.operator, args=(deadline,)) for _ in range(self.operators)]
+        if self.stop_interval:
+            threads.append(threading.Thread(target=self.safety_operator, args=(deadline,)))
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.monotonic() - started)
+
+    def report(self, elapsed):
+        rows = []
+        all_latencies = sorted(value for name, values in self.latencies.items() if name != 'stop (firmware)'
+                               for value in values)
+        for name, values in sorted(self.latencies.items()) + [('total', all_latencies)]:
+            values = sorted(values)
+            errors = sum(self.errors.values()) if name == 'total' else self.errors.get(name, 0)
+            rows.append({
+                "command": name,
+                "count": len(values),
+                "errors": errors,
+                "throughput": len(values) / elapsed if elapsed else 0,
+                "p50_ms": percentile(values, 0.50),
+                "p90_ms": percentile(values, 0.90),
+                "p99_ms": percentile(values, 0.99),
+                "max_ms": values[-1] if values else None,
+            })
+        return rows
+
+
+def format_report(rows, operators, duration):
+    lines = [f'{operators} operators, {duration:.0f} s',
+             f'{"command":<24}{"count":>8}{"errors":>8}{"cmd/s":>9}{"p50":>9}{"p90":>9}{"p99":>9}{"max":>9}']
+    for row in rows:
+        lines.append(f'{row["command"]:<24}{row["count"]:>8}{row["errors"]:>8}{row["throughput"]:>9.1f}'
+                     + ''.join(f'{row[key]:>9.1f}' if row[key] is not None else f'{"-":>9}'
+                               for key in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms')))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive the host control apps with N concurrent operators')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='gateway or app base URL')
+    parser.add_argument('--operators', type=int, nargs='+', default=[1, 4, 16],
+                        help='operator counts to run one after another')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument('--mix', default='arm,car', help='comma separated: arm, car')
+    parser.add_argument('--arm-prefix', default='/arm', help="use '' for arm_testing_flask_app.py")
+    parser.add_argument('--car-prefix', default='/car', help="use '' for car_testing_flask_app.py")
+    parser.add_argument('--think-time', type=float, default=0.0, help='pause between commands (s)')
+    parser.add_argument('--stop-interval', type=float, default=0.0,
+                        help='send a fleet-wide emergency stop every N seconds and report its latency')
+    args = parser.parse_args()
+
+    for operators in args.operators:
+        generator = LoadGenerator(args.url, operators, args.duration, args.mix.split(','),
+                                  args.arm_prefix, args.car_prefix, args.think_time, args.stop_interval)
+        print(format_report(generator.run(), operators, args.duration))
+        print()
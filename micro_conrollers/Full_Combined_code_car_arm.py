@@ -5,6 +5,10 @@ import time
 import ujson
 from machine import Pin, PWM
 import ujson as json  # Import ujson for JSON serialization
+import usocket
+import ustruct
+import ubinascii
+from array import array
 
 # Motor controller pins
 motor_right_in1 = machine.Pin(15, machine.Pin.OUT)
@@ -21,211 +25,1157 @@ echo = machine.Pin(26, machine.Pin.IN)
 # IR sensor pin
 ir_sensor = machine.Pin(25, machine.Pin.IN)
 
-def measure_distance():
-    # Ensure trigger is low
-    trigger.off()
-    time.sleep_us(2)
-
-    # Send a 10us pulse to trigger
-    trigger.on()
-    time.sleep_us(10)
-    trigger.off()
-
-    # Measure the duration of the pulse on echo pin
-    pulse_duration = machine.time_pulse_us(echo, 1, 30000)  # Timeout of 30ms (30,000 us)
-
-    if pulse_duration > 0:
-        # Calculate the distance (duration * speed of sound / 2)
-        distance = (pulse_duration * 0.0343) / 2
-    else:
-        distance = float('inf')  # No pulse received, set distance to infinity
-
-    return distance
-
-def set_speed(speed):
-    # Set PWM duty cycle for motor enable pins
-    motor_right_ena.duty(int(speed * 1023 / 100))
-    motor_left_enb.duty(int(speed * 1023 / 100))
-
-def move(direction, speed):
-    if direction == "backward":
-        motor_right_in1.on()
-        motor_right_in2.off()
-        motor_left_in1.on()
-        motor_left_in2.off()
-    elif direction == "forward":
-        motor_right_in1.off()
-        motor_right_in2.on()
-        motor_left_in1.off()
-        motor_left_in2.on()
-    elif direction == "left":
-        motor_right_in1.off()
-        motor_right_in2.on()
-        motor_left_in1.on()
-        motor_left_in2.off()
-    elif direction == "right":
-        motor_right_in1.on()
-        motor_right_in2.off()
-        motor_left_in1.off()
-        motor_left_in2.on()
-    elif direction == "stop":
-        motor_right_in1.off()
-        motor_right_in2.off()
-        motor_left_in1.off()
-        motor_left_in2.off()
+# Interrupt-driven ranging. The echo pin's IRQ timestamps both edges with
+# ticks_us and sets a ThreadSafeFlag on the falling edge, so a reading costs
+# the 12 us trigger pulse plus two short IRQs instead of holding the event
+# loop (and with it the arm server) in time_pulse_us for up to 30 ms. The IRQ
+# handler only stores small ints, so it is safe as a hard IRQ.
+ECHO_TIMEOUT_MS = 30  # No echo after this long: nothing in range
 
-async def handle_client_car(reader, writer):
+class Ultrasonic:
+    def __init__(self, trigger, echo, timeout_ms=ECHO_TIMEOUT_MS):
+        self.trigger = trigger
+        self.echo = echo
+        self.timeout_ms = timeout_ms
+        self.rise_us = 0
+        self.pulse_us = -1
+        self.flag = asyncio.ThreadSafeFlag()
+        self.lock = asyncio.Lock()  # One ping in flight; tasks queue for the sensor
+        echo.irq(handler=self._edge, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, hard=True)
+
+    def _edge(self, pin):
+        now = time.ticks_us()
+        if pin.value():
+            self.rise_us = now
+        elif self.rise_us:
+            # A falling edge without a rising one belongs to a ping we gave up on
+            self.pulse_us = time.ticks_diff(now, self.rise_us)
+            self.rise_us = 0
+            self.flag.set()
+
+    async def measure(self):
+        async with self.lock:
+            self.rise_us = 0
+            self.pulse_us = -1
+            # Ensure trigger is low, then send a 10us pulse
+            self.trigger.off()
+            time.sleep_us(2)
+            self.trigger.on()
+            time.sleep_us(10)
+            self.trigger.off()
+
+            deadline = time.ticks_add(time.ticks_ms(), self.timeout_ms)
+            while self.pulse_us < 0:
+                # The flag may still be set by a late echo of an earlier ping
+                remaining = time.ticks_diff(deadline, time.ticks_ms())
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for_ms(self.flag.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+        if self.pulse_us > 0:
+            # Calculate the distance (duration * speed of sound / 2)
+            return (self.pulse_us * 0.0343) / 2
+        return float('inf')  # No pulse received, set distance to infinity
+
+ultrasonic = Ultrasonic(trigger, echo)
+
+# One task samples the ultrasonic and IR sensors at a fixed rate and publishes
+# filtered values in sensors.distance and sensors.ir. The car stream, teleop
+# and status replies only read those, so any number of clients costs no extra
+# pings and they all see the same numbers. Distance is the median of the last
+# SENSOR_WINDOW raw readings, smoothed by an EMA; a reading that jumps more
+# than OUTLIER_CM from the median is dropped, unless OUTLIER_RUN such readings
+# in a row agree with each other: then the scene really changed (something
+# moved in front of the car) and the filter restarts from them. IR is the
+# majority of the last SENSOR_WINDOW reads.
+SENSOR_RATE_HZ = 25
+SENSOR_WINDOW = 3
+SENSOR_EMA_ALPHA = 0.5
+MAX_RANGE_CM = 400  # HC-SR04 limit; no echo is stored as this
+OUTLIER_CM = 80
+OUTLIER_RUN = 3
+
+class SensorSampler:
+    def __init__(self, ultrasonic, ir, rate_hz=SENSOR_RATE_HZ, window=SENSOR_WINDOW, alpha=SENSOR_EMA_ALPHA):
+        self.ultrasonic = ultrasonic
+        self.ir_pin = ir
+        self.window = window
+        self.alpha = alpha
+        self.period_ms = 1000 // rate_hz
+        # Preallocated so sampling does not allocate
+        self.ring = array('f', [MAX_RANGE_CM] * window)
+        self.scratch = array('f', [0] * window)
+        self.ir_ring = bytearray(b'\x01' * window)
+        self.index = 0
+        self.filled = 0
+        self.ir_index = 0
+        self.outlier_run = 0
+        self.last_outlier = 0.0
+        self.ema = None
+        self.distance = float('inf')  # Filtered, inf when nothing is in range
+        self.ir = 1
+        self.raw = float('inf')
+        self.samples = 0
+        self.rejected = 0
+        self.updated = time.ticks_ms()
+
+    def set_rate(self, rate_hz):
+        if not 1 <= rate_hz <= 30:
+            raise ValueError("Sensor rate must be 1-30 Hz")  # A ping can take 30 ms
+        self.period_ms = 1000 // rate_hz
+
+    def median(self):
+        # Insertion sort of the filled part of the ring into scratch
+        n = self.filled
+        for i in range(n):
+            value = self.ring[i]
+            j = i
+            while j > 0 and self.scratch[j - 1] > value:
+                self.scratch[j] = self.scratch[j - 1]
+                j -= 1
+            self.scratch[j] = value
+        return self.scratch[n // 2]
+
+    def add(self, raw, ir):
+        self.samples += 1
+        self.raw = raw
+        value = raw if raw < MAX_RANGE_CM else MAX_RANGE_CM
+        if self.filled and abs(value - self.median()) > OUTLIER_CM:
+            if self.outlier_run and abs(value - self.last_outlier) <= OUTLIER_CM:
+                self.outlier_run += 1
+            else:
+                self.outlier_run = 1
+            self.last_outlier = value
+            if self.outlier_run < OUTLIER_RUN:
+                self.rejected += 1
+                value = None
+            else:
+                # Restart the filter from the new reading; median() reads
+                # ring[0:filled], so the ring starts over at slot 0
+                self.index = 0
+                self.filled = 0
+                self.ema = None
+        if value is not None:
+            self.outlier_run = 0
+            self.ring[self.index] = value
+            self.index = (self.index + 1) % self.window
+            if self.filled < self.window:
+                self.filled += 1
+            median = self.median()
+            self.ema = median if self.ema is None else self.alpha * median + (1 - self.alpha) * self.ema
+            self.distance = float('inf') if self.ema >= MAX_RANGE_CM - 1 else self.ema
+
+        self.ir_ring[self.ir_index] = ir
+        self.ir_index = (self.ir_index + 1) % self.window
+        self.ir = 1 if sum(self.ir_ring) * 2 > self.window else 0
+        self.updated = time.ticks_ms()
+
+    async def run(self):
+        deadline = time.ticks_ms()
+        while True:
+            self.add(await self.ultrasonic.measure(), self.ir_pin.value())
+            deadline = time.ticks_add(deadline, self.period_ms)
+            wait = time.ticks_diff(deadline, time.ticks_ms())
+            if wait < 0:
+                deadline = time.ticks_ms()  # Overran: carry on from now, no burst of catch-up pings
+                wait = 0
+            await asyncio.sleep_ms(wait)
+
+    def to_dict(self):
+        return {
+            "distance": None if self.distance == float('inf') else self.distance,
+            "raw": None if self.raw == float('inf') else self.raw,
+            "ir": self.ir,
+            "rate_hz": 1000 // self.period_ms,
+            "age_ms": time.ticks_diff(time.ticks_ms(), self.updated),
+            "samples": self.samples,
+            "rejected": self.rejected
+        }
+
+sensors = SensorSampler(ultrasonic, ir_sensor)
+
+# Motor driver for the L298 bridge. Each motor has a precomputed 101-entry
+# duty table: 0 % is off, and 1-100 % map linearly onto deadband..full duty
+# scaled by the side's trim, so low speeds still turn the wheels and both
+# sides run at the same pace. Wheel speeds are signed (-100..100, positive is
+# forward) and ramp towards their target by at most MOTOR_ACCEL percent per
+# second (MOTOR_DECEL when slowing down or reversing), one step per control
+# tick, which keeps the inrush current and wheel slip down.
+MOTOR_CALIBRATION = {
+    # side: (deadband duty where the wheel starts turning, trim)
+    "right": (360, 1.0),
+    "left": (380, 0.97),
+}
+MOTOR_ACCEL = 400   # %/s: 0 to full speed in 250 ms
+MOTOR_DECEL = 800   # %/s: full speed to standstill in 125 ms
+RAMP_TICK_MS = 20   # Control tick while a ramp is running
+
+# (right, left) wheel sign per direction preset
+WHEEL_SIGNS = {
+    "stop": (0, 0),
+    "forward": (1, 1),
+    "backward": (-1, -1),
+    "left": (1, -1),
+    "right": (-1, 1),
+}
+
+class Motor:
+    def __init__(self, in1, in2, enable, deadband, trim=1.0):
+        self.in1 = in1
+        self.in2 = in2
+        self.enable = enable
+        full = min(1023, int(1023 * trim))
+        self.duties = array('H', [0] + [deadband + (full - deadband) * percent // 100 for percent in range(1, 101)])
+        self.speed = 0  # Current signed speed in percent
+
+    def drive(self, speed):
+        if speed == self.speed:
+            return
+        if speed > 0:
+            self.in1.off()
+            self.in2.on()
+        elif speed < 0:
+            self.in1.on()
+            self.in2.off()
+        else:
+            self.in1.off()
+            self.in2.off()
+        self.enable.duty(self.duties[min(abs(speed), 100)])
+        self.speed = speed
+
+class MotorDriver:
+    def __init__(self, right, left, accel=MOTOR_ACCEL, decel=MOTOR_DECEL):
+        self.motors = (right, left)
+        self.accel = accel
+        self.decel = decel
+        self.targets = [0, 0]
+        self.updated = time.ticks_ms()
+
+    def set(self, direction, speed):
+        # Direction presets are shortcuts for wheel speeds
+        right, left = WHEEL_SIGNS[direction]
+        self.set_wheels(right * speed, left * speed)
+
+    def set_wheels(self, right, left):
+        self.targets = [max(-100, min(100, int(right))), max(-100, min(100, int(left)))]
+
+    def stop(self):
+        # Emergency stop: no ramp
+        self.targets = [0, 0]
+        for motor in self.motors:
+            motor.drive(0)
+
+    def ramping(self):
+        return self.motors[0].speed != self.targets[0] or self.motors[1].speed != self.targets[1]
+
+    def update(self):
+        now = time.ticks_ms()
+        # After an idle stretch a ramp starts with one tick's step, not a jump
+        elapsed = min(time.ticks_diff(now, self.updated), RAMP_TICK_MS)
+        self.updated = now
+        for motor, target in zip(self.motors, self.targets):
+            current = motor.speed
+            if current == target:
+                continue
+            if current == 0 or (current > 0) == (target > 0) and abs(target) > abs(current):
+                step = max(1, self.accel * elapsed // 1000)
+            else:
+                step = max(1, self.decel * elapsed // 1000)
+                if current != 0 and (target > 0) != (current > 0):
+                    target = 0  # Reversing: down to a standstill first
+            if target > current:
+                motor.drive(min(target, current + step))
+            else:
+                motor.drive(max(target, current - step))
+
+    def to_dict(self):
+        return {
+            "wheels": [motor.speed for motor in self.motors],
+            "targets": list(self.targets),
+            "duties": [motor.duties[min(abs(motor.speed), 100)] for motor in self.motors]
+        }
+
+def mix(linear, angular):
+    # Differential drive: (linear, angular) in -100..100 -> (right, left)
+    # wheel speeds. Positive angular turns left. If a wheel would need more
+    # than 100 %, both are scaled down together so the arc keeps its shape.
+    right, left = linear + angular, linear - angular
+    peak = max(abs(right), abs(left))
+    if peak > 100:
+        right, left = right * 100 / peak, left * 100 / peak
+    return int(right), int(left)
+
+motors = MotorDriver(
+    Motor(motor_right_in1, motor_right_in2, motor_right_ena, *MOTOR_CALIBRATION["right"]),
+    Motor(motor_left_in1, motor_left_in2, motor_left_enb, *MOTOR_CALIBRATION["left"]))
+
+# Obstacle avoidance for /move forward, as a state machine on ticks_ms
+# deadlines rather than sleeps and direction flips:
+#
+#   cruise  -- speed ramps from min_speed at stop_cm up to 100 at slow_cm
+#   brake   -- closer than stop_cm: motors off for brake_ms
+#   reverse -- back off for reverse_ms, cut short when the rear IR sensor sees something
+#   turn    -- spin towards turn for turn_ms, repeated until the way ahead is
+#              clear of clear_cm, then back to cruise
+#
+# The car commits to each manoeuvre for its full time, so it no longer flips
+# between forward and backward on every tick. All thresholds can be changed
+# at run time with /avoidance?stop_cm=40&turn_ms=300.
+AVOIDANCE = {
+    "stop_cm": 50,
+    "slow_cm": 100,
+    "clear_cm": 70,      # Resume only once this much room is ahead (hysteresis over stop_cm)
+    "min_speed": 50,
+    "brake_ms": 150,
+    "reverse_ms": 500,
+    "reverse_speed": 50,
+    "turn_ms": 400,
+    "turn_speed": 60,
+}
+AVOID_TURN = "right"
+
+class ObstacleAvoidance:
+    def __init__(self, config=AVOIDANCE, turn=AVOID_TURN):
+        self.config = dict(config)
+        self.turn = turn
+        self.state = "cruise"
+        self.deadline = 0
+        self.manoeuvres = 0
+
+    def configure(self, values):
+        config = dict(self.config)
+        for key, value in values.items():
+            if key not in config:
+                raise ValueError("Unknown setting: " + key)
+            config[key] = int(value)
+            if config[key] < 0:
+                raise ValueError(key + " must not be negative")
+        if not config["stop_cm"] <= config["clear_cm"] <= config["slow_cm"]:
+            raise ValueError("Need stop_cm <= clear_cm <= slow_cm")
+        self.config = config
+
+    def reset(self):
+        self.state = "cruise"
+
+    def enter(self, state, now, duration_ms):
+        self.state = state
+        self.deadline = time.ticks_add(now, duration_ms)
+
+    def remaining_ms(self, now):
+        # Time until the current manoeuvre ends, None while cruising
+        if self.state == "cruise":
+            return None
+        return max(0, time.ticks_diff(self.deadline, now))
+
+    def cruise_speed(self, distance):
+        config = self.config
+        if distance >= config["slow_cm"]:
+            return 100
+        if distance <= config["stop_cm"]:
+            return config["min_speed"]
+        span = config["slow_cm"] - config["stop_cm"]
+        return config["min_speed"] + int((100 - config["min_speed"]) * (distance - config["stop_cm"]) / span)
+
+    def step(self, now, distance, rear_blocked):
+        # One control tick; returns the (direction, speed) to drive
+        config = self.config
+        expired = self.state != "cruise" and time.ticks_diff(now, self.deadline) >= 0
+        if self.state == "cruise" and distance < config["stop_cm"]:
+            self.manoeuvres += 1
+            self.enter("brake", now, config["brake_ms"])
+        elif self.state == "brake" and distance >= config["clear_cm"]:
+            self.state = "cruise"  # The obstacle moved away while braking
+        elif self.state == "brake" and expired:
+            if rear_blocked:
+                self.enter("turn", now, config["turn_ms"])
+            else:
+                self.enter("reverse", now, config["reverse_ms"])
+        elif self.state == "reverse" and (expired or rear_blocked):
+            self.enter("turn", now, config["turn_ms"])
+        elif self.state == "turn" and expired:
+            if distance >= config["clear_cm"]:
+                self.state = "cruise"
+            else:
+                self.enter("turn", now, config["turn_ms"])  # Still blocked, keep turning
+
+        if self.state == "brake":
+            return "stop", 0
+        if self.state == "reverse":
+            return "backward", config["reverse_speed"]
+        if self.state == "turn":
+            return self.turn, config["turn_speed"]
+        return "forward", self.cruise_speed(distance)
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "remaining_ms": self.remaining_ms(time.ticks_ms()),
+            "manoeuvres": self.manoeuvres,
+            "turn": self.turn,
+            "config": self.config
+        }
+
+# The one task that drives the car. HTTP, TCP teleop and UDP handlers only
+# change the setpoint (set()/drive()) and return; the controller applies it
+# with the obstacle rules every CONTROL_PERIOD_MS, or at once when the
+# setpoint changes, and publishes one sample per tick to the /move streams
+# subscribed to it. A closed connection no longer takes a control loop with
+# it, and two clients can't fight over the motor pins: the last setpoint wins.
+CONTROL_PERIOD_MS = 100
+MAX_SUBSCRIBERS = 4
+TELEOP_STOP_CM = 20     # Teleop: never drive forward into anything closer
+
+class MotionController:
+    def __init__(self, period_ms=CONTROL_PERIOD_MS):
+        self.period_ms = period_ms
+        # Setpoint. auto (/move) picks the speed from the distance ahead,
+        # teleop passes its own speed through. Direction "drive" runs the
+        # wheels at their own speeds (wheels) for arcs and gentle steering.
+        self.direction = "stop"
+        self.speed = 0
+        self.wheels = (0, 0)
+        self.auto = True
+        # What the motors are doing
+        self.out_direction = "stop"
+        self.out_speed = 0
+        self.actuated = time.ticks_us()
+        self.ticks = 0
+        self.subscribers = []  # [writer, trace timings or None]
+        self.wake = asyncio.Event()
+        self.avoidance = ObstacleAvoidance()
+
+    def set(self, direction, speed=0, auto=True):
+        if auto and direction != self.direction:
+            self.avoidance.reset()
+        self.direction, self.speed, self.auto = direction, speed, auto
+        self.wake.set()
+
+    def drive(self, direction, speed):
+        # Teleop setpoint; returns what the car will do with it
+        self.set(direction, speed, False)
+        return self.target(sensors.distance)
+
+    def drive_wheels(self, right, left):
+        # Signed per-wheel speeds (-100..100), e.g. from mix(linear, angular)
+        right, left = max(-100, min(100, int(right))), max(-100, min(100, int(left)))
+        self.wheels = (right, left)
+        self.set("drive", max(abs(right), abs(left)), False)
+        return self.target(sensors.distance)
+
+    def stop(self):
+        # The motors are cut here rather than ramped down at the next ticks
+        self.set("stop")
+        motors.stop()
+        self.out_direction, self.out_speed = "stop", 0
+        self.actuated = time.ticks_us()
+
+    def apply(self, direction, speed):
+        if direction == "drive":
+            motors.set_wheels(*self.wheels)
+        else:
+            motors.set(direction, speed)
+        motors.update()  # First ramp step right away
+        self.out_direction, self.out_speed = direction, speed
+        self.actuated = time.ticks_us()
+
+    def target(self, distance):
+        direction = self.direction
+        if halted or direction == "stop":
+            return "stop", 0
+        if not self.auto:
+            forward = direction == "forward" or (direction == "drive" and self.wheels[0] + self.wheels[1] > 0)
+            if forward and distance < TELEOP_STOP_CM:
+                return "stop", 0
+            return direction, self.speed
+        if direction == "forward":
+            return self.avoidance.step(time.ticks_ms(), distance, sensors.ir == 0)
+        if direction == "backward":
+            # Hold still rather than back into whatever the rear sensor sees
+            return ("stop", 0) if sensors.ir == 0 else (direction, 50)
+        return direction, self.avoidance.cruise_speed(distance)  # Turning in place
+
+    def step(self):
+        direction, speed = self.target(sensors.distance)
+        if direction != self.out_direction or speed != self.out_speed \
+                or (direction == "drive" and motors.targets != list(self.wheels)):
+            self.apply(direction, speed)
+        elif motors.ramping():
+            motors.update()
+        self.ticks += 1
+
+    def subscribe(self, writer, trace=None):
+        if len(self.subscribers) >= MAX_SUBSCRIBERS:
+            self.subscribers.pop(0)[0].close()
+        self.subscribers.append([writer, trace])
+        self.wake.set()
+
+    def sample(self):
+        distance = sensors.distance
+        return {
+            "distance": None if distance == float('inf') else distance,  # null when no echo
+            "speed": self.out_speed,
+            "status": "running",
+            "direction": self.out_direction,
+            "ir": sensors.ir
+        }
+
+    async def publish(self):
+        if not self.subscribers:
+            return
+        sample = self.sample()
+        line = (ujson.dumps(sample) + '\n').encode('utf-8')
+        for subscriber in list(self.subscribers):
+            writer, trace = subscriber
+            data = line
+            if trace is not None:
+                # The first sample of a stream tells the host when the motors took the command
+                sample["trace"] = {
+                    "rid": trace['rid'],
+                    "parse_us": time.ticks_diff(trace['parsed'], trace['received']),
+                    "actuate_us": max(0, time.ticks_diff(self.actuated, trace['parsed'])),
+                    "firmware_us": time.ticks_diff(time.ticks_us(), trace['received'])
+                }
+                data = (ujson.dumps(sample) + '\n').encode('utf-8')
+                del sample["trace"]
+                subscriber[1] = None
+            try:
+                writer.write(data)
+                # A client that stops reading is dropped rather than allowed to stall the car
+                await asyncio.wait_for_ms(writer.drain(), self.period_ms)
+            except Exception:
+                if subscriber in self.subscribers:
+                    self.subscribers.remove(subscriber)
+                writer.close()
+
+    async def run(self):
+        while True:
+            self.step()
+            await self.publish()
+            # Tick faster while the motors ramp, and wake up early for the end
+            # of an avoidance manoeuvre
+            timeout = RAMP_TICK_MS if motors.ramping() else self.period_ms
+            remaining = self.avoidance.remaining_ms(time.ticks_ms()) if self.auto else None
+            if remaining is not None:
+                timeout = max(1, min(timeout, remaining))
+            try:
+                await asyncio.wait_for_ms(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+    def to_dict(self):
+        return {
+            "setpoint": {"direction": self.direction, "speed": self.speed, "wheels": self.wheels, "auto": self.auto},
+            "direction": self.out_direction,
+            "speed": self.out_speed,
+            "ticks": self.ticks,
+            "subscribers": len(self.subscribers),
+            "motors": motors.to_dict(),
+            "avoidance": self.avoidance.to_dict()
+        }
+
+controller = MotionController()
+
+# Emergency stop. /stop and /halt are routed ahead of everything else on both
+# servers: the car's motors are cut in the handler itself and arm motions are
+# cancelled at their next 20 ms servo step. /halt also latches: motion
+# commands are refused until /resume.
+halted = False
+arm_motions = set()  # Handler tasks currently moving the arm
+
+def stop_car():
+    controller.stop()
+
+def stop_arm():
+    for task in list(arm_motions):
+        task.cancel()
+    robotic_arm.servos.hold()
+    return len(arm_motions)
+
+async def emergency_stop(route):
+    global halted
+    if route == '/resume':
+        halted = False
+        return {"message": "Board resumed"}
+    started = time.ticks_us()
+    stop_car()
+    cancelled = stop_arm()
+    if route == '/halt':
+        halted = True
+    await asyncio.sleep_ms(0)  # Let cancelled motions unwind (PWM off) before answering
+    return {
+        "message": "Board halted" if route == '/halt' else "Motion stopped",
+        "cancelled": cancelled,
+        "stop_us": time.ticks_diff(time.ticks_us(), started)
+    }
+
+STOP_ROUTES = ('/stop', '/halt', '/resume')
+
+TELEOP_TIMEOUT_MS = 500  # Stop the motors if the host goes quiet for this long
+TELEOP_DEADZONE = 5
+
+def teleop_to_move(throttle, steering):
+    # Map a (throttle, steering) sample in -100..100 onto the direction presets
+    if abs(throttle) < TELEOP_DEADZONE:
+        throttle = 0
+    if abs(steering) < TELEOP_DEADZONE:
+        steering = 0
+    if abs(steering) > abs(throttle):
+        return ("right" if steering > 0 else "left"), min(abs(steering), 100)
+    if throttle > 0:
+        return "forward", min(throttle, 100)
+    if throttle < 0:
+        return "backward", min(-throttle, 100)
+    return "stop", 0
+
+async def teleop_session(reader, writer):
+    # Persistent teleop link: the host streams "seq,throttle,steering\n" lines over
+    # one connection and gets one JSON status line back per sample
+    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n\r\n')
+    await writer.drain()
     try:
-        params = {}
+        while True:
+            try:
+                line = await asyncio.wait_for_ms(reader.readline(), TELEOP_TIMEOUT_MS)
+            except asyncio.TimeoutError:
+                controller.set("stop")
+                continue
+            if not line:
+                break
 
-        async def control_movement():
             try:
-                while True:
-                    direction = params.get('direction')
-
-                    if not direction:
-                        response = 'HTTP/1.1 400 Bad Request\r\nContent-Type: application/json\r\n\r\n{"status": "error", "message": "Invalid parameters"}'
-                        writer.write(response.encode('utf-8'))
-                        await writer.drain()
-                        await writer.aclose()
-                        return
-
-                    # Read IR sensor value
-                    ir_value = ir_sensor.value()
-
-                    # Measure distance
-                    distance = measure_distance()
-                    
-                    if direction != "stop":
-                        if ir_value == 0 and direction == "backward":
-                            direction = "forward"
-                            params['direction'] = "forward"
-
-                        # Adjust speed based on distance
-                        if direction != "backward":
-                            if distance < 50:
-                                speed = 0   # Slow down if obstacle is close
-                                # wait 300 ms
-                                await asyncio.sleep_ms(50)
-                                direction = "backward"
-                                params['direction'] = "backward"
-                            elif distance < 100:
-                                speed = 50  # Moderate speed if obstacle is moderately close
-                            else:
-                                speed = 100  # Full speed if no obstacle nearby
-                        else:
-                            speed = 50
-                    else:
-                        speed = 0
-                            
-                    # Move with adjusted speed and direction
-                    move(direction, speed)
-                    set_speed(speed)
-
-                    # Prepare JSON response with distance, speed, status, and direction
-                    response_data = {
-                        "distance": distance,
-                        "speed": speed,
-                        "status": "running",
-                        "direction": direction  # Assuming forward direction for now
-                    }
-
-                    # Prepare HTTP response with JSON data
-                    http_response = 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n'
-                    http_response += ujson.dumps(response_data)
-
-                    # Send response
-                    writer.write(http_response.encode('utf-8'))
-                    await writer.drain()
-
-                    # Adjust speed every 100 ms
-                    await asyncio.sleep_ms(100)
-
-            except Exception as e:
-                print(f"Error in control_movement: {e}")
-                response = 'HTTP/1.1 500 Internal Server Error\r\nContent-Type: text/plain\r\n\r\nInternal Server Error'
-                writer.write(response.encode('utf-8'))
-                await writer.drain()
-            finally:
-                writer.close()  # Close the writer when control_movement ends
+                seq, throttle, steering = [int(v) for v in line.decode().strip().split(',')]
+            except ValueError:
+                continue
+
+            direction, speed = controller.drive(*teleop_to_move(throttle, steering))
+            distance = sensors.distance
 
-        async def update_request_variables():
-            nonlocal params
+            status = {
+                "seq": seq,
+                "distance": None if distance == float('inf') else distance,  # null when no echo
+                "speed": speed,
+                "direction": direction,
+                "ir": sensors.ir
+            }
+            writer.write((ujson.dumps(status) + '\n').encode('utf-8'))
+            await writer.drain()
+    finally:
+        controller.set("stop")
+
+# Binary UDP teleop (see car_teleop.py on the host for the packet layout). It
+# listens on the car's port number and needs no HTTP parsing or allocation
+# per sample: one 10-byte datagram in, one 13-byte status datagram out.
+PACKET_MAGIC = 0xA5
+CMD_DRIVE = 1
+CMD_STOP = 2
+CMD_STATUS = 0x81
+UDP_POLL_MS = 5
+DIRECTION_CODES = {"stop": 0, "forward": 1, "backward": 2, "left": 3, "right": 4}
+
+def crc32(payload):
+    return ubinascii.crc32(payload) & 0xFFFFFFFF
+
+def decode_command(packet):
+    if len(packet) != 10 or packet[0] != PACKET_MAGIC:
+        return None
+    if ustruct.unpack('!I', packet[6:])[0] != crc32(packet[:6]):
+        return None
+    return ustruct.unpack('!BHbb', packet[1:6])  # cmd, seq, throttle, steering
+
+def encode_status(seq, distance, speed, direction, ir):
+    distance_mm = 0xFFFF if distance == float('inf') else min(int(distance * 10), 0xFFFE)
+    payload = ustruct.pack('!BBHHbBB', PACKET_MAGIC, CMD_STATUS, seq, distance_mm, speed,
+                           DIRECTION_CODES.get(direction, 0), ir)
+    return payload + ustruct.pack('!I', crc32(payload))
+
+def seq_newer(seq, last):
+    return 0 < ((seq - last) & 0xFFFF) < 0x8000
+
+async def udp_teleop(port):
+    sock = usocket.socket(usocket.AF_INET, usocket.SOCK_DGRAM)
+    sock.bind(('0.0.0.0', port))
+    sock.setblocking(False)
+    last_seq = None
+    last_packet = time.ticks_ms()
+    while True:
+        # Drain everything that arrived since the last poll and keep only the
+        # newest valid sample; stale, duplicate and reordered packets are dropped
+        latest = None
+        while True:
             try:
-                request = await reader.read(1024)
-                if not request:
-                    return
-                request = request.decode('utf-8')
-
-                request_line = request.split('\r\n')[0]
-                method, path, _ = request_line.split()
-
-                if method == 'GET' and path.startswith('/move'):
-                    query = path.split('?')[-1]
-                    params = {kv.split('=')[0]: kv.split('=')[1] for kv in query.split('&') if '=' in kv}
-                    if not params.get('direction'):
-                        raise ValueError("Missing direction parameter")
-                    await control_movement()
-                else:
-                    response = 'HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n\r\nNot Found'
-                    writer.write(response.encode('utf-8'))
-                    await writer.drain()
-            except Exception as e:
-                response = f"Error in update_request_variables: {e}"
-            finally:
-                writer.close()  # Close the writer when update_request_variables ends
+                packet, addr = sock.recvfrom(16)
+            except OSError:
+                break
+            command = decode_command(packet)
+            if command is None:
+                continue
+            cmd, seq, throttle, steering = command
+            if cmd == CMD_STOP:
+                stop_car()  # A stop is never dropped as stale
+                last_seq, latest = None, None
+                sock.sendto(encode_status(seq, sensors.distance, 0, "stop", sensors.ir), addr)
+                continue
+            if last_seq is not None and not seq_newer(seq, last_seq):
+                continue
+            last_seq = seq
+            latest = (seq, throttle, steering, addr)
 
-        await update_request_variables()
+        if latest is not None:
+            seq, throttle, steering, addr = latest
+            last_packet = time.ticks_ms()
+            direction, speed = controller.drive(*teleop_to_move(throttle, steering))
+            distance = sensors.distance
+            sock.sendto(encode_status(seq, distance, speed, direction, sensors.ir), addr)
+        elif last_seq is not None and time.ticks_diff(time.ticks_ms(), last_packet) > TELEOP_TIMEOUT_MS:
+            # Deadman: the host went quiet, stop and accept any seq from a new session
+            controller.set("stop")
+            last_seq = None
+        await asyncio.sleep_ms(UDP_POLL_MS)
 
+def respond(writer, status, body, content_type='application/json'):
+    writer.write(('HTTP/1.1 ' + status + '\r\nContent-Type: ' + content_type + '\r\n\r\n' + body).encode('utf-8'))
+
+async def handle_client_car(reader, writer):
+    # Every route answers at once; /move only updates the controller's
+    # setpoint and hands the connection to it as a telemetry stream
+    streaming = False
+    try:
+        request = await reader.read(1024)
+        if not request:
+            return
+        received = time.ticks_us()  # For the host's latency trace
+        method, path, _ = request.decode('utf-8').split('\r\n')[0].split()
+        route = path.split('?')[0]
+
+        if method == 'GET' and route in STOP_ROUTES:
+            respond(writer, '200 OK', ujson.dumps(await emergency_stop(route)))
+        elif method == 'GET' and route == '/move':
+            params = parse_query(path)
+            parsed = time.ticks_us()
+            direction = params.get('direction')
+            if direction not in DIRECTION_CODES:
+                respond(writer, '400 Bad Request', '{"message": "Invalid direction"}')
+            elif halted and direction != 'stop':
+                respond(writer, '423 Locked', '{"message": "Board halted, send /resume"}')
+            else:
+                if direction == 'stop':
+                    controller.stop()  # Motors off now, not at the next tick
+                else:
+                    controller.set(direction)
+                # One header, then one JSON sample per line (NDJSON) per controller tick
+                respond(writer, '200 OK', '', 'application/x-ndjson')
+                await writer.drain()
+                trace = {"rid": params['rid'], "received": received, "parsed": parsed} if params.get('rid') else None
+                controller.subscribe(writer, trace)
+                streaming = True
+        elif method == 'GET' and route == '/sensors':
+            # /sensors?rate=10 changes the sampling rate
+            status, rate = '200 OK', parse_query(path).get('rate')
+            try:
+                if rate:
+                    sensors.set_rate(int(rate))
+                response = ujson.dumps(sensors.to_dict())
+            except ValueError as e:
+                status, response = '400 Bad Request', ujson.dumps({"message": str(e)})
+            respond(writer, status, response)
+        elif method == 'GET' and route == '/drive':
+            # /drive?linear=60&angular=-20 or /drive?right=70&left=40, signed percent
+            params = parse_query(path)
+            try:
+                if 'linear' in params or 'angular' in params:
+                    right, left = mix(int(params.get('linear', 0)), int(params.get('angular', 0)))
+                else:
+                    right, left = int(params['right']), int(params['left'])
+            except (KeyError, ValueError):
+                respond(writer, '400 Bad Request', '{"message": "Give linear/angular or right/left"}')
+            else:
+                if halted:
+                    respond(writer, '423 Locked', '{"message": "Board halted, send /resume"}')
+                else:
+                    direction, speed = controller.drive_wheels(right, left)
+                    body = {"direction": direction, "wheels": controller.wheels if direction == "drive" else [0, 0]}
+                    respond(writer, '200 OK', ujson.dumps(body))
+        elif method == 'GET' and route == '/motion':
+            respond(writer, '200 OK', ujson.dumps(controller.to_dict()))
+        elif method == 'GET' and route == '/avoidance':
+            # /avoidance?stop_cm=40&reverse_ms=300 changes the thresholds and timers
+            status = '200 OK'
+            try:
+                params = parse_query(path)
+                params.pop('rid', None)
+                controller.avoidance.configure(params)
+                response = ujson.dumps(controller.avoidance.to_dict())
+            except ValueError as e:
+                status, response = '400 Bad Request', ujson.dumps({"message": str(e)})
+            respond(writer, status, response)
+        elif method == 'GET' and route == '/ping':
+            respond(writer, '200 OK', '{"message": "pong"}')
+        elif method == 'GET' and route == '/teleop':
+            await teleop_session(reader, writer)
+        else:
+            respond(writer, '404 Not Found', 'Not Found', 'text/plain')
+        await writer.drain()
     except asyncio.CancelledError:
-        response = "Client connection cancelled"
+        streaming = False
     except Exception as e:
-        response = f"Error in handle_client: {e}"
+        print(f"Error in handle_client_car: {e}")
+        streaming = False
     finally:
-        writer.close()  # Close the writer in the outermost try block
+        if not streaming:
+            writer.close()  # Streams are closed by the controller when the client goes away
+
+
+# Servo manager for the arm. Each servo keeps its PWM channel while it holds
+# a position instead of getting a fresh PWM (and a pin reset) for every move,
+# and one shared loop updates all moving joints every SERVO_TICK_MS. A move
+# follows a trapezoidal velocity profile (accelerate, cruise, decelerate)
+# that is evaluated at the time since the move started, so a late tick never
+# stretches the move. The joints of a move share one profile and start and
+# arrive together. Duties come from a per-joint table indexed by whole
+# degrees. A servo left idle for SERVO_RELAX_MS is released (PWM off, pin back
+# to input) until it moves again; 0 keeps the servos powered.
+JOINTS = ('shoulder', 'elbow', 'gripper')
+JOINT_FREQS = (60, 70, 30)  # PWM frequency per joint
+JOINT_DUTY_RANGE = ((40, 115), (40, 115), (40, 115))  # Duty at 0 and 180 degrees per joint
+SERVO_LIMITS = ((400, 2000), (450, 2500), (500, 3000))  # Max deg/s and deg/s^2 per joint
+SERVO_VELOCITY_RANGE = (10, 1000)        # deg/s /limits accepts
+SERVO_ACCELERATION_RANGE = (50, 10000)   # deg/s^2
+SERVO_TICK_MS = 20
+SERVO_SETTLE_MS = 200       # The profile already slows the joints down into the target
+SERVO_RELAX_MS = 2000
+
+# Every move is a ServoMotion. Its joints belong to it until they arrive: a
+# newer motion that claims one of them preempts it and the joint heads for
+# the new target from wherever it is at that moment, so two commands never
+# write the same servo. cancel() stops the motion's joints on the spot.
+class MotionInterrupted(Exception):
+    # Raised to the command waiting on a motion that was preempted or cancelled
+    pass
+
+class ServoMotion:
+    def __init__(self, servos, motion_id, joints, streamed=False):
+        self.servos = servos
+        self.id = motion_id
+        self.joints = joints
+        self.streamed = streamed  # Fed by the trajectory player instead of the servo loop
+        self.state = 'moving'     # Then done, preempted or cancelled
+        self.done = asyncio.Event()
+        self.started = time.ticks_ms()
+        self.duration_ms = 0
+        self.ramp_ms = 0
+        self.velocity = 0.0       # Of the unit profile, per ms
+        self.acceleration = 0.0   # Per ms^2
+
+    def plan(self, distances, limits):
+        # One profile from 0 to 1 for all joints of the motion. Its velocity
+        # and acceleration are the tightest of the joints' limits divided by
+        # their distances, so every joint stays within its own limits and
+        # all of them arrive together.
+        velocity = acceleration = 0.0
+        for joint, distance in distances:
+            if distance > 0:
+                joint_velocity = limits[joint][0] / distance
+                joint_acceleration = limits[joint][1] / distance
+                if not velocity or joint_velocity < velocity:
+                    velocity = joint_velocity
+                if not acceleration or joint_acceleration < acceleration:
+                    acceleration = joint_acceleration
+        if not velocity:
+            return
+        if velocity * velocity >= acceleration:
+            ramp = (1 / acceleration) ** 0.5  # Never reaches cruise speed
+            velocity = acceleration * ramp
+            duration = 2 * ramp
+        else:
+            ramp = velocity / acceleration
+            duration = ramp + 1 / velocity
+        self.duration_ms = int(duration * 1000 + 0.999)
+        self.ramp_ms = ramp * 1000
+        self.velocity = velocity / 1000
+        self.acceleration = acceleration / 1000000
+
+    def progress(self, now):
+        t = time.ticks_diff(now, self.started)
+        if t >= self.duration_ms:
+            return 1.0
+        if t < self.ramp_ms:
+            return self.acceleration * t * t / 2
+        if t <= self.duration_ms - self.ramp_ms:
+            return self.velocity * (t - self.ramp_ms / 2)
+        left = self.duration_ms - t
+        return 1 - self.acceleration * left * left / 2
+
+    def cancel(self):
+        self.servos.finish(self, 'cancelled')
+
+    def to_dict(self):
+        return {"id": self.id, "joints": [JOINTS[joint] for joint in self.joints], "state": self.state,
+                "duration_ms": self.duration_ms}
+
+class ServoManager:
+    def __init__(self, arm, pins, freqs=JOINT_FREQS, duty_ranges=JOINT_DUTY_RANGE, limits=SERVO_LIMITS,
+                 relax_ms=SERVO_RELAX_MS):
+        self.arm = arm
+        self.pins = pins
+        self.freqs = freqs
+        self.relax_ms = relax_ms
+        self.limits = [list(limit) for limit in limits]
+        self.tables = [array('B', [low + (high - low) * angle // 180 for angle in range(181)])
+                       for low, high in duty_ranges]
+        self.pwms = [None, None, None]
+        self.angles = [0.0, 0.0, 0.0]
+        self.origins = [0.0, 0.0, 0.0]   # Where the current move of each joint started
+        self.targets = [0.0, 0.0, 0.0]
+        self.plans = [None, None, None]  # Motion whose profile moves each joint
+        self.owners = [None, None, None]  # Motion each joint belongs to
+        self.active = [time.ticks_ms()] * 3
+        self.next_id = 1
+        self.wake = asyncio.Event()
+        self.task = None
+
+    def channel(self, joint):
+        if self.pwms[joint] is None:
+            # Created at the current position so the servo doesn't jump
+            self.pwms[joint] = PWM(self.pins[joint], freq=self.freqs[joint],
+                                   duty=self.duty(joint, self.angles[joint]))
+        return self.pwms[joint]
+
+    def release(self, joint):
+        if self.pwms[joint] is not None:
+            self.pwms[joint].deinit()
+            self.pins[joint].init(Pin.IN)
+            self.pwms[joint] = None
+
+    def duty(self, joint, angle):
+        return self.tables[joint][int(min(180.0, max(0.0, angle)) + 0.5)]
+
+    def write(self, joint, angle):
+        self.channel(joint).duty(self.duty(joint, angle))
+        self.active[joint] = time.ticks_ms()
+
+    def write_duty(self, joint, duty):
+        # Raw duty from the trajectory player, which does its own timing
+        self.angles[joint] = self.targets[joint] = self.arm.duty_to_angle(duty)
+        self.plans[joint] = None
+        self.channel(joint).duty(duty)
+        self.active[joint] = time.ticks_ms()
+
+    def set_angle(self, joint, angle):
+        # Bookkeeping only: where the joint is known to be
+        self.angles[joint] = self.targets[joint] = angle
+        self.plans[joint] = None
+
+    def configure(self, joint, velocity=None, acceleration=None):
+        # /limits?joint=elbow&velocity=300&acceleration=1500; applies from the next move
+        if joint not in JOINTS:
+            raise ValueError("Unknown joint: " + str(joint))
+        limit = self.limits[JOINTS.index(joint)]
+        velocity = limit[0] if velocity is None else float(velocity)
+        acceleration = limit[1] if acceleration is None else float(acceleration)
+        if not SERVO_VELOCITY_RANGE[0] <= velocity <= SERVO_VELOCITY_RANGE[1]:
+            raise ValueError("Velocity must be between %d and %d deg/s" % SERVO_VELOCITY_RANGE)
+        if not SERVO_ACCELERATION_RANGE[0] <= acceleration <= SERVO_ACCELERATION_RANGE[1]:
+            raise ValueError("Acceleration must be between %d and %d deg/s^2" % SERVO_ACCELERATION_RANGE)
+        limit[0], limit[1] = velocity, acceleration
+
+    def moving(self):
+        return self.plans[0] is not None or self.plans[1] is not None or self.plans[2] is not None
+
+    def motions(self):
+        found = []
+        for motion in self.owners:
+            if motion is not None and motion not in found:
+                found.append(motion)
+        return found
 
+    def start(self, targets, streamed=False):
+        # targets: {joint name: angle}. Returns the new motion.
+        moves = [(JOINTS.index(joint), float(angle)) for joint, angle in targets.items()]
+        motion = ServoMotion(self, self.next_id, [joint for joint, angle in moves], streamed)
+        self.next_id += 1
+        for joint, angle in moves:
+            if self.owners[joint] is not None:
+                self.finish(self.owners[joint], 'preempted')
+            self.owners[joint] = motion
+            self.origins[joint] = self.angles[joint]
+            self.targets[joint] = angle
+            self.plans[joint] = None if streamed else motion
+        if not streamed:
+            motion.plan([(joint, abs(angle - self.angles[joint])) for joint, angle in moves], self.limits)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        self.wake.set()
+        return motion
+
+    def finish(self, motion, state):
+        if motion.state != 'moving':
+            return
+        motion.state = state
+        for joint in motion.joints:
+            if self.owners[joint] is motion:
+                self.owners[joint] = None
+                if state == 'cancelled':
+                    self.targets[joint] = self.angles[joint]
+                    self.plans[joint] = None
+        motion.done.set()
+
+    def hold(self):
+        # Stop every joint where it is now, including joints that are still
+        # finishing a preempted motion
+        for motion in self.motions():
+            motion.cancel()
+        for joint in range(3):
+            self.targets[joint] = self.angles[joint]
+            self.plans[joint] = None
+
+    def arrive(self):
+        for motion in self.motions():
+            if not motion.streamed and not any(self.plans[joint] is motion for joint in motion.joints):
+                self.finish(motion, 'done')
+
+    async def move(self, targets):
+        motion = self.start(targets)
+        try:
+            await motion.done.wait()
+        except asyncio.CancelledError:
+            # Emergency stop mid-move: the joints stay where they were left
+            motion.cancel()
+            raise
+        if motion.state != 'done':
+            raise MotionInterrupted(motion)
+        await asyncio.sleep_ms(SERVO_SETTLE_MS)
+        return motion
+
+    async def run(self):
+        deadline = time.ticks_ms()
+        try:
+            while True:
+                try:
+                    deadline = await self.tick(deadline)
+                except Exception as e:
+                    # One failed write must not stall the arm for good: the
+                    # motions of the joints are cancelled and the loop goes on
+                    print(f"Error in servo loop: {e}")
+                    self.hold()
+                    await asyncio.sleep_ms(SERVO_TICK_MS)
+                    deadline = time.ticks_ms()
+        finally:
+            self.task = None  # The next move starts a new loop
+            self.hold()
+
+    async def tick(self, deadline):
+        # One pass of the servo loop; returns the deadline of the next one
+        if not self.moving():
+            self.arrive()
+            now = time.ticks_ms()
+            timeout = 1000
+            for joint in range(3):
+                if self.relax_ms and self.pwms[joint] is not None:
+                    left = self.relax_ms - time.ticks_diff(now, self.active[joint])
+                    if left <= 0:
+                        self.release(joint)
+                    else:
+                        timeout = min(timeout, left)
+            try:
+                await asyncio.wait_for_ms(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            return time.ticks_ms()
+        now = time.ticks_ms()
+        for joint in range(3):
+            motion = self.plans[joint]
+            if motion is None:
+                continue
+            progress = motion.progress(now)
+            if progress >= 1:
+                self.angles[joint] = self.targets[joint]
+                self.plans[joint] = None
+            else:
+                self.angles[joint] = self.origins[joint] + (self.targets[joint] - self.origins[joint]) * progress
+            self.write(joint, self.angles[joint])
+        self.arrive()
+        deadline = time.ticks_add(deadline, SERVO_TICK_MS)
+        await asyncio.sleep_ms(max(0, time.ticks_diff(deadline, time.ticks_ms())))
+        return deadline
+
+    def status(self):
+        # Per joint: where it is, where it is heading and the motion moving it
+        joints = {}
+        for joint in range(3):
+            owner = self.owners[joint]
+            joints[JOINTS[joint]] = {
+                "angle": round(self.angles[joint], 1),
+                "target": round(self.targets[joint], 1),
+                "moving": self.plans[joint] is not None or (owner is not None and owner.streamed),
+                "motion": None if owner is None else owner.id
+            }
+        return joints
+
+    def to_dict(self):
+        return {
+            "moving": self.moving(),
+            "motions": [motion.to_dict() for motion in self.motions()],
+            "powered": [joint for joint in range(3) if self.pwms[joint] is not None],
+            "limits": {JOINTS[joint]: self.limits[joint] for joint in range(3)},
+            "relax_ms": self.relax_ms
+        }
 
 class RoboticArm:
     def __init__(self, pin_shoulder, pin_elbow, pin_gripper):
         self.pin_shoulder = Pin(pin_shoulder, Pin.OUT)
         self.pin_elbow = Pin(pin_elbow, Pin.OUT)
         self.pin_gripper = Pin(pin_gripper, Pin.OUT)
-        
-        self.current_angle_shoulder = 0
-        self.current_angle_elbow = 0
-        self.current_angle_gripper = 0
+        self.servos = ServoManager(self, (self.pin_shoulder, self.pin_elbow, self.pin_gripper))
+
+    # The angles live in the servo manager
+    @property
+    def current_angle_shoulder(self):
+        return self.servos.angles[0]
+
+    @current_angle_shoulder.setter
+    def current_angle_shoulder(self, angle):
+        self.servos.set_angle(0, angle)
+
+    @property
+    def current_angle_elbow(self):
+        return self.servos.angles[1]
+
+    @current_angle_elbow.setter
+    def current_angle_elbow(self, angle):
+        self.servos.set_angle(1, angle)
+
+    @property
+    def current_angle_gripper(self):
+        return self.servos.angles[2]
+
+    @current_angle_gripper.setter
+    def current_angle_gripper(self, angle):
+        self.servos.set_angle(2, angle)
 
     def angle_to_duty(self, angle, min_duty=40, max_duty=115):
         return int(min_duty + (angle / 180) * (max_duty - min_duty))
 
-    async def move_servo(self, pin, angle, freq, current_angle_attr):
-        pwm = PWM(pin, freq=freq)
-        current_angle = getattr(self, current_angle_attr)
-        steps = max(int(abs(angle - current_angle) / 5), 1)  # Increase step resolution for smoother movement
-        step_angle = (angle - current_angle) / steps
-
-        for _ in range(steps):
-            current_angle += step_angle
-            duty = self.angle_to_duty(current_angle)
-            pwm.duty(int(duty))
-            await asyncio.sleep_ms(20)  # Adjust sleep time for smoother movement
-
-        # Final position
-        pwm.duty(self.angle_to_duty(angle))
-        await asyncio.sleep(0.5)  # Give the servo some time to settle
-        pwm.deinit()
-        pin.init(Pin.IN)  # Reset pin to input to clear state
-        print(f"Servo is at {angle} degrees")
-        setattr(self, current_angle_attr, angle)
+    def duty_to_angle(self, duty, min_duty=40, max_duty=115):
+        return round((duty - min_duty) * 180 / (max_duty - min_duty))
+
+    async def move_joints(self, targets):
+        # {"shoulder": 180, "elbow": 180} moves both joints at once. Raises
+        # MotionInterrupted if another command takes over one of the joints.
+        return await self.servos.move(targets)
 
     async def move_shoulder(self, angle):
-        await self.move_servo(self.pin_shoulder, angle, 60, 'current_angle_shoulder')
+        await self.move_joints({'shoulder': angle})
 
     async def move_elbow(self, angle):
-        await self.move_servo(self.pin_elbow, angle, 70, 'current_angle_elbow')
+        await self.move_joints({'elbow': angle})
 
     async def move_gripper(self, angle):
-        await self.move_servo(self.pin_gripper, angle, 30, 'current_angle_gripper')
+        await self.move_joints({'gripper': angle})
 
     async def move_shoulder_up(self):
         await self.move_shoulder(180)
@@ -246,53 +1196,317 @@ class RoboticArm:
         await self.move_gripper(55)
     
     async def expand_arm(self):
-        await self.move_shoulder_up()
-        await self.expand_elbow()
+        await self.move_joints({'shoulder': 180, 'elbow': 180})
     
     async def close_arm(self):
-        await self.close_elbow()
-        await self.move_shoulder_down()
+        await self.move_joints({'elbow': 0, 'shoulder': 40})
 
     def get_current_state(self):
         return {
-            "shoulder": self.current_angle_shoulder,
-            "elbow": self.current_angle_elbow,
-            "gripper": self.current_angle_gripper
+            "shoulder": round(self.current_angle_shoulder),
+            "elbow": round(self.current_angle_elbow),
+            "gripper": round(self.current_angle_gripper)
         }
 
+    async def move_joint(self, joint, angle):
+        if joint == 'shoulder':
+            await self.move_shoulder(angle)
+        elif joint == 'elbow':
+            await self.move_elbow(angle)
+        elif joint == 'gripper':
+            await self.move_gripper(angle)
+        else:
+            raise ValueError("Unknown joint: " + joint)
+
+    async def run_sequence(self, steps):
+        # Execute all steps back to back on the device, holding for duration_ms after each one
+        for joint, angle, duration_ms in steps:
+            await self.move_joint(joint, angle)
+            if duration_ms:
+                await asyncio.sleep_ms(duration_ms)
+
+# Host-planned trajectories (arm_trajectory.py). The host streams precomputed
+# waypoints of three duties (shoulder, elbow, gripper; one byte each) as hex in
+# numbered batches: /trajectory?seq=0&dt=20&w=4c4d2a...&end=1&a=b45a23
+# (a: the three target angles, one byte each, kept as the arm state on
+# arrival). The player
+# applies one waypoint every dt ms on all joints at once, so the board does no
+# maths at all. A full buffer holds the host's request until there is room;
+# the last batch is answered once the arm has arrived.
+TRAJECTORY_BUFFER = 150        # Waypoints (3 s at 20 ms)
+TRAJECTORY_TIMEOUT_MS = 1000   # Give up if the host stops sending mid-trajectory
+TRAJECTORY_SETTLE_MS = 200
+
+class TrajectoryPlayer:
+    def __init__(self, arm):
+        self.arm = arm
+        self.buffer = bytearray()
+        self.head = 0              # Read offset into buffer
+        self.dt_ms = 20
+        self.next_seq = 0
+        self.ended = True
+        self.generation = 0        # Bumped by every new trajectory
+        self.task = None
+        self.motion = None         # Servo motion of the playing trajectory
+        self.played = 0
+        self.underruns = 0
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def queue(self, seq, dt_ms, waypoints, end, angles=None):
+        if len(waypoints) % 3 or not 5 <= dt_ms <= 1000:
+            raise ValueError("Invalid trajectory batch")
+        # Checked before anything is queued: the servo tables end at these duties
+        for index in range(len(waypoints)):
+            low, high = JOINT_DUTY_RANGE[index % 3]
+            if not low <= waypoints[index] <= high:
+                raise ValueError("Waypoint duty out of range")
+        if angles and max(angles) > 180:
+            raise ValueError("Target angle out of range")
+        if seq == 0:
+            # A new trajectory replaces the one playing
+            self.cancel()
+            self.buffer = bytearray()
+            self.head = 0
+            self.dt_ms = dt_ms
+            self.generation += 1
+            self.played = 0
+            self.underruns = 0
+        elif seq != self.next_seq or self.ended:
+            raise ValueError("Trajectory batch out of order")
+        generation = self.generation
+        while len(self.buffer) - self.head + len(waypoints) > TRAJECTORY_BUFFER * 3:
+            await asyncio.sleep_ms(self.dt_ms)
+            if generation != self.generation or self.task is None:
+                raise ValueError("Trajectory aborted")
+        self.buffer = self.buffer[self.head:] + waypoints
+        self.head = 0
+        self.next_seq = seq + 1
+        self.ended = end
+        task = self.task
+        if task is None:
+            task = self.task = asyncio.create_task(self.play())
+            arm_motions.add(task)  # Cancelled by /stop and /halt like any arm move
+        if not end:
+            return {"message": "Batch queued", "seq": seq, "buffered": (len(self.buffer) - self.head) // 3}
+        await task
+        if self.motion.state == 'preempted':
+            raise MotionInterrupted(self.motion)
+        if angles:
+            # Duties are coarser than degrees, so the exact targets are kept
+            self.arm.current_angle_shoulder, self.arm.current_angle_elbow, self.arm.current_angle_gripper = angles
+        return {
+            "message": "Trajectory executed",
+            "waypoints": self.played,
+            "underruns": self.underruns,
+            "angles": self.arm.get_current_state()
+        }
+
+    async def play(self):
+        # Writes through the servo manager's channels, which stay powered
+        # afterwards like after any other move. The trajectory owns all three
+        # joints as one motion, so an arm command sent meanwhile preempts it.
+        servos = self.arm.servos
+        motion = self.motion = servos.start(dict(zip(JOINTS, servos.angles)), True)
+        idle_ms = 0
+        deadline = time.ticks_ms()
+        try:
+            while motion.state == 'moving':
+                if self.head < len(self.buffer):
+                    for joint in range(3):
+                        servos.write_duty(joint, self.buffer[self.head + joint])
+                    self.head += 3
+                    self.played += 1
+                    idle_ms = 0
+                elif self.ended:
+                    break
+                else:
+                    # Buffer ran dry: hold the last waypoint until the next batch
+                    self.underruns += 1
+                    idle_ms += self.dt_ms
+                    if idle_ms >= TRAJECTORY_TIMEOUT_MS:
+                        break
+                deadline = time.ticks_add(deadline, self.dt_ms)
+                await asyncio.sleep_ms(max(0, time.ticks_diff(deadline, time.ticks_ms())))
+            if motion.state == 'moving':
+                servos.finish(motion, 'done')
+                await asyncio.sleep_ms(TRAJECTORY_SETTLE_MS)
+        finally:
+            motion.cancel()  # Only if the task itself was cancelled
+            arm_motions.discard(asyncio.current_task())
+            if self.task is asyncio.current_task():
+                self.task = None
+                self.ended = True
+
+# Named arm sequences ("macros"), kept on the flash so they survive a reboot
+MACROS_FILE = 'macros.json'
+
+def load_macros():
+    try:
+        with open(MACROS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_macros():
+    with open(MACROS_FILE, 'w') as f:
+        json.dump(macros, f)
+
+def parse_query(path):
+    query = path.split('?')[-1] if '?' in path else ''
+    return {kv.split('=')[0]: kv.split('=')[1] for kv in query.split('&') if '=' in kv}
+
+def parse_steps(spec):
+    # "shoulder:180:500,elbow:90" -> [("shoulder", 180, 500), ("elbow", 90, 0)]
+    steps = []
+    for item in spec.split(','):
+        fields = item.split(':')
+        if len(fields) < 2 or fields[0] not in ('shoulder', 'elbow', 'gripper'):
+            raise ValueError("Invalid step: " + item)
+        angle = int(fields[1])
+        duration_ms = int(fields[2]) if len(fields) > 2 and fields[2] else 0
+        if angle < 0 or angle > 180 or duration_ms < 0:
+            raise ValueError("Step out of range: " + item)
+        steps.append((fields[0], angle, duration_ms))
+    return steps
+
 async def handle_client_arm(reader, writer):
     try:
         request_line = await reader.readline()
+        received = time.ticks_us()
         method, path, protocol = request_line.decode().strip().split()
+        route = path.split('?')[0]
+        status = '200 OK'
+        parsed = time.ticks_us()
+        motion = asyncio.current_task()
+        if route not in STOP_ROUTES:
+            arm_motions.add(motion)  # So a stop on either server can cancel it
 
-        if method == 'GET' and path == '/move_shoulder_up':
-            await robotic_arm.move_shoulder_up()
-            response = json.dumps({"message": "Shoulder moved up"})
-        elif method == 'GET' and path == '/move_shoulder_down':
-            await robotic_arm.move_shoulder_down()
-            response = json.dumps({"message": "Shoulder moved down"})
-        elif method == 'GET' and path == '/expand_elbow':
-            await robotic_arm.expand_elbow()
-            response = json.dumps({"message": "Elbow expanded"})
-        elif method == 'GET' and path == '/close_elbow':
-            await robotic_arm.close_elbow()
-            response = json.dumps({"message": "Elbow closed"})
-        elif method == 'GET' and path == '/open_gripper':
-            await robotic_arm.open_gripper()
-            response = json.dumps({"message": "Gripper opened"})
-        elif method == 'GET' and path == '/close_gripper':
-            await robotic_arm.close_gripper()
-            response = json.dumps({"message": "Gripper closed"})
-        elif method == 'GET' and path == '/expand_arm':
-            await robotic_arm.expand_arm()
-            response = json.dumps({"message": "Arm expanded"})
-        elif method == 'GET' and path == '/close_arm':
-            await robotic_arm.close_arm()
-            response = json.dumps({"message": "Arm closed"})
-        else:
-            response = "HTTP/1.1 404 Not Found\r\n\r\n"
+        try:
+            if method == 'GET' and route in STOP_ROUTES:
+                body = await emergency_stop(route)
+            elif halted and route not in ('/ping', '/macros', '/state', '/status'):
+                status = '423 Locked'
+                body = {"message": "Board halted, send /resume"}
+            elif method == 'GET' and route == '/move_shoulder_up':
+                await robotic_arm.move_shoulder_up()
+                body = {"message": "Shoulder moved up"}
+            elif method == 'GET' and route == '/move_shoulder_down':
+                await robotic_arm.move_shoulder_down()
+                body = {"message": "Shoulder moved down"}
+            elif method == 'GET' and route == '/expand_elbow':
+                await robotic_arm.expand_elbow()
+                body = {"message": "Elbow expanded"}
+            elif method == 'GET' and route == '/close_elbow':
+                await robotic_arm.close_elbow()
+                body = {"message": "Elbow closed"}
+            elif method == 'GET' and route == '/open_gripper':
+                await robotic_arm.open_gripper()
+                body = {"message": "Gripper opened"}
+            elif method == 'GET' and route == '/close_gripper':
+                await robotic_arm.close_gripper()
+                body = {"message": "Gripper closed"}
+            elif method == 'GET' and route == '/expand_arm':
+                await robotic_arm.expand_arm()
+                body = {"message": "Arm expanded"}
+            elif method == 'GET' and route == '/close_arm':
+                await robotic_arm.close_arm()
+                body = {"message": "Arm closed"}
+            elif method == 'GET' and route == '/sequence':
+                steps = parse_steps(parse_query(path).get('steps', ''))
+                await robotic_arm.run_sequence(steps)
+                body = {"message": "Sequence executed", "steps": len(steps)}
+            elif method == 'GET' and route == '/save_macro':
+                params = parse_query(path)
+                name = params.get('name')
+                if not name:
+                    raise ValueError("Missing macro name")
+                macros[name] = parse_steps(params.get('steps', ''))
+                save_macros()
+                body = {"message": "Macro saved", "name": name}
+            elif method == 'GET' and route == '/run_macro':
+                name = parse_query(path).get('name')
+                if name not in macros:
+                    status = '404 Not Found'
+                    body = {"message": "Unknown macro"}
+                else:
+                    await robotic_arm.run_sequence(macros[name])
+                    body = {"message": "Macro executed", "name": name}
+            elif method == 'GET' and route == '/trajectory':
+                params = parse_query(path)
+                angles = ubinascii.unhexlify(params.get('a', ''))
+                if angles and len(angles) != 3:
+                    raise ValueError("Expected three target angles")
+                body = await trajectory.queue(int(params.get('seq', -1)), int(params.get('dt', 20)),
+                                              ubinascii.unhexlify(params.get('w', '')), params.get('end') == '1',
+                                              angles)
+            elif method == 'GET' and route == '/state':
+                body = {"message": "Arm state", "angles": robotic_arm.get_current_state(), "servos": robotic_arm.servos.to_dict()}
+            elif method == 'GET' and route == '/status':
+                # Cheap enough to poll while the arm moves
+                joints = robotic_arm.servos.status()
+                body = {"message": "Arm status", "angles": robotic_arm.get_current_state(),
+                        "moving": any(joint['moving'] for joint in joints.values()), "joints": joints,
+                        "motions": [item.to_dict() for item in robotic_arm.servos.motions()]}
+            elif method == 'GET' and route == '/cancel':
+                # /cancel?id=3 stops one motion where it is, /cancel all of them.
+                # Unlike /stop, waiting commands get a 409 and nothing is latched.
+                motion_id = parse_query(path).get('id')
+                motions = robotic_arm.servos.motions()
+                if motion_id is not None:
+                    motions = [item for item in motions if item.id == int(motion_id)]
+                if motion_id is not None and not motions:
+                    status = '404 Not Found'
+                    body = {"message": "Unknown motion"}
+                else:
+                    for item in motions:
+                        item.cancel()
+                    if motion_id is None:
+                        robotic_arm.servos.hold()
+                    body = {"message": "Motion cancelled", "cancelled": [item.id for item in motions]}
+            elif method == 'GET' and route == '/limits':
+                # /limits?joint=elbow&velocity=300&acceleration=1500 (deg/s, deg/s^2)
+                params = parse_query(path)
+                if 'joint' in params:
+                    robotic_arm.servos.configure(params['joint'], params.get('velocity'), params.get('acceleration'))
+                body = {"message": "Servo limits", "limits": robotic_arm.servos.to_dict()['limits']}
+            elif method == 'GET' and route == '/ping':
+                body = {"message": "pong"}  # Health probe from the host
+            elif method == 'GET' and route == '/macros':
+                body = {"message": "Macros listed", "macros": macros}
+            else:
+                status = '404 Not Found'
+                body = {"message": "Not Found"}
+        except ValueError as e:
+            status = '400 Bad Request'
+            body = {"message": str(e)}
+        except MotionInterrupted as e:
+            status = '409 Conflict'
+            body = {"message": "Motion " + e.args[0].state, "motion": e.args[0].to_dict(),
+                    "angles": robotic_arm.get_current_state()}
+        except asyncio.CancelledError:
+            status = '409 Conflict'
+            body = {"message": "Motion cancelled by emergency stop"}
+        finally:
+            arm_motions.discard(motion)
 
-        writer.write(response.encode())
+        rid = parse_query(path).get('rid')
+        if rid:
+            # Hop timings for the host's latency trace: request parsing, the motion
+            # itself (until the servos settled) and the whole handler
+            done = time.ticks_us()
+            body['trace'] = {
+                "rid": rid,
+                "parse_us": time.ticks_diff(parsed, received),
+                "motion_us": time.ticks_diff(done, parsed),
+                "firmware_us": time.ticks_diff(done, received)
+            }
+        response = json.dumps(body)
+
+        writer.write(('HTTP/1.1 ' + status + '\r\nContent-Type: application/json\r\n\r\n' + response).encode())
         await writer.drain()
         writer.close()
 
@@ -302,6 +1516,9 @@ async def handle_client_arm(reader, writer):
 
 
 async def main():
+    asyncio.create_task(sensors.run())  # The only place the car's sensors are read, Wi-Fi or not
+    asyncio.create_task(controller.run())  # The only place the car's motors are driven
+
     ssid = "OPPO A54"
     password = "11111111"
     station = network.WLAN(network.STA_IF)
@@ -316,6 +1533,7 @@ async def main():
     
     server_car = await asyncio.start_server(handle_client_car, '0.0.0.0', 8081)  # Use port 8081 instead of 80
     print('Server running on http://0.0.0.0:8081')
+    asyncio.create_task(udp_teleop(8081))  # Binary teleop datagrams on UDP 8081
 
     server_arm = await asyncio.start_server(handle_client_arm, '0.0.0.0', 8080)  # Use port 8080 instead of 80
     print('Server running on http://0.0.0.0:8080')
@@ -328,6 +1546,8 @@ async def main():
 
 try:
     robotic_arm = RoboticArm(pin_shoulder=23, pin_elbow=22, pin_gripper=21)
+    trajectory = TrajectoryPlayer(robotic_arm)
+    macros = load_macros()
     asyncio.run(main())
 except KeyboardInterrupt:
     print("Server stopped")
@@ -0,0 +1,26 @@
+from micropython_hal.timebase import Clock
+from micropython_hal.recorder import Trace, stats
+
+# MicroPython hardware emulation so the files in micro_conrollers/ run
+# unmodified under CPython (see run.py). All HAL modules share one clock and
+# one trace; reset() starts a fresh run.
+clock = Clock(virtual=True)
+trace = Trace()
+
+
+class Config:
+    host = '127.0.0.1'  # Address servers bind to instead of 0.0.0.0
+    port_offset = 0     # Added to every start_server port so several boards can run side by side
+    duration_s = None   # uasyncio.run() returns after this much (virtual or real) time
+    startup = []        # Coroutine functions started next to the firmware's main task
+
+
+config = Config()
+
+
+def reset(virtual=True):
+    from micropython_hal import machine
+    clock.reset(virtual)
+    trace.clear()
+    machine.reset_state()
+    config.startup = []
@@ -0,0 +1,228 @@
+from micropython_hal import clock, trace
+
+# Emulated machine module. Pin levels, PWM settings and IRQ handlers live in a
+# per-pin-number registry, so two Pin objects for the same number share state
+# the way they do on the board. Every write is recorded in the trace.
+
+
+class _PinState:
+    def __init__(self, id):
+        self.id = id
+        self.mode = None
+        self.pull = None
+        self.level = 0          # Level driven by the firmware (output mode)
+        self.input = None       # Scripted input: a value or fn(t_us) -> value
+        self.irq_handler = None
+        self.irq_trigger = 0
+        self.listeners = []     # fn(old, new) called on every output change (sensor models)
+        self.duty = None
+        self.freq = None
+
+
+_pins = {}
+
+
+def _state(id):
+    if id not in _pins:
+        _pins[id] = _PinState(id)
+    return _pins[id]
+
+
+def reset_state():
+    _pins.clear()
+
+
+def _read_input(state):
+    source = state.input
+    if callable(source):
+        return int(source(clock.ticks_us()))
+    if source is None:
+        return 1 if state.pull == Pin.PULL_UP else 0
+    return int(source)
+
+
+def _set_input(id, value):
+    # Called by sensors.py; fires the pin IRQ on the matching edge
+    state = _state(id)
+    old = _read_input(state)
+    state.input = value
+    new = _read_input(state)
+    if old == new or state.irq_handler is None:
+        return
+    if (new and state.irq_trigger & Pin.IRQ_RISING) or (not new and state.irq_trigger & Pin.IRQ_FALLING):
+        state.irq_handler(Pin(id))
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        state = _state(self.id)
+        if mode != -1:
+            state.mode = mode
+        if pull != -1:
+            state.pull = pull
+        trace.record(clock.ticks_us(), 'init', self.id, state.mode)
+        if value is not None:
+            self.value(value)
+
+    def value(self, x=None):
+        state = _state(self.id)
+        if x is None:
+            if state.mode in (Pin.OUT, Pin.OPEN_DRAIN):
+                return state.level
+            # Reading an input costs a microsecond so polling loops move virtual time forward
+            if clock.virtual:
+                clock.advance(1)
+                clock.check_deadline()
+            return _read_input(state)
+        old, state.level = state.level, 1 if x else 0
+        trace.record(clock.ticks_us(), 'pin', self.id, state.level)
+        for listener in list(state.listeners):
+            listener(old, state.level)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def __call__(self, x=None):
+        return self.value(x)
+
+    def irq(self, handler=None, trigger=IRQ_RISING | IRQ_FALLING, hard=False):
+        state = _state(self.id)
+        state.irq_handler = handler
+        state.irq_trigger = trigger
+        return self
+
+    def __repr__(self):
+        return 'Pin(%s)' % self.id
+
+
+class PWM:
+    def __init__(self, dest, freq=None, duty=None, duty_u16=None):
+        self.pin = dest if isinstance(dest, Pin) else Pin(dest)
+        self.init(freq, duty, duty_u16)
+
+    def init(self, freq=None, duty=None, duty_u16=None):
+        if freq is not None:
+            self.freq(freq)
+        if duty is not None:
+            self.duty(duty)
+        if duty_u16 is not None:
+            self.duty_u16(duty_u16)
+
+    def freq(self, value=None):
+        state = _state(self.pin.id)
+        if value is None:
+            return state.freq
+        state.freq = int(value)
+        trace.record(clock.ticks_us(), 'freq', self.pin.id, state.freq)
+
+    def duty(self, value=None):
+        # 10-bit duty (0..1023) as on the ESP32 port
+        state = _state(self.pin.id)
+        if value is None:
+            return state.duty or 0
+        state.duty = max(0, min(1023, int(value)))
+        trace.record(clock.ticks_us(), 'duty', self.pin.id, state.duty)
+
+    def duty_u16(self, value=None):
+        state = _state(self.pin.id)
+        if value is None:
+            return (state.duty or 0) * 65535 // 1023
+        state.duty = max(0, min(65535, int(value))) * 1023 // 65535
+        trace.record(clock.ticks_us(), 'duty', self.pin.id, state.duty)
+
+    def deinit(self):
+        state = _state(self.pin.id)
+        state.duty = None
+        trace.record(clock.ticks_us(), 'deinit', self.pin.id, None)
+
+
+def time_pulse_us(pin, pulse_level, timeout_us=1000000):
+    # Same contract as the board: -2 if the pulse never started within
+    # timeout_us, -1 if it did not end within timeout_us. In virtual mode the
+    # clock jumps from edge to edge instead of spinning.
+    def wait_for(level):
+        started = clock.ticks_us()
+        deadline = started + timeout_us
+        while pin.value() != level:
+            now = clock.ticks_us()
+            if now >= deadline:
+                return False
+            if clock.virtual and not callable(_state(pin.id).input):
+                next_us = clock.next_timer_us()
+                clock.advance((deadline if next_us is None else min(next_us, deadline)) - now)
+        return True
+
+    if not wait_for(pulse_level):
+        return -2
+    started = clock.ticks_us()
+    if not wait_for(1 - pulse_level):
+        return -1
+    return clock.ticks_us() - started
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.id = id
+        self.generation = 0
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, callback=None, freq=None):
+        self.deinit()
+        period_us = int(1000000 / freq) if freq else int(period) * 1000
+        generation = self.generation
+
+        def fire(due_us):
+            if generation != self.generation:
+                return
+            if mode == Timer.PERIODIC:
+                clock.schedule(due_us + period_us, lambda: fire(due_us + period_us))
+            callback(self)
+
+        start = clock.ticks_us()
+        clock.schedule(start + period_us, lambda: fire(start + period_us))
+
+    def deinit(self):
+        self.generation += 1
+
+
+def freq(hz=None):
+    return 240000000 if hz is None else None
+
+
+def unique_id():
+    return b'\x24\x0a\xc4\x00\x00\x01'
+
+
+def idle():
+    clock.advance(1000)
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def reset():
+    raise SystemExit('machine.reset()')
@@ -0,0 +1,29 @@
+from micropython_hal import clock
+
+
+def const(value):
+    return value
+
+
+def native(fn):
+    return fn
+
+
+viper = native
+
+
+def schedule(fn, arg):
+    # Soft IRQ: runs at the current time, after the hard IRQ returns
+    clock.schedule(clock.ticks_us(), lambda: fn(arg))
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def mem_info(verbose=False):
+    pass
+
+
+def opt_level(level=None):
+    return 0
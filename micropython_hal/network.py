@@ -0,0 +1,56 @@
+from micropython_hal import clock
+
+STA_IF = 0
+AP_IF = 1
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+
+CONNECT_DELAY_US = 1500000  # Time an emulated station takes to join the access point
+
+
+# Emulated WLAN interface: connect() always succeeds after CONNECT_DELAY_US
+class WLAN:
+    def __init__(self, interface_id=STA_IF):
+        self.interface_id = interface_id
+        self.is_active = False
+        self.connected_at = None
+        self.essid = None
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self.is_active
+        self.is_active = bool(is_active)
+
+    def connect(self, ssid=None, key=None, **kwargs):
+        self.essid = ssid
+        self.connected_at = clock.ticks_us() + CONNECT_DELAY_US
+
+    def disconnect(self):
+        self.connected_at = None
+
+    def isconnected(self):
+        if self.interface_id == AP_IF:
+            return self.is_active
+        return self.connected_at is not None and clock.ticks_us() >= self.connected_at
+
+    def status(self, param=None):
+        if param == 'rssi':
+            return -50
+        if self.connected_at is None:
+            return STAT_IDLE
+        return STAT_GOT_IP if self.isconnected() else STAT_CONNECTING
+
+    def ifconfig(self, config=None):
+        from micropython_hal import config as hal_config
+        return (hal_config.host, '255.255.255.0', hal_config.host, '8.8.8.8')
+
+    def config(self, *args, **kwargs):
+        if args and args[0] in ('essid', 'ssid'):
+            return self.essid
+        if args and args[0] == 'mac':
+            return b'\x24\x0a\xc4\x00\x00\x01'
+        return None
+
+    def scan(self):
+        return []
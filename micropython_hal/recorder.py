@@ -0,0 +1,66 @@
+import csv
+import statistics
+
+
+# Timestamped record of every pin level and PWM change the firmware makes.
+# Each event is (t_us, kind, pin, value) with kind one of "pin", "duty",
+# "duty_u16", "freq", "init", "deinit" or a free-form marker.
+class Trace:
+    def __init__(self):
+        self.events = []
+        self.enabled = True
+
+    def record(self, t_us, kind, pin, value):
+        if self.enabled:
+            self.events.append((t_us, kind, pin, value))
+
+    def clear(self):
+        self.events = []
+
+    def select(self, pin=None, kind=None, since_us=None):
+        return [event for event in self.events
+                if (pin is None or event[2] == pin)
+                and (kind is None or event[1] == kind)
+                and (since_us is None or event[0] >= since_us)]
+
+    def changes(self, pin, kind=None):
+        # Only events where the value actually changed
+        result, last = [], object()
+        for event in self.select(pin, kind):
+            if event[3] != last:
+                result.append(event)
+                last = event[3]
+        return result
+
+    def intervals(self, pin, kind=None, changes_only=False):
+        events = self.changes(pin, kind) if changes_only else self.select(pin, kind)
+        return [b[0] - a[0] for a, b in zip(events, events[1:])]
+
+    def first_after(self, t_us, pin=None, kind=None, predicate=None):
+        # Response latency helper: first matching event at or after t_us
+        for event in self.events:
+            if event[0] >= t_us and (pin is None or event[2] == pin) \
+                    and (kind is None or event[1] == kind) \
+                    and (predicate is None or predicate(event[3])):
+                return event
+        return None
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('t_us', 'kind', 'pin', 'value'))
+            writer.writerows(self.events)
+
+
+def stats(values):
+    # Summary used for loop period / jitter reports (all values in microseconds)
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "min": min(values),
+        "max": max(values),
+        "stdev": statistics.pstdev(values),
+        "jitter": max(values) - min(values),
+    }
@@ -0,0 +1,183 @@
+import argparse
+import builtins
+import importlib
+import os
+import tempfile
+import types
+
+import micropython_hal as hal
+from micropython_hal import sensors, stats
+
+# Runs a firmware file unmodified under CPython with the emulated HAL:
+#
+#     python -m micropython_hal.run micro_conrollers/Full_Combined_code_car_arm.py \
+#         --duration 10 --scenario my_scenario.py --trace trace.csv
+#
+# Firmware imports of machine, network, uasyncio, time, ... resolve to the
+# HAL modules; everything else is a normal import. A scenario file can define
+# setup(hal) (called before the firmware starts, e.g. to wire sensors),
+# async run(firmware) (a task next to the firmware's main) and
+# check(firmware, trace) (called after the run, e.g. to assert timings).
+
+HAL_MODULES = {
+    'machine': 'machine',
+    'network': 'network',
+    'uasyncio': 'uasyncio',
+    'asyncio': 'uasyncio',
+    'utime': 'utime',
+    'time': 'utime',
+    'ujson': 'ujson',
+    'json': 'ujson',
+    'usocket': 'usocket',
+    'socket': 'usocket',
+    'micropython': 'micropython',
+}
+# MicroPython "u" modules whose CPython counterpart behaves the same
+STDLIB_ALIASES = {
+    'ure': 're',
+    'ustruct': 'struct',
+    'ubinascii': 'binascii',
+    'uselect': 'select',
+    'ucollections': 'collections',
+    'uhashlib': 'hashlib',
+    'uos': 'os',
+    'urandom': 'random',
+}
+
+
+class FirmwareLoader:
+    # Executes firmware sources with an __import__ that maps MicroPython module
+    # names to the HAL; sibling .py files are loaded the same way
+    def __init__(self, search_path):
+        self.search_path = search_path
+        self.modules = {}
+        self.builtins = dict(vars(builtins), __import__=self.import_module)
+
+    def import_module(self, name, globals=None, locals=None, fromlist=(), level=0):
+        root = name.split('.')[0]
+        if root in HAL_MODULES and level == 0:
+            return importlib.import_module('micropython_hal.' + HAL_MODULES[root])
+        if root in STDLIB_ALIASES and level == 0:
+            return importlib.import_module(STDLIB_ALIASES[root])
+        path = os.path.join(self.search_path, root + '.py')
+        if level == 0 and os.path.exists(path):
+            if root not in self.modules:
+                self.modules[root] = self.load(path, root)
+            return self.modules[root]
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def load(self, path, name='firmware'):
+        module = types.ModuleType(name)
+        module.__file__ = path
+        module.__builtins__ = self.builtins
+        self.modules[name] = module
+        with open(path) as f:
+            code = compile(f.read(), path, 'exec')
+        exec(code, module.__dict__)
+        return module
+
+
+def load_scenario(path):
+    scenario = types.ModuleType('scenario')
+    scenario.__file__ = path
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), scenario.__dict__)
+    return scenario
+
+
+def run(firmware_path, duration_s=None, virtual=True, scenario=None, flash_dir=None):
+    # Returns the firmware module (its globals after the run)
+    hal.reset(virtual)
+    hal.config.duration_s = duration_s
+    if duration_s is not None:
+        hal.clock.deadline_us = int(duration_s * 1000000)
+    firmware_path = os.path.abspath(firmware_path)
+    loader = FirmwareLoader(os.path.dirname(firmware_path))
+    # Run as the board runs main.py, so "if __name__ == '__main__'" guards fire
+    firmware = types.ModuleType('__main__')
+
+    if scenario is not None:
+        if hasattr(scenario, 'setup'):
+            scenario.setup(hal)
+        if hasattr(scenario, 'run'):
+            hal.config.startup.append(lambda: scenario.run(firmware))
+
+    # Files the firmware writes (macros.json, ...) go to a scratch "flash" directory
+    cwd = os.getcwd()
+    os.chdir(flash_dir or tempfile.mkdtemp(prefix='flash-'))
+    try:
+        firmware.__file__ = firmware_path
+        firmware.__builtins__ = loader.builtins
+        loader.modules['firmware'] = firmware
+        with open(firmware_path) as f:
+            code = compile(f.read(), firmware_path, 'exec')
+        exec(code, firmware.__dict__)
+    except KeyboardInterrupt:
+        pass  # Deadline reached inside a blocking loop
+    finally:
+        os.chdir(cwd)
+
+    if scenario is not None and hasattr(scenario, 'check'):
+        scenario.check(firmware, hal.trace)
+    return firmware
+
+
+def summary(trace):
+    # Per pin: number of writes and level changes, and the period/jitter of its writes
+    lines = [f'{len(trace.events)} events, {hal.clock.ticks_us() / 1000:.1f} ms emulated']
+    for pin in sorted({event[2] for event in trace.events}, key=str):
+        writes = trace.select(pin, 'pin') + trace.select(pin, 'duty')
+        if not writes:
+            continue
+        writes.sort()
+        periods = stats([b[0] - a[0] for a, b in zip(writes, writes[1:])])
+        line = f'pin {pin}: {len(writes)} writes, {len(trace.changes(pin, "pin")) + len(trace.changes(pin, "duty"))} changes'
+        if periods:
+            line += (f', period mean {periods["mean"]:.0f} us, min {periods["min"]} us, '
+                     f'max {periods["max"]} us, stdev {periods["stdev"]:.0f} us')
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run MicroPython firmware under CPython with an emulated ESP32')
+    parser.add_argument('firmware')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run (0 = until main() returns)')
+    parser.add_argument('--real', action='store_true',
+                        help='follow wall-clock time, e.g. to drive the firmware from the host apps')
+    parser.add_argument('--scenario', help='python file with setup(hal), async run(firmware), check(firmware, trace)')
+    parser.add_argument('--trace', metavar='CSV', help='write every pin/PWM event to this file')
+    parser.add_argument('--host', default='127.0.0.1', help='address 0.0.0.0 servers bind to')
+    parser.add_argument('--port-offset', type=int, default=0, help='added to every server port')
+    parser.add_argument('--distance', type=float,
+                        help='fixed ultrasonic distance in cm on trigger 27 / echo 26 (the car wiring)')
+    parser.add_argument('--world', action='store_true',
+                        help='drive the car in a room with obstacles (sensors.CarWorld) on the car wiring')
+    parser.add_argument('--flash-dir', help='directory the firmware reads and writes files in')
+    parser.add_argument('--no-trace', action='store_true', help='do not record pin events (long --real runs)')
+    args = parser.parse_args()
+
+    hal.config.host = args.host
+    hal.config.port_offset = args.port_offset
+    scenario = load_scenario(args.scenario) if args.scenario else None
+    if args.distance is not None or args.world:
+        scenario = scenario or types.SimpleNamespace()
+        setup = getattr(scenario, 'setup', None)
+
+        def wire_sensors(hal_module, setup=setup):
+            if args.world:
+                sensors.CarWorld(obstacles=[(180, 100, 230, 200), (300, 20, 340, 60)]).attach()
+            else:
+                sensors.ultrasonic(27, 26, args.distance)
+            if setup:
+                setup(hal_module)
+        scenario.setup = wire_sensors
+    hal.trace.enabled = not args.no_trace
+
+    try:
+        run(args.firmware, args.duration or None, not args.real, scenario, args.flash_dir)
+    except KeyboardInterrupt:
+        pass
+    print(summary(hal.trace))
+    if args.trace:
+        hal.trace.to_csv(args.trace)
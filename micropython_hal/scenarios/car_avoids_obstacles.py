@@ -0,0 +1,37 @@
+import asyncio
+
+from micropython_hal import sensors, stats
+
+# The car cruises through a room with two boxes on /move forward for 60 s of
+# virtual time. The avoidance state machine has to brake, back off and turn
+# every time something comes up ahead, so the car never touches a box or a
+# wall, and the sensor task keeps its 25 Hz rate throughout. Run it with
+#
+#     python -m micropython_hal.run micro_conrollers/Full_Combined_code_car_arm.py \
+#         --duration 60 --scenario micropython_hal/scenarios/car_avoids_obstacles.py
+
+DURATION_S = 60  # Used by tests/test_firmware_scenarios.py
+world = None
+
+
+def setup(hal):
+    global world
+    world = sensors.CarWorld(obstacles=[(180, 100, 230, 200), (300, 20, 340, 60)]).attach()
+
+
+async def run(firmware):
+    await asyncio.sleep(5)  # Wi-Fi connect and server start
+    firmware.controller.set("forward", 100)
+
+
+def check(firmware, trace):
+    print(f'travelled {world.travelled:.0f} cm, {world.collisions} collisions, '
+          f'{firmware.controller.avoidance.manoeuvres} manoeuvres')
+    assert world.collisions == 0, f'{world.collisions} collisions'
+    assert firmware.controller.avoidance.manoeuvres > 0, 'never had to avoid anything'
+    assert world.travelled > 500, 'the car got stuck'
+    # The sensor task triggers the ultrasonic every 40 ms (25 Hz)
+    pings = [event[0] for event in trace.select(27, 'pin') if event[3] == 1]
+    periods = stats([b - a for a, b in zip(pings, pings[1:])])
+    print(f'sensor period {periods["mean"]:.0f} us, jitter {periods["jitter"]} us')
+    assert abs(periods['mean'] - 40000) < 100 and periods['jitter'] < 3000, periods
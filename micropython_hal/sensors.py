@@ -0,0 +1,154 @@
+import math
+
+from micropython_hal import clock, machine
+
+# Scriptable inputs for the emulated board. Values are fixed levels or
+# functions of the clock (fn(t_us)); scheduled changes fire pin IRQs at the
+# exact virtual time they are due.
+
+SPEED_OF_SOUND_CM_PER_US = 0.0343
+ECHO_DELAY_US = 450  # HC-SR04: time between the trigger falling edge and the echo rising
+
+
+def set_input(pin, value):
+    machine._set_input(pin, value)
+
+
+def schedule_input(pin, changes):
+    # changes: [(t_us, value), ...] in absolute clock time
+    for at_us, value in changes:
+        clock.schedule(at_us, lambda value=value: machine._set_input(pin, value))
+
+
+def ultrasonic(trigger, echo, distance_cm):
+    # HC-SR04 model: every falling edge on trigger produces one echo pulse of
+    # 2 * distance / speed of sound. distance_cm is a number or fn(t_us); None
+    # or inf means no echo, so time_pulse_us times out.
+    def on_trigger(old, new):
+        if not (old and not new):
+            return
+        now = clock.ticks_us()
+        distance = distance_cm(now) if callable(distance_cm) else distance_cm
+        if distance is None or distance == float('inf'):
+            return
+        rise = now + ECHO_DELAY_US
+        schedule_input(echo, [(rise, 1), (rise + int(2 * distance / SPEED_OF_SOUND_CM_PER_US), 0)])
+
+    machine._state(trigger).listeners.append(on_trigger)
+    set_input(echo, 0)
+
+
+def pin_level(pin):
+    return machine._state(pin).level
+
+
+def pwm_duty(pin):
+    return machine._state(pin).duty
+
+
+# Closed-loop model of the car for testing its driving logic: a differential
+# drive in a rectangular room with box obstacles. The wheel speeds follow the
+# firmware's motor pins (in1/in2 per side set the direction, the enable PWM
+# duty the speed), the ultrasonic sees the nearest wall or box straight ahead
+# and the rear IR pin reads 0 while something is within ir_range_cm behind.
+# Below stall_duty a wheel does not turn at all, like a real gear motor.
+# The pose is integrated whenever a sensor is read, so it lags the motors by
+# at most one sensor period.
+class CarWorld:
+    def __init__(self, room=(400, 300), obstacles=(), start=(50, 150, 0), max_speed_cm_s=60,
+                 track_cm=25, radius_cm=10, ir_range_cm=10, stall_duty=0,
+                 right=(15, 2, 4), left=(13, 12, 14)):
+        self.room = room
+        self.obstacles = [tuple(box) for box in obstacles]  # (x0, y0, x1, y1) in cm
+        self.x, self.y, self.heading = start[0], start[1], math.radians(start[2])
+        self.max_speed = max_speed_cm_s
+        self.track = track_cm
+        self.radius = radius_cm
+        self.ir_range = ir_range_cm
+        self.stall_duty = stall_duty
+        self.motors = (right, left)  # (in1, in2, enable) pins; in2 high drives the wheel forward
+        self.updated = None
+        self.travelled = 0.0
+        self.collisions = 0
+        self.blocked = False
+
+    def attach(self, trigger=27, echo=26, ir=25):
+        ultrasonic(trigger, echo, self.distance_ahead)
+        set_input(ir, lambda t_us: self.rear_level())
+        return self
+
+    def wheel_speed(self, pins):
+        in1, in2, enable = pins
+        direction = machine._state(in2).level - machine._state(in1).level
+        duty = machine._state(enable).duty or 0
+        if duty <= self.stall_duty:
+            return 0.0
+        return direction * (duty - self.stall_duty) / (1023 - self.stall_duty) * self.max_speed
+
+    def update(self):
+        now = clock.ticks_us()
+        dt = 0 if self.updated is None else (now - self.updated) / 1000000
+        self.updated = now
+        right, left = (self.wheel_speed(pins) for pins in self.motors)
+        speed = (right + left) / 2
+        self.heading += (right - left) / self.track * dt
+        x = self.x + speed * math.cos(self.heading) * dt
+        y = self.y + speed * math.sin(self.heading) * dt
+        blocked = not self.free(x, y)
+        if blocked and not self.blocked:
+            self.collisions += 1
+        self.blocked = blocked
+        if not blocked:
+            self.travelled += math.hypot(x - self.x, y - self.y)
+            self.x, self.y = x, y
+
+    def free(self, x, y):
+        r = self.radius
+        if not (r <= x <= self.room[0] - r and r <= y <= self.room[1] - r):
+            return False
+        # The car is round: it touches a box when the box's closest point is within its radius
+        return not any((x - min(max(x, x0), x1)) ** 2 + (y - min(max(y, y0), y1)) ** 2 < r * r
+                       for x0, y0, x1, y1 in self.obstacles)
+
+    def ray(self, angle, limit=400):
+        # Distance from the car's edge to the first wall or box along angle.
+        # Rays from both sides of the car as well as the centre, so a box the
+        # car would clip with a corner is seen too.
+        dx, dy = math.cos(angle), math.sin(angle)
+        hits = [self.cast(self.x + side * -dy, self.y + side * dx, dx, dy)
+                for side in (-self.radius, 0, self.radius)]
+        distance = min(hits) - self.radius
+        return max(2.0, distance) if distance <= limit else None
+
+    def cast(self, x, y, dx, dy):
+        hits = []
+        for t in ((0 - x) / dx if dx < 0 else None, (self.room[0] - x) / dx if dx > 0 else None,
+                  (0 - y) / dy if dy < 0 else None, (self.room[1] - y) / dy if dy > 0 else None):
+            if t is not None:
+                hits.append(t)
+        for x0, y0, x1, y1 in self.obstacles:
+            # Slab test against the box
+            near, far = 0.0, float('inf')
+            for origin, direction, low, high in ((x, dx, x0, x1), (y, dy, y0, y1)):
+                if abs(direction) < 1e-9:
+                    if not low <= origin <= high:
+                        near, far = 1, 0
+                    continue
+                t0, t1 = sorted(((low - origin) / direction, (high - origin) / direction))
+                near, far = max(near, t0), min(far, t1)
+            if near <= far:
+                hits.append(near)
+        return min(hits) if hits else float('inf')
+
+    def distance_ahead(self, t_us=None):
+        self.update()
+        return self.ray(self.heading)
+
+    def rear_level(self):
+        self.update()
+        behind = self.ray(self.heading + math.pi)
+        return 0 if behind is not None and behind <= self.ir_range else 1
+
+    def to_dict(self):
+        return {"x": round(self.x, 1), "y": round(self.y, 1), "heading": round(math.degrees(self.heading) % 360, 1),
+                "travelled_cm": round(self.travelled, 1), "collisions": self.collisions}
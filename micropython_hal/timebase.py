@@ -0,0 +1,110 @@
+import heapq
+import itertools
+import math
+import selectors
+import threading
+import time
+
+
+# Time source behind utime.ticks_*, time.sleep_* and the uasyncio event loop.
+#
+# In virtual mode time only moves when the firmware sleeps (blocking or
+# awaiting) or a HAL call models a blocking duration, such as time_pulse_us.
+# Runs are deterministic and as fast as the CPU allows, and the timestamps in
+# the trace are what the board would have seen. In real mode the clock follows
+# time.perf_counter and sleeps really sleep, which is what you want when a
+# host app or browser talks to the emulated firmware.
+class Clock:
+    def __init__(self, virtual=True):
+        self.virtual = virtual
+        self.now_us = 0
+        self.origin = time.perf_counter()
+        self.timers = []  # (due_us, seq, callback) heap of scheduled pin edges
+        self.seq = itertools.count()
+        self.lock = threading.RLock()
+        self.deadline_us = None  # End of the run for firmware that never returns to uasyncio
+
+    def ticks_us(self):
+        if self.virtual:
+            return self.now_us
+        self._fire_due(int((time.perf_counter() - self.origin) * 1_000_000))
+        return int((time.perf_counter() - self.origin) * 1_000_000)
+
+    def advance(self, duration_us):
+        # Blocking sleep: in virtual mode jump ahead, firing scheduled edges in order
+        duration_us = max(0, int(duration_us))
+        if not self.virtual:
+            time.sleep(duration_us / 1_000_000)
+            self._fire_due(self.ticks_us())
+            return
+        target = self.now_us + duration_us
+        self._fire_due(target)
+        self.now_us = target
+
+    def check_deadline(self):
+        # Blocking firmware loops (while True: ... time.sleep(1)) end the way
+        # they do on the board when you press Ctrl-C
+        if self.deadline_us is not None and self.ticks_us() >= self.deadline_us:
+            raise KeyboardInterrupt
+
+    def _fire_due(self, target_us):
+        while True:
+            with self.lock:
+                if not self.timers or self.timers[0][0] > target_us:
+                    return
+                due_us, _, callback = heapq.heappop(self.timers)
+                if self.virtual:
+                    self.now_us = max(self.now_us, due_us)
+            callback()
+
+    def schedule(self, at_us, callback):
+        # Run callback once the clock reaches at_us (used for pin edges and IRQs)
+        with self.lock:
+            heapq.heappush(self.timers, (int(at_us), next(self.seq), callback))
+
+    def next_timer_us(self):
+        with self.lock:
+            return self.timers[0][0] if self.timers else None
+
+    def reset(self, virtual=None):
+        with self.lock:
+            if virtual is not None:
+                self.virtual = virtual
+            self.now_us = 0
+            self.deadline_us = None
+            self.origin = time.perf_counter()
+            self.timers = []
+
+
+# Selector for the virtual-time event loop. Ready sockets are always polled
+# first; when nothing is ready and the loop would block until its next timer,
+# the clock jumps to that timer instead of waiting for it.
+class VirtualSelector(selectors.DefaultSelector):
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        if not self.clock.virtual:
+            # Real mode still needs scheduled pin edges to fire on time
+            next_us = self.clock.next_timer_us()
+            if next_us is not None:
+                wait = max(0, (next_us - self.clock.ticks_us()) / 1_000_000)
+                timeout = wait if timeout is None else min(timeout, wait)
+            events = super().select(timeout)
+            self.clock.ticks_us()
+            return events
+
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        next_us = self.clock.next_timer_us()
+        if timeout is None and next_us is None:
+            # Nothing scheduled: only outside I/O can wake us up
+            return super().select(None)
+        step_us = math.ceil(timeout * 1_000_000) if timeout is not None else None
+        if next_us is not None:
+            edge_us = max(0, next_us - self.clock.now_us)
+            step_us = edge_us if step_us is None else min(step_us, edge_us)
+        self.clock.advance(step_us)
+        return []
@@ -0,0 +1,171 @@
+import asyncio as _asyncio
+
+from micropython_hal import clock, config
+from micropython_hal.timebase import VirtualSelector
+
+# uasyncio on top of CPython asyncio. The event loop reads time from the HAL
+# clock, so in virtual mode awaiting sleep_ms(100) costs no wall time but the
+# firmware (and the trace) sees exactly 100 ms pass.
+
+CancelledError = _asyncio.CancelledError
+TimeoutError = _asyncio.TimeoutError
+Event = _asyncio.Event
+Lock = _asyncio.Lock
+Task = _asyncio.Task
+gather = _asyncio.gather
+current_task = _asyncio.current_task
+
+_servers = []
+_tasks = set()  # CPython only keeps weak references to tasks, the MicroPython scheduler keeps them alive
+
+
+class _Loop(_asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__(VirtualSelector(clock))
+
+    def time(self):
+        return clock.ticks_us() / 1000000
+
+
+def new_event_loop():
+    loop = _Loop()
+    _asyncio.set_event_loop(loop)
+    return loop
+
+
+def get_event_loop():
+    return _asyncio.get_event_loop()
+
+
+def create_task(coro):
+    task = _asyncio.get_event_loop().create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def sleep(seconds):
+    await _asyncio.sleep(seconds)
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+
+async def wait_for(aw, timeout):
+    return await _asyncio.wait_for(aw, timeout)
+
+
+async def wait_for_ms(aw, timeout):
+    return await _asyncio.wait_for(aw, timeout / 1000)
+
+
+class ThreadSafeFlag:
+    # Set from an IRQ handler or another thread, awaited by one task
+    def __init__(self):
+        self.event = _asyncio.Event()
+        self.loop = None
+
+    def set(self):
+        loop = self.loop or _asyncio.get_event_loop()
+        loop.call_soon_threadsafe(self.event.set)
+
+    def clear(self):
+        self.event.clear()
+
+    async def wait(self):
+        self.loop = _asyncio.get_running_loop()
+        await self.event.wait()
+        self.event.clear()
+
+
+# MicroPython hands the handler one Stream object as both reader and writer
+class Stream:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def read(self, n=-1):
+        return await self.reader.read(n)
+
+    async def readline(self):
+        return await self.reader.readline()
+
+    async def readexactly(self, n):
+        return await self.reader.readexactly(n)
+
+    def write(self, buf):
+        self.writer.write(buf)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def awrite(self, buf, off=0, sz=-1):
+        self.writer.write(buf[off:] if sz == -1 else buf[off:off + sz])
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+    async def wait_closed(self):
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+    async def aclose(self):
+        self.close()
+        await self.wait_closed()
+
+    def get_extra_info(self, name):
+        return self.writer.get_extra_info(name)
+
+
+async def start_server(callback, host, port, backlog=5):
+    # 0.0.0.0 binds config.host and ports are shifted by config.port_offset
+    async def handle(reader, writer):
+        stream = Stream(reader, writer)
+        await callback(stream, stream)
+
+    if host in ('0.0.0.0', ''):
+        host = config.host
+    server = await _asyncio.start_server(handle, host, port + config.port_offset, backlog=backlog)
+    _servers.append(server)
+    return server
+
+
+async def open_connection(host, port):
+    reader, writer = await _asyncio.open_connection(host, port)
+    stream = Stream(reader, writer)
+    return stream, stream
+
+
+async def _supervise(coro):
+    main = _asyncio.ensure_future(coro)
+    for startup in config.startup:
+        create_task(startup())
+    if config.duration_s is None:
+        return await main
+    done, _ = await _asyncio.wait([main], timeout=config.duration_s)
+    if main in done:
+        return main.result()
+    main.cancel()
+    return None
+
+
+def run(coro):
+    # Runs until the firmware's main task finishes or config.duration_s has
+    # passed, then cancels whatever is still running and closes the servers
+    loop = new_event_loop()
+    try:
+        return loop.run_until_complete(_supervise(coro))
+    finally:
+        for server in _servers:
+            server.close()
+        _servers.clear()
+        tasks = [task for task in _asyncio.all_tasks(loop) if not task.done()]
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(_asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+        _asyncio.set_event_loop(None)
@@ -0,0 +1,43 @@
+import select as _select
+import socket as _socket
+from socket import *  # noqa: F401,F403
+
+from micropython_hal import clock, config
+
+
+# Blocking sockets for firmware that serves HTTP without uasyncio. bind() maps
+# 0.0.0.0 and the port like uasyncio.start_server; accept() keeps the virtual
+# clock moving with wall time while it waits, so the run still ends.
+class socket(_socket.socket):
+    def bind(self, address):
+        host, port = address[0], address[1]
+        if host in ('0.0.0.0', ''):
+            host = config.host
+        self.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+        super().bind((host, port + config.port_offset))
+
+    def accept(self):
+        if self.gettimeout() is None:
+            while not _select.select([self], [], [], 0.05)[0]:
+                if clock.virtual:
+                    clock.advance(50000)
+                clock.check_deadline()
+        return super().accept()
+
+    def write(self, data):
+        return self.send(data)
+
+    def readline(self):
+        line = b''
+        while not line.endswith(b'\n'):
+            chunk = self.recv(1)
+            if not chunk:
+                break
+            line += chunk
+        return line
+
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    return _socket.getaddrinfo(host, port, af, type, proto, flags)
+
+
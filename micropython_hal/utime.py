@@ -0,0 +1,59 @@
+import time as _time
+
+from micropython_hal import clock
+
+# utime / time for the firmware. ticks_* wrap like on the board (30-bit),
+# so ticks_diff() mistakes show up in emulation too.
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+_epoch = _time.time()
+
+
+def ticks_us():
+    return clock.ticks_us() & TICKS_MAX
+
+
+def ticks_ms():
+    return (clock.ticks_us() // 1000) & TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def sleep(seconds):
+    clock.advance(seconds * 1000000)
+    clock.check_deadline()
+
+
+def sleep_ms(ms):
+    clock.advance(ms * 1000)
+    clock.check_deadline()
+
+
+def sleep_us(us):
+    clock.advance(us)
+    clock.check_deadline()
+
+
+def time():
+    return int(_epoch + clock.ticks_us() / 1000000)
+
+
+def time_ns():
+    return int(_epoch * 1e9) + clock.ticks_us() * 1000
+
+
+localtime = _time.localtime
+gmtime = _time.gmtime
+mktime = _time.mktime
@@ -14,48 +14,50 @@ motor_left_enb = machine.PWM(machine.Pin(14))  # Use PWM for speed control
 motor_right_ena.freq(1000)  # 1 kHz
 motor_left_enb.freq(1000)  # 1 kHz
 
-# Ultrasonic sensor pins
-trigger = machine.Pin(27, machine.Pin.OUT)
-echo = machine.Pin(26, machine.Pin.IN)
+# Ultrasonic sensor on pins 27/26, timed by the echo IRQ in distancde.py
+from distancde import get_distance as measure_distance
 
 # IR sensor pin
 ir_sensor = machine.Pin(25, machine.Pin.IN)
 
-def measure_distance():
-        # Ensure trigger is low
-    trigger.off()
-    time.sleep_us(2)
+# Duty per speed percent for each motor: 1 % starts just above the deadband
+# where the motor only hums, and the trim evens out the two sides
+DEADBAND_U16 = {"right": 23000, "left": 24300}
+TRIM = {"right": 1.0, "left": 0.97}
+RAMP_STEP = 10     # Percent per step
+RAMP_STEP_MS = 25  # 0 to full speed in 250 ms
 
-    # Send a 10us pulse to trigger
-    trigger.on()
-    time.sleep_us(10)
-    trigger.off()
+def duty_table(side):
+    full = int(65535 * TRIM[side])
+    deadband = DEADBAND_U16[side]
+    return [0] + [deadband + (full - deadband) * percent // 100 for percent in range(1, 101)]
 
-    # Wait for the echo pin to go high (start of the pulse)
-    while echo.value() == 0:
-        pass
-    start = time.ticks_us()
-
-    # Wait for the echo pin to go low (end of the pulse)
-    while echo.value() == 1:
-        pass
-    end = time.ticks_us()
-
-    # Calculate the duration of the pulse
-    duration = time.ticks_diff(end, start)
-
-    # Calculate the distance (duration * speed of sound / 2)
-    distance = (duration * 0.0343) / 2
-
-    return distance
+right_duties = duty_table("right")
+left_duties = duty_table("left")
+current_speed = 0
 
 def set_speed(speed):
-    # Set PWM duty cycle for motor enable pins
-    motor_right_ena.duty_u16(int(speed * 65535 / 100))
-    motor_left_enb.duty_u16(int(speed * 65535 / 100))
+    # Ramp the enable pins to the new speed instead of jumping there
+    global current_speed
+    speed = max(0, min(100, int(speed)))
+    while current_speed != speed:
+        if speed > current_speed:
+            current_speed = min(speed, current_speed + RAMP_STEP)
+        else:
+            current_speed = max(speed, current_speed - 2 * RAMP_STEP)  # Slow down twice as fast
+        motor_right_ena.duty_u16(right_duties[current_speed])
+        motor_left_enb.duty_u16(left_duties[current_speed])
+        if current_speed != speed:
+            utime.sleep_ms(RAMP_STEP_MS)
+
+current_direction = "stop"
 
 def move(direction, speed):
-    
+    global current_direction
+    if direction != current_direction:
+        set_speed(0)  # Come to a standstill before the bridge changes direction
+        current_direction = direction
+
     if direction == "backward":
         motor_right_in1.value(1)
         motor_right_in2.value(0)
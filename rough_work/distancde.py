@@ -5,7 +5,26 @@ import time
 trigger = machine.Pin(27, machine.Pin.OUT)
 echo = machine.Pin(26, machine.Pin.IN)
 
+# The echo pin's IRQ timestamps both edges, so the pulse is timed exactly
+# and a missing echo (nothing in range, sensor unplugged) ends in a timeout
+# instead of spinning on echo.value() forever
+ECHO_TIMEOUT_MS = 30
+edges = {'rise': 0, 'pulse': -1}
+
+def on_echo(pin):
+    now = time.ticks_us()
+    if pin.value():
+        edges['rise'] = now
+    elif edges['rise']:
+        edges['pulse'] = time.ticks_diff(now, edges['rise'])
+        edges['rise'] = 0
+
+echo.irq(handler=on_echo, trigger=machine.Pin.IRQ_RISING | machine.Pin.IRQ_FALLING)
+
 def get_distance():
+    edges['rise'] = 0
+    edges['pulse'] = -1
+
     # Ensure trigger is low
     trigger.off()
     time.sleep_us(2)
@@ -15,25 +34,21 @@ def get_distance():
     time.sleep_us(10)
     trigger.off()
 
-    # Wait for the echo pin to go high (start of the pulse)
-    while echo.value() == 0:
-        pass
-    start = time.ticks_us()
-
-    # Wait for the echo pin to go low (end of the pulse)
-    while echo.value() == 1:
-        pass
-    end = time.ticks_us()
-
-    # Calculate the duration of the pulse
-    duration = time.ticks_diff(end, start)
+    # Wait for the IRQ to time the echo pulse
+    started = time.ticks_ms()
+    while edges['pulse'] < 0:
+        if time.ticks_diff(time.ticks_ms(), started) > ECHO_TIMEOUT_MS:
+            return float('inf')  # No echo
+        time.sleep_ms(1)
 
     # Calculate the distance (duration * speed of sound / 2)
-    distance = (duration * 0.0343) / 2
+    distance = (edges['pulse'] * 0.0343) / 2
 
     return distance
 
-while True:
-    distance = get_distance()
-    print("Distance: {:.2f} cm".format(distance))
-    time.sleep(1)
+# Final_Car_Configuration_Code.py imports get_distance from here
+if __name__ == '__main__':
+    while True:
+        distance = get_distance()
+        print("Distance: {:.2f} cm".format(distance))
+        time.sleep(1)
@@ -0,0 +1,75 @@
+import os
+import threading
+
+from fleet import Fleet
+from device_health import HealthMonitor
+from car_telemetry import CarTelemetry
+from telemetry_store import TelemetryStore
+from latency import LatencyRecorder
+from arm_kinematics import ReachabilityGrid
+from car_teleop import TeleopLink
+
+# Process-wide services shared by the car, arm and camera blueprints. Whether
+# the blueprints run in their own app or together in the gateway, one process
+# has one device client pool, one health monitor and one telemetry bus.
+DEVICES_FILE = os.environ.get('ROBOGARDEN_DEVICES', 'devices.json')
+TELEMETRY_DB = os.environ.get('ROBOGARDEN_TELEMETRY_DB', 'telemetry.db')
+
+_lock = threading.Lock()
+_fleet = None
+_store = None
+_telemetry = {}
+_latency = None
+_kinematics = None
+
+
+def get_fleet():
+    global _fleet
+    with _lock:
+        if _fleet is None:
+            # Boards are listed in devices.json (id, kind, address, port, capabilities)
+            _fleet = Fleet.load(DEVICES_FILE)
+            HealthMonitor(_fleet).start()  # Probes every board and opens its circuit when it is down
+        return _fleet
+
+
+def get_store():
+    global _store
+    with _lock:
+        if _store is None:
+            _store = TelemetryStore(TELEMETRY_DB)
+        return _store
+
+
+def get_telemetry(device_id):
+    # One telemetry stream + ring buffer per car, all persisted to the same store
+    device = get_fleet().get(device_id)
+    store = get_store()
+    with _lock:
+        if device_id not in _telemetry:
+            _telemetry[device_id] = CarTelemetry(device.url('/move'), store=store, device=device_id)
+        return _telemetry[device_id]
+
+
+def open_teleop(device_id):
+    # Used by session replays, whose links are not recorded again
+    return get_fleet().stream(device_id, 'teleop', None, lambda device: TeleopLink(device.address, device.port),
+                              record=False)
+
+
+def get_latency():
+    # Per-stage command latency histograms shown on /latency
+    global _latency
+    with _lock:
+        if _latency is None:
+            _latency = LatencyRecorder()
+        return _latency
+
+
+def get_kinematics():
+    # Arm IK with its reachability grid, built once (tens of ms) on first use
+    global _kinematics
+    with _lock:
+        if _kinematics is None:
+            _kinematics = ReachabilityGrid()
+        return _kinematics
@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, jsonify, request
+
+from car_telemetry import CommandRefused
+from fleet import PRIORITY_STOP, command_priority
+from load_generator import percentile
+
+# Session recording and replay. While a session is recorded, every command the
+# host sends to a board is appended to an NDJSON log, one compact array per
+# command:
+#
+#     {"session": "pick-and-place", "started": 1760000000.0, "version": 1}
+#     [0.0, "http", "arm-1", "move_shoulder_up", null]
+#     [812.4, "move", "car-1", "move", {"direction": "forward", "speed": 60}]
+#     [840.1, "teleop", "car-1", "teleop", {"throttle": 40, "steering": -10}]
+#
+# The first field is milliseconds since the session started (time.monotonic).
+# "http" commands go through Fleet.send, "move" through Fleet.stream on the
+# car's telemetry stream and "teleop" through a TeleopLink, so replay
+# re-issues each one the same way the original was sent.
+
+SESSIONS_DIR = os.environ.get('ROBOGARDEN_SESSIONS', 'sessions')
+LOG_VERSION = 1
+
+
+class SessionRecorder:
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.entries = 0
+        # Line buffered: each command is on disk as soon as it is recorded
+        self.file = open(path, 'a', buffering=1)
+        self.file.write(json.dumps({"session": self.name, "started": time.time(), "version": LOG_VERSION}) + '\n')
+
+    def record(self, kind, device_id, command, params=None):
+        t_ms = round((time.monotonic() - self.started) * 1000, 1)
+        line = json.dumps([t_ms, kind, device_id, command, params or None], separators=(',', ':'))
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line + '\n')
+                self.entries += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def to_dict(self):
+        return {"name": self.name, "path": self.path, "entries": self.entries,
+                "elapsed_s": round(time.monotonic() - self.started, 1), "recording": self.file is not None}
+
+
+def load_session(path):
+    # Returns (header, entries); a line cut short by a crash mid-write is skipped
+    header, entries = {}, []
+    with open(path) as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(item, dict):
+                header = header or item
+            elif isinstance(item, list) and len(item) == 5:
+                entries.append(item)
+    return header, entries
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 2),
+        "p50_ms": round(percentile(values, 0.5), 2),
+        "p95_ms": round(percentile(values, 0.95), 2),
+        "max_ms": round(values[-1], 2),
+    }
+
+
+# Re-issues a recorded session with the original spacing between commands,
+# divided by speed. Each device gets its own dispatch thread, so a slow
+# command (an arm move answers after the motion) holds back only that device
+# and its commands (trajectory batches, for one) keep their order. Stops skip
+# the queue like they do in Fleet, and teleop samples only hand a value to the
+# link, so they are applied on the scheduling thread. Every dispatch is
+# compared with its scheduled time: the drift report shows
+# how well the host keeps the recorded timing, which makes a replay usable as
+# a regression benchmark.
+class SessionReplayer:
+    def __init__(self, entries, fleet, get_telemetry, open_teleop, speed=1.0, device_map=None, workers=4):
+        if speed <= 0:
+            raise ValueError("Speed must be positive")
+        self.entries = entries
+        self.fleet = fleet
+        self.get_telemetry = get_telemetry  # device_id -> CarTelemetry
+        self.open_teleop = open_teleop      # device_id -> TeleopLink
+        self.speed = speed
+        self.device_map = device_map or {}
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.links = {}
+        self.drift_ms = []
+        self.response_ms = {}
+        self.errors = []
+        self.dispatched = 0
+        self.cancelled = threading.Event()
+        self.running = False
+
+    def _teleop_link(self, device_id):
+        with self.lock:
+            if device_id not in self.links:
+                self.links[device_id] = self.open_teleop(device_id)
+            return self.links[device_id]
+
+    def _dispatch(self, scheduled, kind, device_id, command, params):
+        started = time.perf_counter()
+        with self.lock:
+            self.drift_ms.append((time.monotonic() - scheduled) * 1000)
+            self.dispatched += 1
+        try:
+            if kind == 'teleop':
+                self._teleop_link(device_id).update(params['throttle'], params['steering'])
+                ok = True
+            elif kind == 'move':
+                telemetry = self.get_telemetry(device_id)
+                self.fleet.stream(device_id, command, params,
+                                  lambda device: telemetry.command(params['direction'], params['speed']),
+                                  record=False)
+                ok = True
+            else:
+                # Not recorded again when a session is being recorded meanwhile
+                result = self.fleet.send(device_id, command, params, record=False)
+                ok = result['ok']
+        except (OSError, KeyError, TypeError, ValueError, CommandRefused) as e:
+            ok = False
+            result = {"message": str(e)}
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.response_ms.setdefault(f'{kind}:{command}', []).append(elapsed_ms)
+            if not ok:
+                self.errors.append({"device": device_id, "command": command, "message": result.get('message')})
+
+    def run(self):
+        self.running = True
+        started = time.monotonic()
+        queues = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='replay-stop') as stops:
+                for t_ms, kind, device_id, command, params in self.entries:
+                    scheduled = started + t_ms / 1000 / self.speed
+                    delay = scheduled - time.monotonic()
+                    if delay > 0 and self.cancelled.wait(delay):
+                        break
+                    if self.cancelled.is_set():
+                        break
+                    device_id = self.device_map.get(device_id, device_id)
+                    args = (scheduled, kind, device_id, command, params)
+                    if kind == 'teleop':
+                        self._dispatch(*args)
+                    elif kind == 'http' and command_priority(command, params) == PRIORITY_STOP:
+                        stops.submit(self._dispatch, *args)
+                    else:
+                        if device_id not in queues:
+                            queues[device_id] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='replay')
+                        queues[device_id].submit(self._dispatch, *args)
+                for queue in queues.values():
+                    queue.shutdown(cancel_futures=self.cancelled.is_set())
+        finally:
+            for queue in queues.values():
+                queue.shutdown(cancel_futures=True)
+            for link in self.links.values():
+                link.close()  # Sends a final stop
+            self.running = False
+        return self.report()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def report(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "dispatched": self.dispatched,
+                "speed": self.speed,
+                "running": self.running,
+                "cancelled": self.cancelled.is_set(),
+                "drift": summarize(self.drift_ms),
+                "response": {name: summarize(values) for name, values in sorted(self.response_ms.items())},
+                "errors": self.errors[-20:],
+                "error_count": len(self.errors),
+            }
+
+
+def session_path(name):
+    if not name or not name.replace('_', '').replace('-', '').isalnum():
+        raise ValueError("Session names may only contain letters, digits, '-' and '_'")
+    return os.path.join(SESSIONS_DIR, name + '.ndjson')
+
+
+def make_session_blueprint(get_fleet, get_telemetry, open_teleop):
+    # One recording and one replay at a time per process. The recorder is
+    # attached to the fleet (fleet.recorder), where Fleet.send and the car
+    # routes pick it up.
+    blueprint = Blueprint('sessions', __name__)
+    state = {"replayer": None}
+
+    @blueprint.route('/api/sessions', methods=['GET'])
+    def list_sessions():
+        names = sorted(f[:-len('.ndjson')] for f in os.listdir(SESSIONS_DIR) if f.endswith('.ndjson')) \
+            if os.path.isdir(SESSIONS_DIR) else []
+        recorder = get_fleet().recorder
+        return jsonify({"sessions": names, "recording": recorder.to_dict() if recorder else None})
+
+    @blueprint.route('/api/sessions', methods=['POST'])
+    def start_recording():
+        # {"name": "pick-and-place"}; recording into an existing session appends to it
+        fleet = get_fleet()
+        data = request.get_json(silent=True) or {}
+        if fleet.recorder is not None:
+            return jsonify({"error": "Already recording", "recording": fleet.recorder.to_dict()}), 409
+        try:
+            path = session_path(data.get('name') or time.strftime('session-%Y%m%d-%H%M%S'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        os.makedirs(SESSIONS_DIR, exist_ok=True)
+        fleet.recorder = SessionRecorder(path)
+        return jsonify(fleet.recorder.to_dict()), 201
+
+    @blueprint.route('/api/sessions/current', methods=['DELETE'])
+    def stop_recording():
+        fleet = get_fleet()
+        recorder, fleet.recorder = fleet.recorder, None
+        if recorder is None:
+            return jsonify({"error": "Not recording"}), 404
+        recorder.close()
+        return jsonify(recorder.to_dict())
+
+    @blueprint.route('/api/sessions/<name>/replay', methods=['POST'])
+    def replay(name):
+        # {"speed": 2, "devices": {"car-1": "car-2"}} replays in the background;
+        # GET /api/sessions/replay shows progress and the drift report
+        data = request.get_json(silent=True) or {}
+        if state['replayer'] is not None and state['replayer'].running:
+            return jsonify({"error": "A replay is already running"}), 409
+        try:
+            _, entries = load_session(session_path(name))
+            replayer = SessionReplayer(entries, get_fleet(), get_telemetry, open_teleop,
+                                       float(data.get('speed', 1)), data.get('devices'))
+        except OSError:
+            return jsonify({"error": "Unknown session"}), 404
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        state['replayer'] = replayer
+        threading.Thread(target=replayer.run, daemon=True, name='session-replay').start()
+        return jsonify(replayer.report()), 202
+
+    @blueprint.route('/api/sessions/replay', methods=['GET'])
+    def replay_status():
+        if state['replayer'] is None:
+            return jsonify({"error": "No replay yet"}), 404
+        return jsonify(state['replayer'].report())
+
+    @blueprint.route('/api/sessions/replay', methods=['DELETE'])
+    def cancel_replay():
+        if state['replayer'] is None:
+            return jsonify({"error": "No replay yet"}), 404
+        state['replayer'].cancel()
+        return jsonify(state['replayer'].report())
+
+    return blueprint
+
+
+if __name__ == '__main__':
+    # Offline replay, e.g. against the emulator:
+    #   python esp32_emulator.py --write-devices emulated.json
+    #   python session_log.py sessions/demo.ndjson --devices emulated.json --speed 2
+    from car_telemetry import CarTelemetry
+    from car_teleop import TeleopLink
+    from fleet import Fleet
+
+    parser = argparse.ArgumentParser(description='Replay a recorded session and report timing drift')
+    parser.add_argument('session', help='NDJSON session log')
+    parser.add_argument('--devices', default='devices.json', help='devices.json of the boards to replay against')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor (2 = twice as fast)')
+    parser.add_argument('--map', action='append', default=[], metavar='RECORDED=TARGET',
+                        help='send commands recorded for one device to another')
+    args = parser.parse_args()
+
+    fleet = Fleet.load(args.devices)
+    telemetry = {}
+
+    def get_telemetry(device_id):
+        if device_id not in telemetry:
+            telemetry[device_id] = CarTelemetry(fleet.get(device_id).url('/move'), device=device_id)
+        return telemetry[device_id]
+
+    def open_teleop(device_id):
+        device = fleet.get(device_id)
+        return TeleopLink(device.address, device.port)
+
+    header, entries = load_session(args.session)
+    device_map = dict(item.split('=', 1) for item in args.map)
+    print(f"Replaying {header.get('session', args.session)}: {len(entries)} commands at {args.speed}x")
+    report = SessionReplayer(entries, fleet, get_telemetry, open_teleop, args.speed, device_map).run()
+    print(json.dumps(report, indent=4))
+    for stream in telemetry.values():
+        stream.close()
+    fleet.close()
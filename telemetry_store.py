@@ -0,0 +1,217 @@
+import sqlite3
+import threading
+import time
+
+# Numeric metrics kept per sample; direction is stored as a small code
+METRICS = ('distance', 'speed', 'direction', 'ir')
+DIRECTION_CODES = {'stop': 0, 'forward': 1, 'backward': 2, 'left': 3, 'right': 4}
+
+# Rollup resolutions in milliseconds
+RESOLUTIONS = {'1s': 1000, '1m': 60000}
+
+# How long each resolution is kept, in seconds. At one sample every 100 ms a
+# robot writes ~3 MB of raw rows per hour; rollups are 10x and 600x smaller, so
+# a week of 1 minute data for several robots takes a few megabytes.
+DEFAULT_RETENTION = {
+    'raw': 6 * 3600,
+    '1s': 2 * 24 * 3600,
+    '1m': 90 * 24 * 3600,
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    device TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    UNIQUE (device, metric)
+);
+CREATE TABLE IF NOT EXISTS raw (
+    series INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (series, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_1s (
+    series INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    min REAL, max REAL, sum REAL, count INTEGER,
+    PRIMARY KEY (series, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_1m (
+    series INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    min REAL, max REAL, sum REAL, count INTEGER,
+    PRIMARY KEY (series, bucket)
+) WITHOUT ROWID;
+'''
+
+
+def sample_values(sample):
+    # Pull the numeric metrics out of a telemetry sample, skipping missing ones
+    values = {}
+    for metric in METRICS:
+        value = sample.get(metric)
+        if metric == 'direction':
+            value = DIRECTION_CODES.get(value)
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            values[metric] = float(value)
+    return values
+
+
+# Embedded time-series store for car telemetry (SQLite, WAL mode).
+# append() only queues samples in memory; a background thread writes them in
+# one transaction per batch and updates the 1 s and 1 min min/max/mean rollups
+# at the same time, so queries never have to aggregate raw rows.
+class TelemetryStore:
+    def __init__(self, path='telemetry.db', retention=None, flush_interval=1.0,
+                 batch_size=500, prune_interval=300):
+        self.path = path
+        self.retention = dict(DEFAULT_RETENTION, **(retention or {}))
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.prune_interval = prune_interval
+        self.pending = []
+        self.lock = threading.Lock()  # Guards the pending batch only, so append() never waits on disk
+        self.db_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.series_ids = {}
+
+        self.db = self._connect()
+        self.db.executescript(SCHEMA)
+        for series_id, device, metric in self.db.execute('SELECT id, device, metric FROM series'):
+            self.series_ids[(device, metric)] = series_id
+
+        self.last_prune = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def append(self, device, sample, ts=None):
+        ts_ms = int((ts if ts is not None else sample.get('ts', time.time())) * 1000)
+        values = sample_values(sample)
+        if not values:
+            return
+        with self.lock:
+            self.pending.append((device, ts_ms, values))
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+            if time.time() - self.last_prune > self.prune_interval:
+                self.prune()
+
+    def _series_id(self, device, metric):
+        key = (device, metric)
+        if key not in self.series_ids:
+            self.db.execute('INSERT OR IGNORE INTO series (device, metric) VALUES (?, ?)', key)
+            self.series_ids[key] = self.db.execute(
+                'SELECT id FROM series WHERE device = ? AND metric = ?', key).fetchone()[0]
+        return self.series_ids[key]
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+
+        with self.db_lock, self.db:
+            raw_rows = []
+            rollups = {name: {} for name in RESOLUTIONS}
+            for device, ts_ms, values in batch:
+                for metric, value in values.items():
+                    series_id = self._series_id(device, metric)
+                    raw_rows.append((series_id, ts_ms, value))
+                    # Pre-aggregate the batch so each bucket is written once
+                    for name, width in RESOLUTIONS.items():
+                        key = (series_id, ts_ms - ts_ms % width)
+                        bucket = rollups[name].get(key)
+                        if bucket is None:
+                            rollups[name][key] = [value, value, value, 1]
+                        else:
+                            bucket[0] = min(bucket[0], value)
+                            bucket[1] = max(bucket[1], value)
+                            bucket[2] += value
+                            bucket[3] += 1
+
+            self.db.executemany('INSERT OR REPLACE INTO raw (series, ts, value) VALUES (?, ?, ?)', raw_rows)
+            for name, buckets in rollups.items():
+                self.db.executemany(
+                    f'''INSERT INTO rollup_{name} (series, bucket, min, max, sum, count)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (series, bucket) DO UPDATE SET
+                            min = MIN(min, excluded.min),
+                            max = MAX(max, excluded.max),
+                            sum = sum + excluded.sum,
+                            count = count + excluded.count''',
+                    [key + tuple(bucket) for key, bucket in buckets.items()])
+        return len(batch)
+
+    def prune(self):
+        # Apply the per-resolution retention policy
+        self.last_prune = time.time()
+        now_ms = int(self.last_prune * 1000)
+        with self.db_lock, self.db:
+            self.db.execute('DELETE FROM raw WHERE ts < ?', (now_ms - self.retention['raw'] * 1000,))
+            for name in RESOLUTIONS:
+                self.db.execute(f'DELETE FROM rollup_{name} WHERE bucket < ?',
+                                (now_ms - self.retention[name] * 1000,))
+
+    def pick_resolution(self, start, end, max_points):
+        # Finest resolution that still has data for the range and fits max_points
+        span_ms = (end - start) * 1000
+        oldest = {name: time.time() - seconds for name, seconds in self.retention.items()}
+        if span_ms / 100 <= max_points and start >= oldest['raw']:
+            return 'raw'
+        for name, width in RESOLUTIONS.items():
+            if span_ms / width <= max_points and start >= oldest[name]:
+                return name
+        return '1m'
+
+    def query(self, device, metric, start, end=None, resolution='auto', max_points=4000):
+        # Returns [[ts, value], ...] for raw data and [[ts, min, max, mean], ...]
+        # for rollups, with timestamps in seconds
+        end = time.time() if end is None else end
+        if resolution == 'auto':
+            resolution = self.pick_resolution(start, end, max_points)
+        if resolution != 'raw' and resolution not in RESOLUTIONS:
+            raise ValueError(f'Unknown resolution: {resolution}')
+
+        with self.db_lock:
+            series_id = self.series_ids.get((device, metric))
+            if series_id is None:
+                return resolution, []
+            start_ms, end_ms = int(start * 1000), int(end * 1000)
+            if resolution == 'raw':
+                rows = self.db.execute(
+                    'SELECT ts, value FROM raw WHERE series = ? AND ts BETWEEN ? AND ? ORDER BY ts',
+                    (series_id, start_ms, end_ms)).fetchall()
+                return resolution, [[ts / 1000, value] for ts, value in rows]
+            rows = self.db.execute(
+                f'''SELECT bucket, min, max, sum / count FROM rollup_{resolution}
+                    WHERE series = ? AND bucket BETWEEN ? AND ? ORDER BY bucket''',
+                (series_id, start_ms, end_ms)).fetchall()
+            return resolution, [[bucket / 1000, low, high, mean] for bucket, low, high, mean in rows]
+
+    def devices(self):
+        with self.db_lock:
+            return sorted({device for device, _ in self.series_ids})
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        self.db.close()
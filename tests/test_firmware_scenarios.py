@@ -0,0 +1,18 @@
+import glob
+import os
+
+import pytest
+
+from micropython_hal.run import load_scenario, run
+
+# Every scenario in micropython_hal/scenarios/ against the combined firmware,
+# in virtual time, so a minute of driving takes about a second
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRMWARE = os.path.join(ROOT, 'micro_conrollers', 'Full_Combined_code_car_arm.py')
+SCENARIOS = sorted(glob.glob(os.path.join(ROOT, 'micropython_hal', 'scenarios', '*.py')))
+
+
+@pytest.mark.parametrize('path', SCENARIOS, ids=os.path.basename)
+def test_scenario(path, tmp_path):
+    scenario = load_scenario(path)
+    run(FIRMWARE, getattr(scenario, 'DURATION_S', 10), scenario=scenario, flash_dir=str(tmp_path))